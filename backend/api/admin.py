@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Alias, Medicine
+
+
+class AliasInline(admin.TabularInline):
+    model = Alias
+    extra = 1
+
+
+@admin.register(Medicine)
+class MedicineAdmin(admin.ModelAdmin):
+    list_display = ('brand_name', 'generic', 'updated_at')
+    search_fields = ('brand_normalized', 'generic_normalized', 'aliases__normalized')
+    inlines = [AliasInline]
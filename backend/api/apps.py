@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+        from . import checks  # noqa: F401 (registers the system checks)
+        if getattr(settings, "PRESCRIPTION_EXTRACTOR_WARMUP", False):
+            from .extractors import warmup
+            warmup()
@@ -0,0 +1,193 @@
+# api/async_views.py
+"""
+Async versions of the OCR endpoints, routed instead of the sync views when
+serving through ``medisnap.asgi`` (see the ``ASYNC_VIEWS`` setting).
+
+Under ASGI Django runs every sync view on one shared thread, so a single
+multi-second OCR request would hold up cheap endpoints like resolve and
+suggest. Here the upload is parsed and validated on a worker thread, after
+the sync view's DRF authentication, permission and throttle checks, and
+the OCR pipeline runs on the bounded offload pool (``OCR_ASYNC_WORKERS``).
+The event loop and the sync-view thread only wait on futures, and a full
+pool answers 503 rather than queueing without limit.
+
+A batch streams its NDJSON lines from an async iterator that advances the
+batch one line at a time on the offload pool, so the lines go out as
+images finish and the batch never holds the shared sync thread.
+"""
+import asyncio
+import contextvars
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import services
+from .debug import OCRTrace, debug_requested
+from .jobs import QueueFull, async_requested, get_offload_executor
+from .serializers import BatchOCRSerializer, OCRSerializer
+from .uploads import read_upload
+from .views import (
+    QUEUE_FULL, QUEUE_FULL_HEADERS, BatchProcessView, OCRView, PrescriptionProcessView,
+    StripProcessView, batch_lines, job_submission, upload_error,
+)
+
+logger = logging.getLogger(__name__)
+
+PROCESSORS = {
+    "ocr": services.process_ocr,
+    "strip": services.process_strip,
+    "prescription": services.process_prescription,
+}
+
+# Sync views whose DRF policies (authentication, permissions, throttling,
+# parsers) the async views apply
+POLICY_VIEWS = {
+    "ocr": OCRView,
+    "strip": StripProcessView,
+    "prescription": PrescriptionProcessView,
+    "batch": BatchProcessView,
+}
+
+# How long a streaming batch waits before retrying a full offload pool
+BATCH_RETRY_INTERVAL = 0.05
+
+def _initial(kind, request):
+    """
+    Run the DRF checks the sync view's dispatch would (``APIView.initial``).
+
+    Returns:
+        tuple: ``(DRF request, None)``, or ``(None, rendered error response)``
+        when authentication, permissions or throttling reject the request
+    """
+    view = POLICY_VIEWS[kind]()
+    view.args, view.kwargs = (), {}
+    request = view.initialize_request(request)
+    view.request = request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(request)
+    except Exception as exc:
+        response = view.finalize_response(request, view.handle_exception(exc))
+        return None, response.render()
+    return request, None
+
+def _prepare(kind, request):
+    """
+    Parse and validate the upload (blocking I/O, run off the event loop).
+
+    Returns:
+        tuple: ``(bytes, trace)`` to process, or a finished response
+        (rejected by DRF checks, validation error or an ``async=1`` job
+        submission)
+    """
+    request, rejected = _initial(kind, request)
+    if rejected is not None:
+        return rejected
+    ser = OCRSerializer(data=request.data)
+    if not ser.is_valid():
+        payload, status = upload_error(request, ser.errors)
+        return JsonResponse(payload, status=status, safe=False)
+    bytes_data = read_upload(ser.validated_data["image"])
+    if async_requested(request):
+        payload, status, headers = job_submission(kind, bytes_data)
+        return JsonResponse(payload, status=status, headers=headers)
+    return bytes_data, OCRTrace() if debug_requested(request) else None
+
+async def _process(kind, request):
+    prepared = await sync_to_async(_prepare, thread_sensitive=False)(kind, request)
+    if isinstance(prepared, HttpResponse):
+        return prepared
+    bytes_data, trace = prepared
+
+    try:
+        # In a copy of this context, so lookups count towards this request's metrics
+        future = get_offload_executor().submit(
+            contextvars.copy_context().run, PROCESSORS[kind], bytes_data, trace=trace
+        )
+    except QueueFull:
+        return JsonResponse(QUEUE_FULL, status=503, headers=QUEUE_FULL_HEADERS)
+    try:
+        response = dict(await asyncio.wrap_future(future))
+    except Exception as e:
+        logger.exception("Error processing %s", kind)
+        error = "ocr_failed" if kind == "ocr" else "processing_failed"
+        return JsonResponse({"error": error, "detail": str(e)}, status=500)
+
+    if trace is not None:
+        response["debug"] = trace.as_dict()
+    return JsonResponse(response)
+
+def _prepare_batch(request):
+    """
+    Parse and validate a batch upload (blocking I/O, run off the event loop).
+
+    Returns:
+        tuple: The ``batch_lines`` arguments ``(kind, names, images)``, or a
+        finished response (rejected by DRF checks or validation error)
+    """
+    request, rejected = _initial("batch", request)
+    if rejected is not None:
+        return rejected
+    ser = BatchOCRSerializer(data=request.data)
+    if not ser.is_valid():
+        payload, status = upload_error(request, ser.errors)
+        return JsonResponse(payload, status=status, safe=False)
+    files = ser.validated_data["images"]
+    return ser.validated_data["kind"], [img.name for img in files], [read_upload(img) for img in files]
+
+async def _stream_batch(lines, context, future):
+    """
+    Yield the sync ``lines`` generator's items, each produced on the offload
+    pool; ``future`` is the step already submitted for the first one.
+    """
+    try:
+        while True:
+            line = await asyncio.wrap_future(future)
+            if line is None:
+                return
+            yield line
+            while True:
+                try:
+                    future = get_offload_executor().submit(context.run, next, lines, None)
+                    break
+                except QueueFull:
+                    # The batch is already streaming: wait for a free slot
+                    await asyncio.sleep(BATCH_RETRY_INTERVAL)
+    finally:
+        # Stop the batch if the client went away; a step still running
+        # closes the generator once it returns
+        future.add_done_callback(lambda _: lines.close())
+
+@csrf_exempt
+@require_POST
+async def ocr(request):
+    return await _process("ocr", request)
+
+@csrf_exempt
+@require_POST
+async def process_strip(request):
+    return await _process("strip", request)
+
+@csrf_exempt
+@require_POST
+async def process_prescription(request):
+    return await _process("prescription", request)
+
+@csrf_exempt
+@require_POST
+async def process_batch(request):
+    prepared = await sync_to_async(_prepare_batch, thread_sensitive=False)(request)
+    if isinstance(prepared, HttpResponse):
+        return prepared
+    lines = batch_lines(*prepared)
+
+    # In a copy of this context, so lookups count towards this request's metrics
+    context = contextvars.copy_context()
+    try:
+        future = get_offload_executor().submit(context.run, next, lines, None)
+    except QueueFull:
+        return JsonResponse(QUEUE_FULL, status=503, headers=QUEUE_FULL_HEADERS)
+    return StreamingHttpResponse(_stream_batch(lines, context, future), content_type="application/x-ndjson")
@@ -0,0 +1,385 @@
+# api/benchmarks.py
+"""
+Reproducible benchmarks for the OCR and catalog resolution pipeline.
+
+A synthetic corpus of medicine strip photos is rendered locally from the
+catalog (clean, rotated, noisy and high-resolution variants, seeded so
+every run sees the same pixels). The harness times every OCR stage, the
+resolution step, ``fuzzy_lookup`` and ``suggest``, then measures
+end-to-end ``/api/process-strip/`` throughput at several concurrency
+levels with caching off. It also records peak RSS and OCR accuracy
+against the rendered text. Run it with ``python manage.py benchmark``.
+"""
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, override_settings
+from rapidfuzz.distance import Levenshtein
+
+from . import cache, ocr_engine, services
+from .ocr_utils import PIPELINE_VERSION, ocr_image_bytes
+from .resolver import CATALOG_PATH, Catalog, fuzzy_lookup, get_catalog, normalize_query, suggest
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = ("clean", "rotated", "noisy", "highres")
+
+# Strip size at scale 1; "highres" renders at HIGHRES_SCALE times this.
+STRIP_SIZE = (900, 300)
+HIGHRES_SCALE = 4
+
+def render_strip(lines, variant, rng):
+    """
+    Render ``lines`` of text onto a foil-like strip image.
+
+    Args:
+        lines (list): Text lines; the first is drawn largest (the brand)
+        variant (str): One of VARIANTS
+        rng (numpy.random.Generator): Source of all randomness
+
+    Returns:
+        numpy.ndarray: BGR image
+    """
+    scale = HIGHRES_SCALE if variant == "highres" else 1
+    width, height = STRIP_SIZE[0] * scale, STRIP_SIZE[1] * scale
+
+    # Brushed-foil background: a vertical gradient with horizontal streaks
+    shade = np.linspace(rng.uniform(185, 215), rng.uniform(215, 240), height)[:, None]
+    streaks = rng.normal(0, 4, (1, width))
+    img = np.clip(shade + streaks, 0, 255).astype(np.uint8)
+    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    y = 0
+    for index, line in enumerate(lines):
+        font_scale = (2.0 if index == 0 else 1.1) * scale
+        thickness = (4 if index == 0 else 2) * scale
+        (w, h), baseline = cv2.getTextSize(line, cv2.FONT_HERSHEY_DUPLEX, font_scale, thickness)
+        # Shrink lines that would not fit across the strip
+        if w > width * 0.9:
+            font_scale *= width * 0.9 / w
+            (w, h), baseline = cv2.getTextSize(line, cv2.FONT_HERSHEY_DUPLEX, font_scale, thickness)
+        y += h + baseline + int(20 * scale)
+        x = int(40 * scale)
+        color = (30, 30, 120) if index == 0 else (40, 40, 40)
+        cv2.putText(img, line, (x, y), cv2.FONT_HERSHEY_DUPLEX, font_scale, color, thickness, cv2.LINE_AA)
+
+    if variant == "rotated":
+        angle = rng.uniform(-8, 8)
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        img = cv2.warpAffine(img, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    elif variant == "noisy":
+        img = cv2.GaussianBlur(img, (3, 3), 0)
+        noise = rng.normal(0, 22, img.shape)
+        img = np.clip(img + noise, 0, 255).astype(np.uint8)
+        speckle = rng.random(img.shape[:2])
+        img[speckle < 0.01] = 0
+        img[speckle > 0.99] = 255
+    return img
+
+def build_corpus(per_variant=5, seed=0, variants=VARIANTS):
+    """
+    Render ``per_variant`` strips of each variant from catalog medicines.
+
+    Returns:
+        list: Samples as dicts with ``id``, ``variant``, ``brand_name``,
+        ``lines`` (ground truth text) and ``image`` (PNG bytes)
+    """
+    catalog = get_catalog()
+    if catalog.empty:
+        raise ValueError("The catalog is empty")
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+
+    corpus = []
+    for variant in variants:
+        for i in range(per_variant):
+            row = picker.randrange(len(catalog))
+            brand = catalog.value(row, "brand_name").strip()
+            lines = [brand, catalog.value(row, "ingredients").strip() or catalog.value(row, "generic").strip()]
+            lines.append(f"{picker.choice([10, 15, 20, 30])} Tablets")
+            ok, png = cv2.imencode(".png", render_strip(lines, variant, rng))
+            corpus.append({
+                "id": f"{variant}-{i}",
+                "variant": variant,
+                "brand_name": brand,
+                "lines": lines,
+                "image": png.tobytes(),
+            })
+    return corpus
+
+def summarize(values):
+    """Latency stats in milliseconds for a list of durations in seconds."""
+    if not values:
+        return {"count": 0}
+    ms = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def catalog_memory(path=None):
+    """
+    Build a fresh, fully indexed catalog from the CSV at ``path`` (default
+    CATALOG_PATH) under tracemalloc.
+
+    Returns:
+        dict: Rows, MiB still held by the catalog afterwards, peak MiB while
+        building, and build seconds (slowed down by the tracing)
+    """
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        catalog = Catalog.from_csv(path or CATALOG_PATH).warm()
+        catalog.trigram_index
+        seconds = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "catalog_rows": len(catalog),
+        "catalog_retained_mb": round(retained / 2 ** 20, 1),
+        "catalog_build_peak_mb": round(peak / 2 ** 20, 1),
+        "catalog_build_seconds": round(seconds, 3),
+    }
+
+def char_accuracy(truth, text):
+    """1 - normalized edit distance between the expected and OCR'd text."""
+    return Levenshtein.normalized_similarity(normalize_query(" ".join(truth)), normalize_query(text))
+
+def _typo(text, rng):
+    """``text`` with one character dropped, as a misspelled query."""
+    if len(text) < 5:
+        return text
+    i = rng.randrange(1, len(text) - 1)
+    return text[:i] + text[i + 1:]
+
+def bench_catalog(corpus, stages, seed=0):
+    """Time fuzzy_lookup and suggest with queries derived from ``corpus``."""
+    rng = random.Random(seed)
+    for sample in corpus:
+        brand = sample["brand_name"]
+        for query in (brand, _typo(brand, rng)):
+            start = time.perf_counter()
+            fuzzy_lookup(query)
+            stages.setdefault("fuzzy_lookup", []).append(time.perf_counter() - start)
+        for length in (2, 4):
+            start = time.perf_counter()
+            suggest(brand[:length], fuzzy=True)
+            stages.setdefault("suggest", []).append(time.perf_counter() - start)
+
+def bench_ocr(corpus, stages, pipeline, regions):
+    """
+    OCR and resolve every sample once, recording per-stage timings.
+
+    Returns:
+        dict: Accuracy figures overall and per variant
+    """
+    by_variant = {}
+    for sample in corpus:
+        timings = {}
+        start = time.perf_counter()
+        text = ocr_image_bytes(sample["image"], pipeline=pipeline, regions=regions, timings=timings)
+        stages.setdefault("ocr_total", []).append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            stages.setdefault(f"ocr.{stage}", []).append(seconds)
+
+        start = time.perf_counter()
+        result = services.resolve_strip_text(text)
+        stages.setdefault("resolve", []).append(time.perf_counter() - start)
+
+        brands = [m["brand_name"] for m in result["medicines"]]
+        scores = by_variant.setdefault(sample["variant"], {"char": [], "top1": [], "found": [], "empty": 0})
+        scores["char"].append(char_accuracy(sample["lines"], text))
+        scores["top1"].append(bool(brands) and brands[0] == sample["brand_name"])
+        scores["found"].append(sample["brand_name"] in brands)
+        scores["empty"] += not text.strip()
+
+    def rates(scores):
+        return {
+            "samples": len(scores["char"]),
+            "char_accuracy": round(float(np.mean(scores["char"])), 4),
+            "resolve_top1": round(float(np.mean(scores["top1"])), 4),
+            "resolve_any": round(float(np.mean(scores["found"])), 4),
+            "empty_ocr": scores["empty"],
+        }
+
+    overall = {"char": [], "top1": [], "found": [], "empty": 0}
+    for scores in by_variant.values():
+        for key in ("char", "top1", "found"):
+            overall[key].extend(scores[key])
+        overall["empty"] += scores["empty"]
+    return {
+        "overall": rates(overall),
+        "by_variant": {variant: rates(scores) for variant, scores in by_variant.items()},
+    }
+
+def bench_throughput(corpus, workers, rounds=1):
+    """
+    Post the corpus to /api/process-strip/ from ``workers`` client threads,
+    with the result cache disabled so every request does the full work.
+
+    Requests go through whichever view api.urls routed when it was
+    imported (``ASYNC_VIEWS``); the test client runs async views too.
+    """
+    local = threading.local()
+    latencies = []
+    failures = []
+
+    def post(sample):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = Client()
+        upload = SimpleUploadedFile(f"{sample['id']}.png", sample["image"], "image/png")
+        start = time.perf_counter()
+        response = client.post("/api/process-strip/", {"image": upload})
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            failures.append(response.status_code)
+
+    samples = corpus * rounds
+    with override_settings(OCR_CACHE_MAX_BYTES=0):
+        cache.reset_cache()
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(post, samples))
+            elapsed = time.perf_counter() - start
+        finally:
+            cache.reset_cache()
+
+    return {
+        "workers": workers,
+        "requests": len(samples),
+        "failed": len(failures),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(samples) / elapsed, 3) if elapsed else None,
+        "latency": summarize(latencies),
+    }
+
+def ocr_available():
+    """``(True, None)`` if the OCR engine can run here, else ``(False, reason)``."""
+    try:
+        ocr_engine.recognize(np.full((32, 32), 255, dtype=np.uint8))
+    except Exception as e:
+        return False, str(e)
+    return True, None
+
+def run(per_variant=5, workers=(1, 2, 4), seed=0, variants=VARIANTS, ocr=True, pipeline=None, regions=None,
+        catalog_path=None):
+    """
+    Run the whole suite.
+
+    Args:
+        per_variant (int): Strips rendered per variant
+        workers (tuple): Concurrency levels for the throughput runs
+        seed (int): Seed for corpus rendering and query typos
+        variants (tuple): Which corpus variants to render
+        ocr (bool): Include the OCR, accuracy and throughput benchmarks
+            (which need a working Tesseract); catalog benchmarks always run
+        pipeline (str): Preprocessing pipeline (defaults to the strip one)
+        regions (bool): Crop to text regions (defaults to the strip setting)
+        catalog_path (str): CSV whose catalog memory use is measured
+            (defaults to CATALOG_PATH)
+
+    Returns:
+        dict: JSON-serializable results
+    """
+    pipeline = pipeline or services.pipeline_for("strip")
+    regions = services.regions_for("strip") if regions is None else regions
+
+    started = time.perf_counter()
+    catalog = get_catalog()
+    corpus = build_corpus(per_variant, seed, variants)
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "per_variant": per_variant,
+            "variants": list(variants),
+            "pipeline": pipeline,
+            "pipeline_version": PIPELINE_VERSION,
+            "regions": regions,
+            "catalog_version": catalog.version,
+            "catalog_size": len(catalog),
+            "catalog_source": settings.CATALOG_SOURCE,
+            "async_views": bool(getattr(settings, "ASYNC_VIEWS", False)),
+        },
+        "stages": {},
+        "throughput": [],
+    }
+
+    stages = {}
+    bench_catalog(corpus, stages, seed)
+
+    if ocr:
+        available, reason = ocr_available()
+        results["meta"]["ocr_backend"] = ocr_engine.get_backend().name
+        if not available:
+            raise RuntimeError(f"OCR engine unavailable ({reason}); rerun without OCR benchmarks")
+        results["accuracy"] = bench_ocr(corpus, stages, pipeline, regions)
+        for count in workers:
+            results["throughput"].append(bench_throughput(corpus, count))
+
+    results["stages"] = {stage: summarize(values) for stage, values in sorted(stages.items())}
+    results["memory"] = {"peak_rss_mb": peak_rss_mb(), **catalog_memory(catalog_path)}
+    results["meta"]["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return results
+
+def compare(current, baseline):
+    """
+    Per-stage p50/p95 and throughput changes against ``baseline`` results.
+
+    Returns:
+        list: ``(name, metric, baseline, current, change %)`` rows
+    """
+    rows = []
+    for stage, stats in current.get("stages", {}).items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or not before.get("count"):
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            rows.append((stage, metric, before[metric], stats[metric], _change(before[metric], stats[metric])))
+    before_runs = {run["workers"]: run for run in baseline.get("throughput", [])}
+    for run in current.get("throughput", []):
+        before = before_runs.get(run["workers"])
+        if before:
+            rows.append((
+                f"throughput@{run['workers']}", "requests_per_second",
+                before["requests_per_second"], run["requests_per_second"],
+                _change(before["requests_per_second"], run["requests_per_second"]),
+            ))
+    before_memory = baseline.get("memory", {})
+    for metric, value in current.get("memory", {}).items():
+        if before_memory.get(metric):
+            rows.append(("memory", metric, before_memory[metric], value, _change(before_memory[metric], value)))
+    return rows
+
+def _change(before, after):
+    if not before:
+        return None
+    return round((after - before) / before * 100, 1)
@@ -0,0 +1,150 @@
+# api/cache.py
+"""
+Content-addressed cache for OCR and resolution results.
+
+Keys combine a SHA-256 of the uploaded bytes with the OCR pipeline version
+(and, for resolved medicines, the catalog version), so a re-upload of the
+same photo skips OpenCV and Tesseract entirely. Entries live in an
+in-process LRU bounded by size and, optionally, in a shared Django cache
+(e.g. a ``DatabaseCache`` on SQLite) so other workers can reuse them.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Thread-safe LRU that evicts by total approximate size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+class ResultCache:
+    """Local LRU in front of an optional shared Django cache."""
+
+    def __init__(self, max_bytes, shared=None, timeout=None):
+        self.local = LRUCache(max_bytes)
+        self.shared = shared
+        self.timeout = timeout
+
+    def get(self, key):
+        value = self.local.get(key)
+        result = "local_hit"
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception:
+                logger.exception("Shared OCR cache read failed")
+                value = None
+            if value is not None:
+                self.local.set(key, value, _sizeof(value))
+                result = "shared_hit"
+        metrics.inc("ocr_cache_requests_total", result=result if value is not None else "miss")
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value, _sizeof(value))
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.timeout)
+            except Exception:
+                logger.exception("Shared OCR cache write failed")
+
+def _sizeof(value):
+    """Approximate in-memory footprint of a JSON-like value."""
+    return len(json.dumps(value, default=str))
+
+def make_key(kind, file_bytes, *parts):
+    """Cache key for ``kind`` of result computed from ``file_bytes``."""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    return ":".join(["medisnap", kind, *(str(p) for p in parts), digest])
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Return the process-wide result cache, or None when disabled.
+
+    Configured by ``OCR_CACHE_MAX_BYTES`` (0 disables caching),
+    ``OCR_CACHE_SHARED`` (an alias in ``CACHES`` to share results between
+    workers, or None) and ``OCR_CACHE_TIMEOUT`` for shared entries.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_bytes = getattr(settings, "OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+                if not max_bytes:
+                    return None
+                shared = None
+                alias = getattr(settings, "OCR_CACHE_SHARED", None)
+                if alias:
+                    from django.core.cache import caches
+                    shared = caches[alias]
+                _cache = ResultCache(
+                    max_bytes,
+                    shared=shared,
+                    timeout=getattr(settings, "OCR_CACHE_TIMEOUT", 24 * 60 * 60),
+                )
+    return _cache
+
+def reset_cache():
+    """Drop the process-wide result cache so the next use rebuilds it from settings."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+def _hit_ratio():
+    total = metrics.counter_total("ocr_cache_requests_total")
+    if not total:
+        return None
+    return 1 - metrics.counter_value("ocr_cache_requests_total", result="miss") / total
+
+metrics.describe("ocr_cache_requests_total", "Result cache lookups by outcome (local_hit, shared_hit, miss)")
+metrics.gauge("ocr_cache_hit_ratio", _hit_ratio, "Share of result cache lookups answered from a cache")
+metrics.gauge("ocr_cache_bytes", lambda: _cache and _cache.local.size, "Approximate size of this process's result LRU")
+metrics.gauge("ocr_cache_entries", lambda: _cache and len(_cache.local), "Entries in this process's result LRU")
@@ -0,0 +1,30 @@
+# api/checks.py
+"""System checks for settings the API relies on at runtime."""
+from django.conf import settings
+from django.core import checks
+
+# Cache backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+@checks.register(checks.Tags.caches)
+def check_job_cache(app_configs, **kwargs):
+    """Job state must live in a cache every web worker can read."""
+    alias = getattr(settings, "OCR_JOB_CACHE", "default")
+    if alias not in settings.CACHES:
+        return [checks.Error(f"OCR_JOB_CACHE {alias!r} is not defined in CACHES.", id="api.E001")]
+    backend = settings.CACHES[alias].get("BACKEND")
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Warning(
+            f"OCR_JOB_CACHE {alias!r} uses {backend}, which is private to each process.",
+            hint=(
+                "With more than one web worker, polls for ?async=1 jobs can reach a worker "
+                "that doesn't know the job and get a 404. Point OCR_JOB_CACHE at a shared "
+                "cache (database, file, memcached, redis), or silence api.W001 when serving "
+                "from a single process."
+            ),
+            id="api.W001",
+        )]
+    return []
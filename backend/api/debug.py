@@ -0,0 +1,78 @@
+# api/debug.py
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Single background writer so debug image I/O never blocks a request
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-debug")
+
+TRUTHY = {"1", "true", "yes", "on"}
+
+def debug_requested(request):
+    """
+    Whether OCR tracing is on for ``request``.
+
+    Enabled globally by the ``OCR_DEBUG`` setting, or per request with a
+    ``debug`` query parameter / form field set to a truthy value.
+    """
+    if getattr(settings, "OCR_DEBUG", False):
+        return True
+    flag = request.query_params.get("debug") or request.data.get("debug", "")
+    return str(flag).lower() in TRUTHY
+
+class OCRTrace:
+    """
+    Per-request record of intermediate OCR images and text.
+
+    Images are kept in memory; when ``OCR_DEBUG_DIR`` is set they are also
+    written to ``<OCR_DEBUG_DIR>/<trace id>/<stage>.png`` on a background
+    thread.
+    """
+
+    def __init__(self, trace_id=None):
+        self.id = trace_id or uuid.uuid4().hex
+        self.images = {}
+        self.texts = {}
+        self.passes = []
+        self.timings = {}
+        self.paths = []
+        self.directory = getattr(settings, "OCR_DEBUG_DIR", None)
+
+    def add_image(self, stage, image):
+        self.images[stage] = image
+        if self.directory:
+            path = os.path.join(str(self.directory), self.id, f"{stage}.png")
+            self.paths.append(path)
+            _writer.submit(_write_image, path, image)
+
+    def add_text(self, stage, text):
+        self.texts[stage] = text
+        logger.debug("[%s] %s text:\n%s", self.id, stage, text)
+
+    def add_pass(self, name, text, confidence):
+        self.passes.append({"name": name, "confidence": round(confidence, 1), "chars": len(text)})
+        self.add_text(name, text)
+
+    def as_dict(self):
+        """Summary safe to include in an API response."""
+        return {
+            "trace_id": self.id,
+            "stages": list(self.images),
+            "texts": self.texts,
+            "passes": self.passes,
+            "timings": {stage: round(seconds * 1000, 2) for stage, seconds in self.timings.items()},
+            "image_paths": self.paths,
+        }
+
+def _write_image(path, image):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, image)
+    except Exception:
+        logger.exception("Failed to write debug image %s", path)
@@ -0,0 +1,146 @@
+# api/extractors.py
+"""
+Prescription medicine extractors.
+
+``regex`` runs the hand-written patterns in ``api.resolver``. ``ner`` runs
+the spaCy BRAND/GENERIC/STRENGTH model trained by ``api/ml/train_ner.py``:
+it is loaded once per process with only the pipes NER needs, and texts are
+batched through ``nlp.pipe``. Both return medicines in the same shape.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+try:
+    import spacy
+except ImportError:  # optional dependency
+    spacy = None
+
+from .resolver import extract_medicines_from_text, parse_frequency
+
+logger = logging.getLogger(__name__)
+
+NER_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml", "ner_model")
+
+# Pipes the NER extractor needs; any others in the model are not loaded
+NER_PIPES = ("tok2vec", "ner")
+
+class RegexExtractor:
+    name = "regex"
+
+    def extract(self, texts):
+        return [extract_medicines_from_text(text) for text in texts]
+
+class NERExtractor:
+    name = "ner"
+
+    def __init__(self, path=None, batch_size=32):
+        if spacy is None:
+            raise ImportError("spaCy is not installed")
+        path = path or NER_MODEL_PATH
+        if not os.path.isdir(path):
+            raise OSError(f"No NER model at {path}; train one with api/ml/train_ner.py")
+        pipeline = spacy.util.load_config(os.path.join(path, "config.cfg"))["nlp"]["pipeline"]
+        self.nlp = spacy.load(path, exclude=[pipe for pipe in pipeline if pipe not in NER_PIPES])
+        self.batch_size = batch_size
+
+    def extract(self, texts):
+        return [
+            medicines_from_entities(doc)
+            for doc in self.nlp.pipe(texts, batch_size=self.batch_size)
+        ]
+
+def medicines_from_entities(doc):
+    """
+    Group a parsed prescription's entities into medicines shaped like
+    ``extract_medicines_from_text`` output.
+
+    A BRAND starts a new medicine, as does a GENERIC when the current one
+    already has a generic or there is none yet. STRENGTH and GENERIC
+    entities otherwise attach to the current medicine. The text between a
+    medicine's last entity and the next medicine is its instructions.
+    """
+    groups = []
+    for ent in doc.ents:
+        label = ent.label_
+        current = groups[-1] if groups else None
+        if label == "BRAND" or (label == "GENERIC" and (current is None or current["generic"])):
+            groups.append({
+                "brand_name": ent.text.strip() if label == "BRAND" else "",
+                "generic": ent.text.strip() if label == "GENERIC" else "",
+                "strength": "",
+                "start": ent.start_char,
+                "end": ent.end_char,
+            })
+        elif current is not None and label in ("GENERIC", "STRENGTH"):
+            key = "generic" if label == "GENERIC" else "strength"
+            if not current[key]:
+                current[key] = ent.text.strip()
+            current["end"] = ent.end_char
+
+    medicines = []
+    seen = set()
+    for index, group in enumerate(groups):
+        name = group["brand_name"] or group["generic"]
+        key = (name.lower(), group["strength"].lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        stop = groups[index + 1]["start"] if index + 1 < len(groups) else len(doc.text)
+        instructions = doc.text[group["end"]:stop].strip(" \t\n-")
+        medicines.append({
+            "brand_name": name,
+            "generic": group["generic"] or name,
+            "prescribed_dosage": group["strength"],
+            "prescribed_timing": parse_frequency(instructions),
+            "instructions": instructions,
+            "match_score": 1.0,
+        })
+    return medicines
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+def get_extractor():
+    """
+    Return the process-wide prescription extractor.
+
+    Chosen by the ``PRESCRIPTION_EXTRACTOR`` setting: ``"regex"``, ``"ner"``
+    or ``"auto"`` (the NER model when spaCy and a trained model are
+    available, otherwise regex).
+    """
+    global _extractor
+    if _extractor is not None:
+        return _extractor
+    with _extractor_lock:
+        if _extractor is None:
+            choice = getattr(settings, "PRESCRIPTION_EXTRACTOR", "regex")
+            path = getattr(settings, "NER_MODEL_PATH", None)
+            batch_size = getattr(settings, "NER_BATCH_SIZE", 32)
+            if choice == "regex":
+                _extractor = RegexExtractor()
+            elif choice == "ner":
+                _extractor = NERExtractor(path, batch_size)
+            else:
+                try:
+                    _extractor = NERExtractor(path, batch_size)
+                except (ImportError, OSError) as e:
+                    logger.info("NER extractor unavailable (%s), using regex", e)
+                    _extractor = RegexExtractor()
+            logger.info("Using %s prescription extractor", _extractor.name)
+    return _extractor
+
+def warmup():
+    """Load the configured extractor now (e.g. at worker start) rather than on first request."""
+    extractor = get_extractor()
+    # Run one text through so lazily built pipe state is ready too
+    extractor.extract(["Dolo 650mg once daily"])
+    return extractor
+
+def extract_medicines(texts):
+    """Extract the medicines from each prescription text, as one batch."""
+    if not texts:
+        return []
+    return get_extractor().extract(list(texts))
@@ -0,0 +1,271 @@
+# api/jobs.py
+"""
+Submit/poll job API for slow OCR work.
+
+Jobs run on a bounded local process pool, so multi-second OpenCV and
+Tesseract work doesn't hold a WSGI worker. Job state is kept in a Django
+cache (``OCR_JOB_CACHE``, file based by default) shared between processes,
+so any web worker can answer a poll. With a local-memory cache, polls must
+reach the worker that took the job, so the ``api.W001`` check warns about
+it.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics, services
+from .debug import TRUTHY
+
+logger = logging.getLogger(__name__)
+
+# Pipelines that can run as jobs, by name
+JOB_KINDS = {
+    "ocr": services.process_ocr,
+    "strip": services.process_strip,
+    "prescription": services.process_prescription,
+}
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity."""
+
+def async_requested(request):
+    """Whether ``request`` asked for submit/poll mode with ``async=1``."""
+    flag = request.query_params.get("async") or request.data.get("async", "")
+    return str(flag).lower() in TRUTHY
+
+def _init_worker(warm=False):
+    import django
+    django.setup()
+    if warm:
+        # Job workers run whole pipelines, extraction included
+        from .extractors import warmup
+        warmup()
+
+class RestartingProcessPool:
+    """
+    Process pool that replaces itself when it breaks.
+
+    A ProcessPoolExecutor is unusable for good once one of its workers dies
+    (OOM-killed, segfault in native OCR code): every later submit raises
+    BrokenProcessPool. Work already running on the broken pool fails with
+    it; the next submission starts a fresh pool.
+    """
+
+    def __init__(self, name, **kwargs):
+        self.name = name
+        self._kwargs = kwargs
+        self._executor = ProcessPoolExecutor(**kwargs)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    logger.warning("The %s process pool broke, starting a new one", self.name)
+                    metrics.inc("process_pool_restarts_total", pool=self.name)
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = ProcessPoolExecutor(**self._kwargs)
+                executor = self._executor
+            return executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+class JobManager:
+    """
+    Runs pipelines from JOB_KINDS on a process pool and tracks their state.
+
+    At most ``max_pending`` jobs may be queued or running in this process;
+    further submissions raise QueueFull so callers can apply backpressure.
+    """
+
+    def __init__(self, workers, max_pending, store, ttl):
+        self.max_pending = max_pending
+        self.store = store
+        self.ttl = ttl
+        self._executor = RestartingProcessPool(
+            "job", max_workers=workers, initializer=_init_worker, initargs=(True,)
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _key(self, job_id):
+        return f"medisnap:job:{job_id}"
+
+    def _save(self, job_id, state):
+        self.store.set(self._key(job_id), state, self.ttl)
+
+    def submit(self, kind, bytes_data):
+        """Queue ``bytes_data`` for the ``kind`` pipeline and return the job id."""
+        func = JOB_KINDS[kind]
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                raise QueueFull()
+            job_id = uuid.uuid4().hex
+            # Upload buffers can't be pickled; the worker gets its own copy
+            future = self._executor.submit(func, bytes(bytes_data))
+            self._save(job_id, {"job_id": job_id, "kind": kind, "status": "queued"})
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, kind, f))
+        return job_id
+
+    def _finish(self, job_id, kind, future):
+        state = {"job_id": job_id, "kind": kind}
+        try:
+            state["result"] = future.result()
+            state["status"] = "done"
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            state["status"] = "failed"
+            state["error"] = str(e)
+        self._save(job_id, state)
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def status(self, job_id):
+        """Current state of ``job_id``, or None if it is unknown or expired."""
+        state = self.store.get(self._key(job_id))
+        if state is None:
+            return None
+        future = self._futures.get(job_id)
+        if state["status"] == "queued" and future is not None and future.running():
+            state = dict(state, status="running")
+        return state
+
+    @property
+    def pending(self):
+        return len(self._futures)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    """
+    Return the process-wide JobManager, created on first use.
+
+    Sized by ``OCR_JOB_WORKERS`` (pool processes) and ``OCR_JOB_QUEUE_SIZE``
+    (jobs queued or running before new ones are rejected); finished job
+    state is kept for ``OCR_JOB_TTL`` seconds.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager(
+                    workers=getattr(settings, "OCR_JOB_WORKERS", 2),
+                    max_pending=getattr(settings, "OCR_JOB_QUEUE_SIZE", 16),
+                    store=caches[getattr(settings, "OCR_JOB_CACHE", "default")],
+                    ttl=getattr(settings, "OCR_JOB_TTL", 60 * 60),
+                )
+    return _manager
+
+def reset_manager():
+    """Drop the process-wide JobManager so the next use rebuilds it from settings."""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager._executor.shutdown(wait=False)
+        _manager = None
+
+_batch_executor = None
+
+def batch_workers():
+    """
+    Process count for the batch pool (``OCR_BATCH_WORKERS``).
+
+    Each worker runs up to ``OCR_PASS_WORKERS`` OCR passes at once on its
+    own pass pool, so the default is the CPU count divided by that, to keep
+    the two pools together from oversubscribing the cores.
+    """
+    configured = getattr(settings, "OCR_BATCH_WORKERS", None)
+    if configured:
+        return configured
+    return max(1, (os.cpu_count() or 1) // max(1, getattr(settings, "OCR_PASS_WORKERS", 3)))
+
+def get_batch_executor():
+    """Return the process pool used by the multi-image batch endpoint (see batch_workers)."""
+    global _batch_executor
+    if _batch_executor is None:
+        with _manager_lock:
+            if _batch_executor is None:
+                _batch_executor = RestartingProcessPool(
+                    "batch", max_workers=batch_workers(), initializer=_init_worker
+                )
+    return _batch_executor
+
+def reset_batch_executor():
+    """Drop the batch pool so the next use rebuilds it from settings."""
+    global _batch_executor
+    with _manager_lock:
+        if _batch_executor is not None:
+            _batch_executor.shutdown(wait=False)
+        _batch_executor = None
+
+class BoundedExecutor:
+    """
+    Thread pool that rejects work with QueueFull once ``max_pending`` calls
+    are queued or running, instead of letting its queue grow without limit.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-offload")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                metrics.inc("ocr_offload_rejections_total")
+                raise QueueFull()
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def pending(self):
+        return self._pending
+
+_offload_executor = None
+
+def get_offload_executor():
+    """
+    Return the thread pool the async (ASGI) views run OCR pipelines on.
+
+    Sized by ``OCR_ASYNC_WORKERS``; at most ``OCR_ASYNC_QUEUE_SIZE`` images
+    may be queued or running before requests get a 503.
+    """
+    global _offload_executor
+    if _offload_executor is None:
+        with _manager_lock:
+            if _offload_executor is None:
+                _offload_executor = BoundedExecutor(
+                    workers=getattr(settings, "OCR_ASYNC_WORKERS", 4),
+                    max_pending=getattr(settings, "OCR_ASYNC_QUEUE_SIZE", 16),
+                )
+    return _offload_executor
+
+metrics.describe("process_pool_restarts_total", "Job/batch process pools replaced after a worker died")
+metrics.describe("ocr_offload_rejections_total", "Async-view images turned away with a 503 because the offload pool was full")
+metrics.gauge(
+    "ocr_offload_pending",
+    lambda: _offload_executor and _offload_executor.pending(),
+    "Images queued or running on the async views' offload pool"
+)
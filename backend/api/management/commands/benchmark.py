@@ -0,0 +1,99 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark OCR, catalog resolution and /api/process-strip/ throughput on a "
+        "synthetic strip corpus, and save the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=5,
+                            help="Strips rendered per variant (clean, rotated, noisy, highres)")
+        parser.add_argument('--variants', nargs='+', choices=benchmarks.VARIANTS, default=list(benchmarks.VARIANTS))
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                            help="Concurrent clients for the throughput runs")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--pipeline', help="Preprocessing pipeline (defaults to OCR_PIPELINES['strip'])")
+        parser.add_argument('--catalog-csv', help="Measure the memory of the catalog built from this CSV "
+                                                  "(defaults to the seed catalog)")
+        parser.add_argument('--no-ocr', action='store_true',
+                            help="Only run the catalog benchmarks (no Tesseract needed)")
+        parser.add_argument('--output', help="Results file (defaults to benchmark-results/<timestamp>.json)")
+        parser.add_argument('--baseline', help="Earlier results file to compare against")
+        parser.add_argument('--save-corpus', metavar='DIR', help="Also write the rendered strips here")
+
+    def handle(self, images, variants, workers, seed, pipeline, catalog_csv, no_ocr, output, baseline, save_corpus,
+               **options):
+        baseline_results = None
+        if baseline:
+            try:
+                with open(baseline) as f:
+                    baseline_results = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {baseline}: {exc}")
+
+        if save_corpus:
+            os.makedirs(save_corpus, exist_ok=True)
+            for sample in benchmarks.build_corpus(images, seed, variants):
+                with open(os.path.join(save_corpus, f"{sample['id']}.png"), 'wb') as f:
+                    f.write(sample['image'])
+                with open(os.path.join(save_corpus, f"{sample['id']}.txt"), 'w') as f:
+                    f.write("\n".join(sample['lines']) + "\n")
+
+        try:
+            results = benchmarks.run(
+                per_variant=images, workers=workers, seed=seed, variants=variants,
+                ocr=not no_ocr, pipeline=pipeline, catalog_path=catalog_csv,
+            )
+        except (RuntimeError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        if not output:
+            stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+            output = os.path.join(settings.BASE_DIR, 'benchmark-results', f'benchmark-{stamp}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.report(results)
+        if baseline_results is not None:
+            self.report_changes(benchmarks.compare(results, baseline_results))
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    def report(self, results):
+        self.stdout.write(f"{'stage':<28}{'n':>6}{'p50 ms':>12}{'p95 ms':>12}")
+        for stage, stats in results['stages'].items():
+            if stats['count']:
+                self.stdout.write(f"{stage:<28}{stats['count']:>6}{stats['p50_ms']:>12.3f}{stats['p95_ms']:>12.3f}")
+        for run in results['throughput']:
+            self.stdout.write(
+                f"throughput @ {run['workers']} workers: {run['requests_per_second']} req/s "
+                f"(p95 {run['latency'].get('p95_ms')} ms, {run['failed']} failed)"
+            )
+        accuracy = results.get('accuracy')
+        if accuracy:
+            for variant, rates in [('overall', accuracy['overall']), *accuracy['by_variant'].items()]:
+                self.stdout.write(
+                    f"accuracy {variant}: chars {rates['char_accuracy']:.3f}, "
+                    f"top-1 {rates['resolve_top1']:.3f}, found {rates['resolve_any']:.3f}"
+                )
+        memory = results['memory']
+        self.stdout.write(f"peak RSS: {memory['peak_rss_mb']} MiB")
+        self.stdout.write(
+            f"catalog ({memory['catalog_rows']} rows): {memory['catalog_retained_mb']} MiB retained, "
+            f"{memory['catalog_build_peak_mb']} MiB peak while building"
+        )
+
+    def report_changes(self, rows):
+        self.stdout.write("\nChanges against baseline:")
+        for name, metric, before, after, change in rows:
+            change = "n/a" if change is None else f"{change:+.1f}%"
+            self.stdout.write(f"{name:<28}{metric:<22}{before:>12}{after:>12}{change:>10}")
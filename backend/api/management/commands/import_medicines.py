@@ -0,0 +1,57 @@
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import RECORD_FIELDS, Alias, Medicine, update_search_index
+from api.resolver import CATALOG_PATH, clean_field, normalize_query
+
+
+class Command(BaseCommand):
+    help = "Bulk-import the medicine catalog from CSV into the Medicine and Alias tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=CATALOG_PATH,
+                            help="CSV with the columns of seed_data/medicines.csv")
+        parser.add_argument('--append', action='store_true',
+                            help="Keep existing medicines instead of replacing them")
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help="Rows read and inserted per batch")
+
+    def handle(self, path, append, batch_size, **options):
+        try:
+            chunks = pd.read_csv(path, chunksize=batch_size, dtype=str, keep_default_na=False)
+        except (OSError, pd.errors.ParserError) as exc:
+            raise CommandError(f"Cannot read {path}: {exc}")
+
+        total = 0
+        with transaction.atomic():
+            if not append:
+                Medicine.objects.all().delete()
+
+            for chunk in chunks:
+                missing = set(RECORD_FIELDS) - set(chunk.columns)
+                if missing:
+                    raise CommandError(f"{path} is missing columns: {', '.join(sorted(missing))}")
+
+                rows = chunk.to_dict('records')
+                medicines = []
+                for row in rows:
+                    medicine = Medicine(**{field: str(row[field]).strip() for field in RECORD_FIELDS})
+                    medicine.normalize()
+                    medicines.append(medicine)
+                # bulk_create skips Medicine.save(); the search index is
+                # rebuilt once at the end instead
+                medicines = Medicine.objects.bulk_create(medicines, batch_size=batch_size)
+
+                aliases = []
+                for medicine, row in zip(medicines, rows):
+                    names = dict.fromkeys(a.strip() for a in str(row.get('aliases', '')).split(','))
+                    for name in names:
+                        if clean_field(name):
+                            aliases.append(Alias(medicine=medicine, name=name, normalized=normalize_query(name)))
+                Alias.objects.bulk_create(aliases, batch_size=batch_size)
+                total += len(medicines)
+
+            update_search_index()
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {total} medicines from {path}"))
@@ -0,0 +1,260 @@
+# api/metrics.py
+"""
+In-process metrics registry.
+
+Timing samples are grouped by metric name and label values and summarised
+as count / total / max (``observe``, served as JSON at /api/stage-timings/),
+so per-stage costs can be compared across requests. Counters, bucketed
+histograms and callback gauges sit alongside them, and ``render`` writes
+the whole registry in the Prometheus text format for /api/metrics/.
+
+Everything is per process: each web worker (and each OCR job process)
+keeps its own numbers, so scrape every worker.
+"""
+import contextvars
+import math
+import threading
+
+class Summary:
+    """Running count, total and maximum of observed values."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+_summaries = {}
+_summaries_lock = threading.Lock()
+
+def observe(name, value, **labels):
+    """Record ``value`` under metric ``name`` with the given labels."""
+    key = (name, tuple(sorted(labels.items())))
+    summary = _summaries.get(key)
+    if summary is None:
+        with _summaries_lock:
+            summary = _summaries.setdefault(key, Summary())
+    summary.observe(value)
+
+def snapshot():
+    """All summaries as a list of ``{"name", "labels", count/total/mean/max}``."""
+    with _summaries_lock:
+        items = list(_summaries.items())
+    return [
+        {"name": name, "labels": dict(labels), **summary.as_dict()}
+        for (name, labels), summary in sorted(items)
+    ]
+
+# Latency buckets in seconds, wide enough for multi-pass OCR on big photos
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Buckets for small per-request counts
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Counter:
+    """Monotonic total."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count, as Prometheus expects."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def cumulative(self):
+        """``(upper bound, cumulative count)`` pairs ending with ``+Inf``."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        pairs = []
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            pairs.append((bound, running))
+        pairs.append((math.inf, total))
+        return pairs
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_gauges = {}
+_help = {}
+
+def describe(name, text):
+    """Set the ``# HELP`` line for metric ``name``."""
+    _help[name] = text
+
+def _get(name, factory, labels):
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    metric = _metrics.get(key)
+    if metric is None:
+        with _metrics_lock:
+            metric = _metrics.get(key)
+            if metric is None:
+                metric = _metrics[key] = factory()
+    return metric
+
+def inc(name, amount=1, **labels):
+    """Add ``amount`` to counter ``name`` with the given labels."""
+    _get(name, Counter, labels).inc(amount)
+
+def histogram(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record ``value`` in histogram ``name``; ``buckets`` apply when it is first created."""
+    _get(name, lambda: Histogram(buckets), labels).observe(value)
+
+def gauge(name, read, help=None):
+    """
+    Register a gauge read from ``read()`` at scrape time.
+
+    ``read`` returns a number, or a list of ``(labels dict, value)`` pairs;
+    None (or an exception) leaves the gauge out of that scrape.
+    """
+    _gauges[name] = read
+    if help:
+        describe(name, help)
+
+def counter_value(name, **labels):
+    """Current value of a counter (0 if it was never incremented)."""
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    metric = _metrics.get(key)
+    return metric.value if isinstance(metric, Counter) else 0
+
+def counter_total(name):
+    """Sum of counter ``name`` across all label values."""
+    with _metrics_lock:
+        items = list(_metrics.items())
+    return sum(metric.value for (n, _), metric in items if n == name and isinstance(metric, Counter))
+
+# Lookups made while serving the current request (see track_lookups)
+_request_lookups = contextvars.ContextVar("request_lookups", default=None)
+
+def track_lookups():
+    """
+    Start tallying catalog lookups for the current request.
+
+    Returns the tally dict (``calls``, ``queries``), which ``count_lookup``
+    updates from this context and from contexts copied from it (worker
+    threads started through ``sync_to_async`` or ``copy_context``).
+    """
+    tally = {"calls": 0, "queries": 0}
+    _request_lookups.set(tally)
+    return tally
+
+def count_lookup(kind, queries=1):
+    """Record one resolver call of ``kind`` scoring ``queries`` texts."""
+    inc("resolver_lookups_total", kind=kind)
+    inc("resolver_lookup_queries_total", queries, kind=kind)
+    tally = _request_lookups.get()
+    if tally is not None:
+        tally["calls"] += 1
+        tally["queries"] += queries
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def render():
+    """The whole registry in the Prometheus text exposition format (0.0.4)."""
+    with _metrics_lock:
+        items = sorted(_metrics.items(), key=lambda item: item[0])
+    with _summaries_lock:
+        summaries = sorted(_summaries.items())
+
+    families = {}
+    for (name, labels), metric in items:
+        families.setdefault(name, []).append((labels, metric))
+
+    lines = []
+
+    def header(name, kind):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name, members in families.items():
+        if isinstance(members[0][1], Counter):
+            header(name, "counter")
+            for labels, metric in members:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(metric.value)}")
+        else:
+            header(name, "histogram")
+            for labels, metric in members:
+                for bound, count in metric.cumulative():
+                    le = (("le", _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(metric.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+
+    summary_names = []
+    for (name, labels), summary in summaries:
+        if name not in summary_names:
+            summary_names.append(name)
+            header(name, "summary")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(summary.total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {summary.count}")
+
+    for name, read in sorted(_gauges.items()):
+        try:
+            value = read()
+        except Exception:
+            continue
+        if value is None:
+            continue
+        header(name, "gauge")
+        samples = value if isinstance(value, list) else [({}, value)]
+        for labels, sample in samples:
+            lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(sample)}")
+
+    return "\n".join(lines) + "\n"
+
+def reset():
+    """Forget every counter, histogram and summary (gauges stay registered)."""
+    with _metrics_lock:
+        _metrics.clear()
+    with _summaries_lock:
+        _summaries.clear()
@@ -0,0 +1,117 @@
+# api/middleware.py
+"""
+Request metrics (latency per view and catalog lookups per request, for
+/api/metrics/) and sampled profiling of slow endpoints.
+
+Both work for the sync views and the async OCR views without pushing
+either through a thread adapter.
+"""
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, profiling
+
+metrics.describe("http_request_duration_seconds", "Request latency by view")
+metrics.describe("http_requests_total", "Requests by view, method and status")
+metrics.describe("resolver_lookups_per_request", "Resolver calls made while serving one request")
+metrics.describe("resolver_lookup_queries_per_request", "Texts looked up in the catalog while serving one request")
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+def _record(request, response, started, tally):
+    view = _view_name(request)
+    metrics.histogram(
+        "http_request_duration_seconds", time.perf_counter() - started,
+        view=view, method=request.method
+    )
+    metrics.inc("http_requests_total", view=view, method=request.method, status=response.status_code)
+    metrics.histogram("resolver_lookups_per_request", tally["calls"], metrics.COUNT_BUCKETS, view=view)
+    metrics.histogram("resolver_lookup_queries_per_request", tally["queries"], metrics.COUNT_BUCKETS, view=view)
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        tally = metrics.track_lookups()
+        response = self.get_response(request)
+        _record(request, response, started, tally)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        tally = metrics.track_lookups()
+        response = await self.get_response(request)
+        _record(request, response, started, tally)
+        return response
+
+class ProfilingMiddleware:
+    """
+    Profile a random ``PROFILE_SAMPLE_RATE`` share of requests whose path
+    starts with one of ``PROFILE_PATHS`` (see api.profiling).
+
+    Not installed at all while the rate is 0; an unsampled request costs a
+    prefix check and one random number.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.rate = getattr(settings, "PROFILE_SAMPLE_RATE", 0)
+        if not self.rate:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.paths = tuple(getattr(settings, "PROFILE_PATHS", ["/api/process-"]))
+        self.interval = getattr(settings, "PROFILE_STACK_INTERVAL", 0.01)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        """A started RequestProfile if ``request`` is sampled, else None."""
+        if not request.path.startswith(self.paths) or random.random() >= self.rate:
+            return None
+        profile = profiling.RequestProfile(self.interval)
+        if not profile.start():
+            metrics.inc("profiles_total", outcome="busy")
+            return None
+        return profile
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = self._start(request)
+        if profile is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        profiling.save(request, response, profile)
+        return response
+
+    async def __acall__(self, request):
+        profile = self._start(request)
+        if profile is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        profiling.save(request, response, profile)
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Medicine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('brand_name', models.CharField(max_length=255)),
+                ('generic', models.CharField(blank=True, max_length=255)),
+                ('ingredients', models.TextField(blank=True)),
+                ('uses', models.TextField(blank=True)),
+                ('dosage_child', models.TextField(blank=True)),
+                ('dosage_adult', models.TextField(blank=True)),
+                ('dosage_elderly', models.TextField(blank=True)),
+                ('side_effects', models.TextField(blank=True)),
+                ('layman_summary', models.TextField(blank=True)),
+                ('brand_normalized', models.CharField(db_index=True, editable=False, max_length=255)),
+                ('generic_normalized', models.CharField(db_index=True, editable=False, max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Alias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('normalized', models.CharField(db_index=True, editable=False, max_length=255)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='api.medicine')),
+            ],
+            options={
+                'verbose_name_plural': 'aliases',
+                'ordering': ['id'],
+            },
+        ),
+    ]
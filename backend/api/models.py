@@ -1,3 +1,222 @@
-from django.db import models
+import re
 
-# Create your models here.
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .resolver import normalize_query
+
+# SQLite FTS5 table mirroring each medicine's brand, generic and aliases
+# (rowid = Medicine.id), created by migration 0002 on SQLite only.
+SEARCH_TABLE = 'api_medicine_fts'
+
+# Most per-text searches joined into one statement (SQLite's default
+# SQLITE_MAX_COMPOUND_SELECT)
+MAX_COMPOUND_SELECT = 500
+
+# Catalog columns, in the order of seed_data/medicines.csv.
+RECORD_FIELDS = [
+    'brand_name', 'generic', 'ingredients', 'uses', 'dosage_child',
+    'dosage_adult', 'dosage_elderly', 'side_effects', 'layman_summary',
+]
+
+
+def has_search_table():
+    """Whether the FTS5 search table exists on this database."""
+    return connection.vendor == 'sqlite'
+
+
+def _prefix_terms(text):
+    """
+    Prefix terms for ``text``: each word, plus its first three characters
+    so misspellings past the stem ("cetrizine") still find the row.
+    Single-character words only count when there is nothing longer, so a
+    one-letter typeahead prefix still matches.
+    """
+    words = re.findall(r'\w+', text)
+    terms = []
+    for word in [word for word in words if len(word) > 1] or words:
+        terms.extend([word[:3], word])
+    return list(dict.fromkeys(terms))
+
+
+class MedicineQuerySet(models.QuerySet):
+    def exact(self, *texts):
+        """Medicines whose normalized brand, generic or alias is one of ``texts``."""
+        return self.filter(
+            models.Q(brand_normalized__in=texts)
+            | models.Q(generic_normalized__in=texts)
+            | models.Q(aliases__normalized__in=texts)
+        ).distinct()
+
+    def search_ids(self, text, limit):
+        """
+        Up to ``limit`` medicine ids sharing a word prefix with ``text``.
+
+        Uses the FTS5 table on SQLite (ranked by bm25) and the normalized
+        name indexes elsewhere.
+        """
+        return self.search_ids_batch([text], limit)
+
+    def search_ids_batch(self, texts, limit):
+        """
+        search_ids for many texts in one query.
+
+        On SQLite each text keeps its own ``limit`` best hits, as separate
+        search_ids calls would; elsewhere the texts share a limit of
+        ``limit`` per text. Ids can repeat across texts.
+        """
+        queries = [terms for terms in map(_prefix_terms, texts) if terms]
+        if not queries:
+            return []
+        if has_search_table():
+            select = (
+                f'SELECT rowid FROM (SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                'ORDER BY rank LIMIT %s)'
+            )
+            ids = []
+            with connection.cursor() as cursor:
+                for start in range(0, len(queries), MAX_COMPOUND_SELECT):
+                    chunk = queries[start:start + MAX_COMPOUND_SELECT]
+                    params = []
+                    for terms in chunk:
+                        params += [' OR '.join(f'"{term}"*' for term in terms), limit]
+                    cursor.execute(' UNION ALL '.join([select] * len(chunk)), params)
+                    ids.extend(row[0] for row in cursor.fetchall())
+            return ids
+        match = models.Q()
+        for term in {term for terms in queries for term in terms}:
+            match |= (
+                models.Q(brand_normalized__startswith=term)
+                | models.Q(generic_normalized__startswith=term)
+                | models.Q(aliases__normalized__startswith=term)
+            )
+        return list(self.filter(match).values_list('id', flat=True).distinct()[:limit * len(queries)])
+
+    def candidate_records(self, texts, limit):
+        """
+        Catalog records worth fuzzy-scoring against normalized ``texts``.
+
+        Exact name hits plus up to ``limit`` prefix-search hits per text,
+        as dicts shaped like the CSV rows, in id order. Four queries
+        whatever the number of texts: exact names, prefix search, then the
+        medicines and their aliases.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = set(self.exact(*texts).values_list('id', flat=True))
+        ids.update(self.search_ids_batch(texts, limit))
+        if not ids:
+            return []
+        medicines = self.filter(id__in=ids).order_by('id').prefetch_related('aliases')
+        return [medicine.as_record() for medicine in medicines]
+
+
+class Medicine(models.Model):
+    brand_name = models.CharField(max_length=255)
+    generic = models.CharField(max_length=255, blank=True)
+    ingredients = models.TextField(blank=True)
+    uses = models.TextField(blank=True)
+    dosage_child = models.TextField(blank=True)
+    dosage_adult = models.TextField(blank=True)
+    dosage_elderly = models.TextField(blank=True)
+    side_effects = models.TextField(blank=True)
+    layman_summary = models.TextField(blank=True)
+    brand_normalized = models.CharField(max_length=255, db_index=True, editable=False)
+    generic_normalized = models.CharField(max_length=255, db_index=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = MedicineQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.brand_name} ({self.generic})" if self.generic else self.brand_name
+
+    def normalize(self):
+        self.brand_normalized = normalize_query(self.brand_name)
+        self.generic_normalized = normalize_query(self.generic)
+
+    def save(self, *args, **kwargs):
+        self.normalize()
+        super().save(*args, **kwargs)
+        update_search_index([self.pk])
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        update_search_index([pk])
+        return result
+
+    def as_record(self):
+        """This medicine as a catalog row, with aliases comma-joined as in the CSV."""
+        record = {field: getattr(self, field) for field in RECORD_FIELDS}
+        record['aliases'] = ','.join(alias.name for alias in self.aliases.all())
+        return record
+
+
+class Alias(models.Model):
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='aliases')
+    name = models.CharField(max_length=255)
+    normalized = models.CharField(max_length=255, db_index=True, editable=False)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = 'aliases'
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        self.normalized = normalize_query(self.name)
+        super().save(*args, **kwargs)
+        self.touch_medicine(self.medicine_id)
+
+    def delete(self, *args, **kwargs):
+        medicine_id = self.medicine_id
+        result = super().delete(*args, **kwargs)
+        self.touch_medicine(medicine_id)
+        return result
+
+    @staticmethod
+    def touch_medicine(medicine_id):
+        """
+        Mark the medicine as updated (aliases are part of its catalog row,
+        and catalog_version follows Medicine.updated_at) and reindex it.
+        """
+        Medicine.objects.filter(pk=medicine_id).update(updated_at=timezone.now())
+        update_search_index([medicine_id])
+
+
+def update_search_index(ids=None):
+    """
+    Refresh the FTS5 rows of the medicines in ``ids`` (all medicines if None).
+
+    A no-op on databases without the search table. Rows of deleted
+    medicines are dropped.
+    """
+    if not has_search_table():
+        return
+    medicines = Medicine.objects.prefetch_related('aliases')
+    with transaction.atomic(), connection.cursor() as cursor:
+        if ids is None:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        else:
+            ids = [pk for pk in ids if pk is not None]
+            if not ids:
+                return
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(ids))})',
+                ids
+            )
+            medicines = medicines.filter(id__in=ids)
+        rows = (
+            (medicine.id, ' '.join([
+                medicine.brand_normalized,
+                medicine.generic_normalized,
+                *(alias.normalized for alias in medicine.aliases.all()),
+            ]))
+            for medicine in medicines.iterator(chunk_size=2000)
+        )
+        cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, names) VALUES (%s, %s)', rows)
@@ -0,0 +1,266 @@
+# api/ocr_engine.py
+"""
+OCR backends.
+
+``tesserocr`` keeps one initialised Tesseract handle per worker thread and
+feeds it numpy buffers directly, so there is no process spawn, temp file or
+model reload per call. ``pytesseract`` shells out to the ``tesseract`` CLI
+and is used when tesserocr is unavailable.
+
+``recognize`` takes an optional ``cancel`` event so callers racing several
+passes can stop the losers: the pytesseract backend kills the CLI as soon
+as it is set, tesserocr skips calls that have not started yet.
+"""
+import logging
+import shlex
+import subprocess
+import threading
+import time
+
+import numpy as np
+import pytesseract
+from django.conf import settings
+
+try:
+    import tesserocr
+except ImportError:  # optional dependency
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+# Configure Tesseract path if needed (pytesseract backend)
+# pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+
+# Tesseract variables that only take effect when the engine is initialised
+INIT_ONLY_VARIABLES = {"load_system_dawg", "load_freq_dawg", "user_words_file"}
+
+# How often a running tesseract CLI is checked for cancellation
+CANCEL_POLL_INTERVAL = 0.05
+
+class Cancelled(RuntimeError):
+    """OCR was stopped through its ``cancel`` event."""
+
+def parse_config(config):
+    """
+    Split a Tesseract CLI config string into its parts.
+
+    Returns:
+        tuple: ``(oem, psm, variables)`` where ``oem``/``psm`` are ints or
+        None and ``variables`` maps Tesseract variable names to values
+    """
+    oem = psm = None
+    variables = {}
+    args = shlex.split(config or "")
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        value = args[i + 1] if i + 1 < len(args) else ""
+        if arg == "--oem":
+            oem = int(value)
+        elif arg == "--psm":
+            psm = int(value)
+        elif arg == "--user-words":
+            variables["user_words_file"] = value
+        elif arg == "-c":
+            key, _, val = value.partition("=")
+            variables[key] = val
+        else:
+            i += 1
+            continue
+        i += 2
+    return oem, psm, variables
+
+def _as_array(image):
+    """Return ``image`` (numpy array or PIL image) as a contiguous uint8 array."""
+    if getattr(image, "mode", None) not in (None, "L", "RGB", "RGBA"):
+        image = image.convert("RGB")
+    return np.ascontiguousarray(np.asarray(image), dtype=np.uint8)
+
+class PytesseractBackend:
+    """Runs the ``tesseract`` CLI through pytesseract for every call."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang="eng"):
+        self.lang = lang
+
+    def image_to_string(self, image, config=""):
+        return pytesseract.image_to_string(image, lang=self.lang, config=config)
+
+    def recognize(self, image, config="", timeout=None, cancel=None):
+        """
+        OCR ``image`` and report Tesseract's mean word confidence.
+
+        The CLI is killed after ``timeout`` seconds (raising RuntimeError)
+        or as soon as ``cancel`` is set (raising Cancelled).
+
+        Returns:
+            tuple: ``(text, mean confidence 0-100)``
+        """
+        data = pytesseract.pytesseract.file_to_dict(self._run_tsv(image, config, timeout, cancel), "\t", -1)
+        lines = {}
+        confidences = []
+        for i, word in enumerate(data["text"]):
+            if not word.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            lines.setdefault(key, []).append(word)
+            conf = float(data["conf"][i])
+            if conf >= 0:
+                confidences.append(conf)
+        text = "\n".join(" ".join(words) for words in lines.values())
+        return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+    def _run_tsv(self, image, config, timeout, cancel):
+        """
+        Run the CLI like ``pytesseract.image_to_data`` and return its TSV.
+
+        pytesseract only offers a fixed timeout, so the process is started
+        here and polled, to be killed when ``cancel`` is set.
+        """
+        tess = pytesseract.pytesseract
+        config = f"-c tessedit_create_tsv=1 {config.strip()}"
+        deadline = time.monotonic() + timeout if timeout else None
+        with tess.save(image) as (output_base, input_path):
+            args = [tess.tesseract_cmd, input_path, output_base, "-l", self.lang, *shlex.split(config)]
+            proc = subprocess.Popen(args, **tess.subprocess_args())
+            while True:
+                waits = [CANCEL_POLL_INTERVAL] if cancel is not None else []
+                if deadline is not None:
+                    waits.append(max(0.0, deadline - time.monotonic()))
+                try:
+                    _, errors = proc.communicate(timeout=min(waits, default=None))
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel is not None and cancel.is_set():
+                        proc.kill()
+                        proc.communicate()
+                        raise Cancelled("Tesseract run cancelled")
+                    if deadline is not None and time.monotonic() >= deadline:
+                        proc.kill()
+                        proc.communicate()
+                        raise RuntimeError("Tesseract process timeout")
+            if proc.returncode:
+                raise tess.TesseractError(proc.returncode, tess.get_errors(errors))
+            with open(f"{output_base}.tsv", "rb") as f:
+                return f.read().decode("utf-8")
+
+class TesserocrBackend:
+    """
+    In-process Tesseract through tesserocr.
+
+    Each thread lazily creates and keeps its own ``PyTessBaseAPI`` handles
+    (Tesseract handles are not thread-safe), one per OEM and set of
+    init-only variables. Page segmentation mode and runtime variables are
+    applied per call.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang="eng", path=None):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed")
+        self.lang = lang
+        self.path = path
+        self._local = threading.local()
+        # Fail fast if the language data can't be found
+        self._handle(None, {})
+
+    def _handle(self, oem, init_variables):
+        handles = getattr(self._local, "handles", None)
+        if handles is None:
+            handles = self._local.handles = {}
+        key = (oem, tuple(sorted(init_variables.items())))
+        api = handles.get(key)
+        if api is None:
+            kwargs = {"lang": self.lang, "variables": dict(init_variables)}
+            if self.path:
+                kwargs["path"] = self.path
+            if oem is not None:
+                kwargs["oem"] = tesserocr.OEM(oem)
+            api = handles[key] = tesserocr.PyTessBaseAPI(**kwargs)
+        return api
+
+    def _run(self, image, config, read):
+        oem, psm, variables = parse_config(config)
+        init_variables = {k: v for k, v in variables.items() if k in INIT_ONLY_VARIABLES}
+        runtime_variables = {k: v for k, v in variables.items() if k not in INIT_ONLY_VARIABLES}
+        api = self._handle(oem, init_variables)
+        # Runtime variables persist on the handle; restore them after the call
+        previous = {key: api.GetVariableAsString(key) for key in runtime_variables}
+        try:
+            api.SetPageSegMode(tesserocr.PSM(psm if psm is not None else tesserocr.PSM.AUTO))
+            for key, value in runtime_variables.items():
+                api.SetVariable(key, value)
+            data = _as_array(image)
+            height, width = data.shape[:2]
+            channels = 1 if data.ndim == 2 else data.shape[2]
+            api.SetImageBytes(data.tobytes(), width, height, channels, width * channels)
+            return read(api)
+        finally:
+            api.Clear()
+            for key, value in previous.items():
+                if value is not None:
+                    api.SetVariable(key, value)
+
+    def image_to_string(self, image, config=""):
+        return self._run(image, config, lambda api: api.GetUTF8Text())
+
+    def recognize(self, image, config="", timeout=None, cancel=None):
+        """
+        OCR ``image`` and report Tesseract's mean word confidence.
+
+        Recognition is abandoned after ``timeout`` seconds (raising
+        RuntimeError). Tesseract can't be interrupted from outside, so
+        ``cancel`` only stops calls that haven't started recognising yet
+        (raising Cancelled); running ones are bounded by ``timeout``.
+
+        Returns:
+            tuple: ``(text, mean confidence 0-100)``
+        """
+        def read(api):
+            if cancel is not None and cancel.is_set():
+                raise Cancelled("Tesseract run cancelled")
+            if not api.Recognize(int(timeout * 1000) if timeout else 0):
+                raise RuntimeError("Tesseract recognition timed out")
+            return api.GetUTF8Text(), float(api.MeanTextConf())
+        return self._run(image, config, read)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    Return the process-wide OCR backend.
+
+    Chosen by the ``OCR_BACKEND`` setting: ``"tesserocr"``, ``"pytesseract"``
+    or ``"auto"`` (tesserocr when it is installed and initialises, otherwise
+    pytesseract).
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            choice = getattr(settings, "OCR_BACKEND", "auto")
+            lang = getattr(settings, "OCR_LANG", "eng")
+            if choice == "pytesseract":
+                _backend = PytesseractBackend(lang=lang)
+            elif choice == "tesserocr":
+                _backend = TesserocrBackend(lang=lang)
+            else:
+                try:
+                    _backend = TesserocrBackend(lang=lang)
+                except Exception as e:
+                    logger.info("tesserocr unavailable (%s), using pytesseract", e)
+                    _backend = PytesseractBackend(lang=lang)
+            logger.info("Using %s OCR backend", _backend.name)
+    return _backend
+
+def image_to_string(image, config=""):
+    """Run OCR on a numpy or PIL image with a Tesseract CLI style ``config``."""
+    return get_backend().image_to_string(image, config=config)
+
+def recognize(image, config="", timeout=None, cancel=None):
+    """Run OCR and return ``(text, mean confidence 0-100)``."""
+    return get_backend().recognize(image, config=config, timeout=timeout, cancel=cancel)
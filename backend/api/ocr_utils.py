@@ -1,13 +1,30 @@
 # api/ocr_utils.py
 import cv2
 import numpy as np
-import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance
 import io
-import re
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-# Configure Tesseract path if needed
-# pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+from django.conf import settings
+
+from . import metrics, ocr_engine
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("ocr_images_total", "Images run through ocr_image_bytes")
+metrics.describe("ocr_stage_duration_seconds", "Wall time per preprocessing/OCR stage")
+metrics.describe("ocr_pass_results_total", "Finished OCR passes by outcome (text, empty, failed)")
+metrics.describe("ocr_pass_selected_total", "Images by the OCR pass whose text was kept")
+metrics.describe("ocr_pass_timeouts_total", "Images whose OCR passes or region crops hit OCR_PASS_TIMEOUT")
+metrics.describe("ocr_fallbacks_total", "Images read by a fallback (psm4, basic, whole_image, basic_ocr)")
+
+# Bump whenever preprocessing or OCR settings change so cached results
+# computed by an older pipeline are not reused.
+PIPELINE_VERSION = 6
 
 def enhance_image(img):
     """Apply various image enhancements to improve OCR accuracy."""
@@ -58,8 +75,8 @@ def correct_skew(image):
     if lines is not None and len(lines) > 0:
         # Calculate angles of lines
         angles = []
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
+        for line in lines.reshape(-1, 4):
+            x1, y1, x2, y2 = line
             angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
             angles.append(angle)
         
@@ -75,55 +92,192 @@ def correct_skew(image):
     
     return image
 
-def preprocess_image_bytes(file_bytes):
-    """Preprocess image for better OCR results."""
-    # Convert bytes to numpy array
-    nparr = np.frombuffer(file_bytes, np.uint8)
-    
-    # Read image with OpenCV
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if img is None:
-        raise ValueError("Invalid image")
-    
-    # Store original dimensions for later use
-    original_height, original_width = img.shape[:2]
-    
-    # Resize if image is too large (better for performance and OCR)
-    max_dimension = 2000
-    scale = min(max_dimension/original_width, max_dimension/original_height, 1.0)
+def resize_image(img, max_dimension=2000):
+    """Downscale so neither side exceeds ``max_dimension`` pixels."""
+    height, width = img.shape[:2]
+    scale = min(max_dimension/width, max_dimension/height, 1.0)
     if scale < 1.0:
         img = cv2.resize(img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-    
-    # Enhance image quality
-    img = enhance_image(img)
-    
-    # Convert to grayscale for further processing
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Apply adaptive thresholding
-    thresh = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY, 31, 5
+    return img
+
+def to_grayscale(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+def adaptive_threshold(img, block_size=11, c=2):
+    return cv2.adaptiveThreshold(
+        img, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, block_size, c
     )
-    
-    # Remove noise
-    denoised = remove_noise(thresh)
-    
-    # Correct skew
-    deskewed = correct_skew(denoised)
-    
-    # Apply morphological operations to clean up the image
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-    morph = cv2.morphologyEx(deskewed, cv2.MORPH_CLOSE, kernel)
-    morph = cv2.morphologyEx(morph, cv2.MORPH_OPEN, kernel)
-    
-    # Apply sharpening
+
+def dilate(img, size=2, iterations=1):
+    """Dilate to connect text components."""
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+    return cv2.dilate(img, kernel, iterations=iterations)
+
+def morphology(img, size=2):
+    """Close then open to clean up speckles and gaps."""
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+    img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel)
+    return cv2.morphologyEx(img, cv2.MORPH_OPEN, kernel)
+
+def sharpen(img):
     kernel = np.array([[-1,-1,-1], 
                        [-1, 9,-1],
                        [-1,-1,-1]])
-    sharpened = cv2.filter2D(morph, -1, kernel)
-    
-    return sharpened
+    return cv2.filter2D(img, -1, kernel)
+
+def estimate_skew(gray, proxy_dimension=500):
+    """
+    Estimate skew in degrees from a downscaled proxy of ``gray``.
+
+    Same Hough-line approach as correct_skew, with line lengths scaled to
+    the proxy, so it costs a fraction of running it at full resolution.
+    Near-vertical lines are ignored.
+    """
+    proxy = resize_image(gray, proxy_dimension)
+    scale = proxy.shape[1] / gray.shape[1]
+    thresh = cv2.threshold(proxy, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    lines = cv2.HoughLinesP(
+        thresh, 1, np.pi/180, max(30, int(100 * scale)),
+        minLineLength=max(20, int(100 * scale)), maxLineGap=max(3, int(10 * scale))
+    )
+    if lines is None:
+        return 0.0
+    x1, y1, x2, y2 = lines.reshape(-1, 4).T
+    angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    angles = angles[np.abs(angles) < 45]
+    return float(np.median(angles)) if len(angles) else 0.0
+
+def estimate_noise(gray, patch_size=512):
+    """
+    Estimate the noise standard deviation of ``gray`` (Immerkaer's method).
+
+    Measured on a full-resolution centre patch rather than a downscaled
+    proxy, since downscaling averages the noise away.
+    """
+    height, width = gray.shape[:2]
+    top = max(0, (height - patch_size) // 2)
+    left = max(0, (width - patch_size) // 2)
+    patch = gray[top:top + patch_size, left:left + patch_size].astype(np.float32)
+    if min(patch.shape) < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = np.abs(cv2.filter2D(patch, -1, kernel)[1:-1, 1:-1])
+    return float(np.sqrt(np.pi / 2) * response.sum() / (6 * response.size))
+
+def auto_deskew(img, min_angle=0.5, proxy_dimension=500):
+    """Rotate once by the proxy-estimated skew, only if it exceeds ``min_angle`` degrees."""
+    angle = estimate_skew(to_grayscale(img), proxy_dimension)
+    if abs(angle) <= min_angle:
+        return img
+    (h, w) = img.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def auto_denoise(img, min_sigma=4.0):
+    """Denoise with non-local means scaled to the estimated noise, only if it exceeds ``min_sigma``."""
+    sigma = estimate_noise(to_grayscale(img))
+    if sigma <= min_sigma:
+        return img
+    h = min(15.0, 1.2 * sigma)
+    if img.ndim == 3:
+        return cv2.fastNlMeansDenoisingColored(img, None, h, h, 7, 21)
+    return cv2.fastNlMeansDenoising(img, None, h, 7, 21)
+
+# Preprocessing stages by name; each takes and returns an image
+PREPROCESS_STAGES = {
+    "resize": resize_image,
+    "enhance": enhance_image,
+    "grayscale": to_grayscale,
+    "adaptive_threshold": adaptive_threshold,
+    "denoise": remove_noise,
+    "deskew": correct_skew,
+    "auto_deskew": auto_deskew,
+    "auto_denoise": auto_denoise,
+    "dilate": dilate,
+    "morphology": morphology,
+    "sharpen": sharpen,
+}
+
+# Named pipelines: lists of stage names or (stage name, params) pairs.
+# Endpoints pick one through the OCR_PIPELINES setting.
+#
+# "full" and "fast" first cap images at 2000px a side, which bounds the
+# cost of the later stages on phone photos. The default "standard" and
+# "strip" pipelines keep full resolution until the cap is shown not to
+# cost accuracy on the highres benchmark variant
+# (`manage.py benchmark --pipeline fast --baseline <standard results>`).
+PIPELINES = {
+    # Heavy cleanup for poor photos
+    "full": [
+        ("resize", {"max_dimension": 2000}),
+        "enhance",
+        "grayscale",
+        ("adaptive_threshold", {"block_size": 31, "c": 5}),
+        "denoise",
+        "deskew",
+        "morphology",
+        "sharpen",
+    ],
+    # Resolution-aware equivalent of "full": downscale first, then deskew
+    # and denoise only when estimates from a proxy say they are needed.
+    # Not used by any endpoint by default
+    "fast": [
+        ("resize", {"max_dimension": 2000}),
+        "grayscale",
+        "auto_deskew",
+        "auto_denoise",
+        ("adaptive_threshold", {"block_size": 31, "c": 5}),
+        "morphology",
+    ],
+    # Default for ocr/strip/prescription uploads
+    "standard": [
+        "grayscale",
+        ("adaptive_threshold", {"block_size": 11, "c": 2}),
+        "dilate",
+    ],
+    # Threshold only, as used by ocr_strip_image
+    "strip": [
+        "grayscale",
+        ("adaptive_threshold", {"block_size": 11, "c": 2}),
+    ],
+}
+
+def decode_image(file_bytes):
+    """Decode uploaded bytes into a BGR image."""
+    nparr = np.frombuffer(file_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Invalid image")
+    return img
+
+def preprocess(img, pipeline="standard", timings=None, trace=None):
+    """
+    Run the named preprocessing pipeline over a decoded image.
+
+    Wall time per stage is added to ``timings`` (stage name -> seconds)
+    when given; with a ``trace`` each stage's output image is kept too.
+    """
+    for step in PIPELINES[pipeline]:
+        name, params = (step, {}) if isinstance(step, str) else step
+        start = time.perf_counter()
+        img = PREPROCESS_STAGES[name](img, **params)
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
+        if trace is not None:
+            trace.add_image(name, img)
+    return img
+
+def record_timings(pipeline, timings):
+    """Aggregate one request's stage timings into the process metrics."""
+    for stage, seconds in timings.items():
+        metrics.observe("ocr_stage_seconds", seconds, pipeline=pipeline, stage=stage)
+        metrics.histogram("ocr_stage_duration_seconds", seconds, pipeline=pipeline, stage=stage)
+
+def preprocess_image_bytes(file_bytes):
+    """Preprocess image for better OCR results."""
+    return preprocess(decode_image(file_bytes), "full")
 
 def postprocess_text(text):
     """Clean and format the extracted text."""
@@ -154,19 +308,7 @@ def postprocess_text(text):
 def ocr_strip_image(file_bytes):
     """Process strip images with specialized settings for medicine strip recognition."""
     try:
-        # Convert bytes to image
-        nparr = np.frombuffer(file_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply adaptive thresholding
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, 
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
-        )
+        thresh = preprocess(decode_image(file_bytes), "strip")
         
         # Use a more permissive OCR configuration for strip images
         custom_config = (
@@ -177,107 +319,374 @@ def ocr_strip_image(file_bytes):
         )
         
         # Perform OCR
-        text = pytesseract.image_to_string(thresh, config=custom_config.strip())
+        text = ocr_engine.image_to_string(thresh, config=custom_config.strip())
         
         # Clean up the text
         cleaned_text = postprocess_text(text)
         
         return cleaned_text
         
-    except Exception as e:
-        print(f"Error in ocr_strip_image: {str(e)}")
+    except Exception:
+        logger.exception("Error in ocr_strip_image")
         # Fall back to regular OCR if strip-specific processing fails
         return ocr_image_bytes(file_bytes)
 
-def ocr_image_bytes(file_bytes):
-    """Extract text from image using Tesseract with optimized settings and detailed logging."""
-    print("\n" + "="*80)
-    print("STARTING OCR PROCESSING")
-    print("="*80)
+# Tesseract config for the optimized passes
+OCR_CONFIG = (
+    '--oem 3 '  # LSTM + Legacy OCR Engine
+    '--psm 6 '   # Assume a single uniform block of text
+    '-c preserve_interword_spaces=1 '  # Preserve spaces between words
+    '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-+/.()[],:;% '  # Whitelist common medical characters
+    '--user-words ./api/seed_data/medical_terms.txt '  # Custom dictionary
+    '-c load_system_dawg=1 '  # Load system dictionary
+    '-c load_freq_dawg=1 '    # Load frequent words dictionary
+    '-c textord_min_linesize=2.0 '  # Minimum line size
+).strip()
+
+_pass_executor = None
+_pass_executor_pid = None
+_pass_executor_lock = threading.Lock()
+
+def _get_pass_executor():
+    """Thread pool for OCR passes (recreated after a fork, e.g. in job workers)."""
+    global _pass_executor, _pass_executor_pid
+    if _pass_executor is None or _pass_executor_pid != os.getpid():
+        with _pass_executor_lock:
+            if _pass_executor is None or _pass_executor_pid != os.getpid():
+                _pass_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "OCR_PASS_WORKERS", 3),
+                    thread_name_prefix="ocr-pass",
+                )
+                _pass_executor_pid = os.getpid()
+    return _pass_executor
+
+def reset_pass_executor():
+    """Drop the pass thread pool so the next use rebuilds it from settings."""
+    global _pass_executor
+    with _pass_executor_lock:
+        if _pass_executor is not None:
+            _pass_executor.shutdown(wait=False)
+        _pass_executor = None
+
+# Slack past a call's budget before its result is given up on (the engine
+# itself stops at the budget; this covers killing the process)
+PASS_TIMEOUT_GRACE = 0.5
+
+# How often a waiting request rechecks budgets while its calls are queued
+PASS_POLL_INTERVAL = 0.05
+
+class OCRCalls:
+    """
+    One request's OCR calls on the shared pass pool.
+
+    A call's ``timeout`` budget starts when it starts running, not when it
+    is queued, so calls waiting behind other requests' work don't time out
+    for it. With ``shared``, all calls share one budget that starts with the
+    first of them (for many small calls, such as region crops).
+
+    ``stop`` sets a cancel flag shared by the calls: queued ones are
+    skipped and running ones are stopped by the engine (see
+    ocr_engine.recognize), so they don't hold pool threads for later
+    requests.
+    """
+
+    def __init__(self, timeout, shared=False):
+        self.timeout = timeout
+        self.shared = shared
+        self.cancel = threading.Event()
+        self._futures = {}
+        self._started = {}
+        self._first_start = None
+        self._lock = threading.Lock()
+
+    def submit(self, key, image, config):
+        """Queue ``recognize`` for ``image``; ``key`` (sortable) identifies the call."""
+        future = _get_pass_executor().submit(self._recognize, key, image, config)
+        self._futures[future] = key
+        return future
+
+    def _recognize(self, key, image, config):
+        if self.cancel.is_set():
+            raise ocr_engine.Cancelled("OCR call dropped before it started")
+        now = time.monotonic()
+        with self._lock:
+            self._started[key] = now
+            if self._first_start is None:
+                self._first_start = now
+        timeout = self.timeout
+        if timeout and self.shared:
+            timeout = self._first_start + self.timeout - now
+            if timeout <= 0:
+                raise ocr_engine.Cancelled("OCR budget used up before the call started")
+        return ocr_engine.recognize(image, config, timeout, cancel=self.cancel)
+
+    def _deadline(self, key):
+        start = self._first_start if self.shared else self._started.get(key)
+        return None if start is None else start + self.timeout + PASS_TIMEOUT_GRACE
+
+    def as_completed(self):
+        """
+        Yield ``(key, future)`` as calls finish.
+
+        Raises:
+            TimeoutError: A started call overran its budget
+        """
+        pending = set(self._futures)
+        while pending:
+            deadlines = [self._deadline(self._futures[f]) for f in pending] if self.timeout else []
+            running = [deadline for deadline in deadlines if deadline is not None]
+            wait_for = min(running) - time.monotonic() if running else PASS_POLL_INTERVAL
+            done, pending = wait(pending, timeout=max(0.0, min(wait_for, PASS_POLL_INTERVAL)), return_when=FIRST_COMPLETED)
+            # Calls finishing together come back in submission order
+            for future in sorted(done, key=self._futures.get):
+                yield self._futures[future], future
+            if running and not done and time.monotonic() >= min(running):
+                raise TimeoutError()
+
+    def stop(self):
+        """Cancel whatever is still queued or running."""
+        self.cancel.set()
+        for future in self._futures:
+            future.cancel()
+
+def ocr_passes(preprocessed, original):
+    """Alternative OCR passes for an image as ``(name, image, config)``, in priority order."""
+    return [
+        ("psm6", preprocessed, OCR_CONFIG),
+        ("psm4", preprocessed, OCR_CONFIG.replace('--psm 6', '--psm 4')),  # Assume a single column of text
+        ("basic", original, ""),  # Plain Tesseract on the unprocessed image
+    ]
+
+def run_passes(passes, min_confidence=None, timeout=None, trace=None):
+    """
+    Run OCR passes concurrently and pick the best result.
+
+    Passes are scheduled on a shared thread pool in priority order. As soon
+    as one returns text with a mean confidence of at least
+    ``min_confidence`` (``OCR_PASS_MIN_CONFIDENCE``) the rest are stopped;
+    otherwise the highest-confidence non-empty result wins. No pass runs
+    longer than ``timeout`` seconds (``OCR_PASS_TIMEOUT``) from when it
+    starts, which bounds the worst case on hard images.
+
+    Returns:
+        tuple: ``(pass name, cleaned text, confidence)``; name is None when
+        every pass came back empty
+    """
+    if min_confidence is None:
+        min_confidence = getattr(settings, "OCR_PASS_MIN_CONFIDENCE", 75)
+    if timeout is None:
+        timeout = getattr(settings, "OCR_PASS_TIMEOUT", 20)
+
+    calls = OCRCalls(timeout)
+    for priority, (name, image, config) in enumerate(passes):
+        calls.submit(priority, image, config)
+    best = None
+    try:
+        for priority, future in calls.as_completed():
+            name = passes[priority][0]
+            try:
+                text, confidence = future.result()
+            except ocr_engine.Cancelled:
+                continue
+            except Exception:
+                logger.warning("OCR pass %s failed", name, exc_info=True)
+                metrics.inc("ocr_pass_results_total", **{"pass": name, "outcome": "failed"})
+                continue
+            text = postprocess_text(text)
+            logger.debug("OCR pass %s: %d chars, confidence %.1f", name, len(text), confidence)
+            if trace is not None:
+                trace.add_pass(name, text, confidence)
+            if not text.strip():
+                metrics.inc("ocr_pass_results_total", **{"pass": name, "outcome": "empty"})
+                continue
+            metrics.inc("ocr_pass_results_total", **{"pass": name, "outcome": "text"})
+            # Higher confidence wins; ties go to the higher-priority pass
+            if best is None or (confidence, -priority) > (best[2], -best[3]):
+                best = (name, text, confidence, priority)
+            if confidence >= min_confidence:
+                break
+    except TimeoutError:
+        logger.warning("OCR passes timed out after %ss", timeout)
+        metrics.inc("ocr_pass_timeouts_total")
+    finally:
+        calls.stop()
+
+    # Which pass each image was read with; anything but the first is a
+    # fallback (PSM 4 retry, plain Tesseract on the original image)
+    metrics.inc("ocr_pass_selected_total", **{"pass": best[0] if best else "none"})
+    if best is not None and best[3] > 0:
+        metrics.inc("ocr_fallbacks_total", fallback=best[0])
+    if best is None:
+        return None, "", 0.0
+    return best[:3]
+
+def detect_text_regions(img, max_regions=40, padding=4):
+    """
+    Find likely text regions with a morphological-gradient/contour approach.
+
+    Edges are found with a morphological gradient, binarised with Otsu,
+    joined horizontally into line-shaped blobs and boxed. Boxes that are
+    tiny, sparse or cover most of the frame (glare, foil texture) are
+    dropped.
+
+    Returns:
+        list: ``(x, y, w, h)`` boxes in reading order (top-to-bottom,
+        left-to-right); empty when nothing text-like was found
+    """
+    # Median blur first so threshold speckle doesn't read as text edges
+    gray = cv2.medianBlur(to_grayscale(img), 5)
+    height, width = gray.shape[:2]
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, kernel)
+    edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    
+    # Join characters of a line into one blob
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 50), 1))
+    connected = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < 20 or h < 8 or w * h > 0.9 * width * height:
+            continue
+        fill = cv2.countNonZero(edges[y:y + h, x:x + w]) / float(w * h)
+        if fill < 0.1:
+            continue
+        boxes.append((x, y, w, h))
     
+    # Keep the largest regions, then restore reading order: group boxes
+    # whose vertical centres fall on the same line, left to right within it
+    boxes = sorted(boxes, key=lambda b: b[2] * b[3], reverse=True)[:max_regions]
+    boxes.sort(key=lambda b: b[1] + b[3] / 2)
+    lines = []
+    for box in boxes:
+        center = box[1] + box[3] / 2
+        if lines and abs(center - lines[-1][0]) < box[3] / 2:
+            lines[-1][1].append(box)
+        else:
+            lines.append((center, [box]))
+    boxes = [box for _, line in lines for box in sorted(line)]
+    return [
+        (max(0, x - padding), max(0, y - padding),
+         min(width, x + w + padding) - max(0, x - padding),
+         min(height, y + h + padding) - max(0, y - padding))
+        for x, y, w, h in boxes
+    ]
+
+def ocr_regions(img, regions, timeout=None, trace=None):
+    """
+    OCR each text region crop in parallel with a PSM suited to its shape.
+
+    Wide, short crops are read as a single line (PSM 7), anything else as a
+    block (PSM 6). All crops share one ``timeout`` budget, counted from when
+    the first starts; crops still queued or running when it runs out are
+    cancelled and left out.
+
+    Returns:
+        tuple: ``(cleaned text in reading order, char-weighted mean confidence)``
+    """
+    if timeout is None:
+        timeout = getattr(settings, "OCR_PASS_TIMEOUT", 20)
+    calls = OCRCalls(timeout, shared=True)
+    for index, (x, y, w, h) in enumerate(regions):
+        psm = 7 if w >= 4 * h else 6
+        config = OCR_CONFIG.replace('--psm 6', f'--psm {psm}')
+        calls.submit(index, img[y:y + h, x:x + w], config)
+    
+    texts = {}
     try:
-        print("\n[1/6] Converting bytes to image...")
-        nparr = np.frombuffer(file_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        print("[2/6] Converting to grayscale...")
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        print("[3/6] Applying adaptive thresholding...")
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, 
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
-        )
-        
-        print("[4/6] Applying dilation to connect text components...")
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2,2))
-        dilated = cv2.dilate(thresh, kernel, iterations=1)
-        
-        # Save preprocessed image for debugging
-        debug_img_path = "./debug_preprocessed.png"
-        cv2.imwrite(debug_img_path, dilated)
-        print(f"[5/6] Saved preprocessed image to: {debug_img_path}")
-        
-        print("[6/6] Configuring Tesseract OCR...")
-        custom_config = (
-            '--oem 3 '  # LSTM + Legacy OCR Engine
-            '--psm 6 '   # Assume a single uniform block of text
-            '-c preserve_interword_spaces=1 '  # Preserve spaces between words
-            '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-+/.()[],:;% '  # Whitelist common medical characters
-            '--user-words ./api/seed_data/medical_terms.txt '  # Custom dictionary
-            '-c load_system_dawg=1 '  # Load system dictionary
-            '-c load_freq_dawg=1 '    # Load frequent words dictionary
-            '-c textord_min_linesize=2.0 '  # Minimum line size
-        )
-        
-        print("\nPerforming OCR with initial settings...")
-        text = pytesseract.image_to_string(dilated, config=custom_config.strip())
-        
-        # If initial OCR doesn't give good results, try with different settings
-        if not text or len(text.strip()) < 10:  # If text is too short
-            print("Initial OCR results were poor, trying alternative settings...")
-            custom_config = custom_config.replace('--psm 6', '--psm 4')  # Assume a single column of text
-            text = pytesseract.image_to_string(dilated, config=custom_config.strip())
+        for index, future in calls.as_completed():
+            try:
+                text, confidence = future.result()
+            except ocr_engine.Cancelled:
+                continue
+            except Exception:
+                logger.warning("OCR of region %s failed", regions[index], exc_info=True)
+                continue
+            texts[index] = (postprocess_text(text), confidence)
+    except TimeoutError:
+        logger.warning("OCR of %d regions timed out after %ss", len(regions), timeout)
+        metrics.inc("ocr_pass_timeouts_total")
+    finally:
+        calls.stop()
+    
+    lines = []
+    weighted = 0.0
+    for index in sorted(texts):
+        text, confidence = texts[index]
+        if text:
+            lines.append(text)
+            weighted += confidence * len(text)
+    text = "\n".join(lines)
+    confidence = weighted / len(text) if text else 0.0
+    if trace is not None:
+        trace.add_pass("regions", text, confidence)
+    return text, confidence
+
+def ocr_image_bytes(file_bytes, trace=None, pipeline="standard", regions=False, timings=None):
+    """
+    Extract text from image using Tesseract with optimized settings.
+
+    The image goes through the named preprocessing ``pipeline`` (see
+    PIPELINES). With ``regions``, only detected text regions are OCR'd (see
+    detect_text_regions); otherwise, or when that finds no text, the PSM 6,
+    PSM 4 and plain-Tesseract passes run concurrently through run_passes,
+    which keeps the most confident result. Per-stage wall times are
+    aggregated into ``api.metrics``.
+
+    Pass an ``api.debug.OCRTrace`` as ``trace`` to keep stage images, text
+    and timings; without one no debug I/O happens. A ``timings`` dict, if
+    given, receives this call's stage wall times too.
+    """
+    timings = {} if timings is None else timings
+    metrics.inc("ocr_images_total", pipeline=pipeline)
+    try:
+        logger.debug("Decoding %d bytes", len(file_bytes))
+        start = time.perf_counter()
+        img = decode_image(file_bytes)
+        timings["decode"] = time.perf_counter() - start
         
-        # Post-process the extracted text
-        cleaned_text = postprocess_text(text)
+        preprocessed = preprocess(img, pipeline, timings=timings, trace=trace)
         
-        # Debug: Print the extracted text
-        print("\n" + "="*80)
-        print("EXTRACTED TEXT FROM IMAGE:")
-        print("="*80)
-        print(cleaned_text)
-        print("="*80 + "\n")
+        cleaned_text = ""
+        if regions:
+            start = time.perf_counter()
+            boxes = detect_text_regions(preprocessed)
+            timings["detect_regions"] = time.perf_counter() - start
+            if boxes:
+                start = time.perf_counter()
+                cleaned_text, confidence = ocr_regions(preprocessed, boxes, trace=trace)
+                timings["ocr_regions"] = time.perf_counter() - start
+                logger.debug("Extracted %d chars from %d regions", len(cleaned_text), len(boxes))
         
-        # If no text was extracted, try one more time with basic settings
         if not cleaned_text.strip():
-            print("No text extracted with optimized settings, trying basic OCR...")
-            text = pytesseract.image_to_string(Image.open(io.BytesIO(file_bytes)))
-            cleaned_text = postprocess_text(text)
-            print("\nBASIC OCR EXTRACTED TEXT:")
-            print("-" * 50)
-            print(cleaned_text)
-            print("-" * 50 + "\n")
-        
+            if regions:
+                metrics.inc("ocr_fallbacks_total", fallback="whole_image")
+            start = time.perf_counter()
+            original = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            name, cleaned_text, confidence = run_passes(ocr_passes(preprocessed, original), trace=trace)
+            timings["ocr"] = time.perf_counter() - start
+            logger.debug("Extracted %d chars of text from pass %s", len(cleaned_text), name)
         return cleaned_text
         
-    except Exception as e:
-        print(f"\n!!! ERROR in OCR processing: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error in OCR processing, falling back to basic OCR")
         
         # Fallback to basic OCR if optimized processing fails
+        metrics.inc("ocr_fallbacks_total", fallback="basic_ocr")
         try:
-            print("\nAttempting fallback to basic OCR...")
-            text = pytesseract.image_to_string(Image.open(io.BytesIO(file_bytes)))
+            start = time.perf_counter()
+            text = ocr_engine.image_to_string(Image.open(io.BytesIO(file_bytes)))
             cleaned_text = postprocess_text(text)
-            print("\nFALLBACK OCR EXTRACTED TEXT:")
-            print("-" * 50)
-            print(cleaned_text)
-            print("-" * 50 + "\n")
+            timings["fallback_ocr"] = time.perf_counter() - start
+            if trace is not None:
+                trace.add_text("fallback", cleaned_text)
             return cleaned_text
-        except Exception as fallback_error:
-            print(f"!!! Fallback OCR also failed: {str(fallback_error)}")
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Fallback OCR also failed")
             return ""
+    finally:
+        record_timings(pipeline, timings)
+        if trace is not None:
+            trace.timings.update(timings)
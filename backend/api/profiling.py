@@ -0,0 +1,249 @@
+# api/profiling.py
+"""
+Sampled request profiling, for slow requests that can't be reproduced.
+
+``api.middleware.ProfilingMiddleware`` profiles a random
+``PROFILE_SAMPLE_RATE`` share of requests under ``PROFILE_PATHS``. It runs
+cProfile on the request thread (for the async views, the event loop, which
+other requests share) and a stack sampler over that thread and the OCR
+worker threads (passes, region crops and offloaded pipelines run there, out
+of cProfile's sight).
+
+Only the ``PROFILE_KEEP`` slowest profiles are kept, in ``PROFILE_DIR``:
+
+- ``<id>.prof``: pstats data (``python -m pstats``, snakeviz)
+- ``<id>.stacks``: collapsed stacks for flamegraph.pl / speedscope
+- ``<id>.json``: request details and the top functions
+
+Admins list them at /api/profiles/ and download them from there.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Files kept per profile, by download format (metadata first, so a
+# half-removed profile is no longer listed)
+PROFILE_FILES = {"json": ".json", "prof": ".prof", "stacks": ".stacks"}
+
+# Thread name prefixes of the pools OCR work is offloaded to
+WORKER_THREAD_PREFIXES = ("ocr-",)
+
+# Top functions (by cumulative time) summarised in each profile's JSON
+TOP_FUNCTIONS = 30
+
+# Single background writer so saving a profile never delays the response
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+
+metrics.describe("profiles_total", "Sampled requests by outcome (kept, dropped, busy)")
+
+class StackSampler:
+    """
+    Counts collapsed stacks of the request thread and of OCR worker threads,
+    sampled every ``interval`` seconds on a background thread.
+
+    Worker threads are shared, so under concurrent load their samples can
+    include other requests' work.
+    """
+
+    def __init__(self, thread_id, interval=0.01, prefixes=WORKER_THREAD_PREFIXES):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.prefixes = prefixes
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, "")
+                if ident == self.thread_id or name.startswith(self.prefixes):
+                    self.samples[collapse(frame, "request" if ident == self.thread_id else name)] += 1
+
+    def collapsed(self):
+        """Samples as ``frame;frame;... count`` lines, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+def collapse(frame, root):
+    """One stack, outermost frame first, as ``root;module:function;...``."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join([root, *reversed(names)])
+
+class RequestProfile:
+    """cProfile plus stack samples for one request."""
+
+    # cProfile can have one active profiler per interpreter on newer
+    # Pythons, so only one request per process is profiled at a time
+    _active = threading.Lock()
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.profiler = None
+        self.sampler = None
+        self.started = None
+        self.duration = None
+
+    def start(self):
+        """Begin profiling; False if another request is already being profiled."""
+        if not self._active.acquire(blocking=False):
+            return False
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), self.interval).start()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        return True
+
+    def stop(self):
+        try:
+            self.profiler.disable()
+            self.duration = time.perf_counter() - self.started
+            self.sampler.stop()
+        finally:
+            self._active.release()
+
+class ProfileRing:
+    """The ``keep`` slowest profiles saved in ``directory``."""
+
+    def __init__(self, directory, keep):
+        self.directory = str(directory)
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def entries(self):
+        """Metadata of the saved profiles, slowest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    entries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        entries.sort(key=lambda entry: entry["duration_ms"], reverse=True)
+        return entries
+
+    def path(self, profile_id, fmt):
+        """Path of one of a profile's files, or None if there is no such profile."""
+        if fmt not in PROFILE_FILES or not profile_id.isalnum():
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_FILES[fmt])
+        return path if os.path.exists(path) else None
+
+    def would_keep(self, duration_ms):
+        """Whether a profile of ``duration_ms`` would make it into the ring."""
+        entries = self.entries()
+        return len(entries) < self.keep or duration_ms > entries[-1]["duration_ms"]
+
+    def add(self, meta, profile):
+        """
+        Save ``profile`` (a stopped RequestProfile) with ``meta``, then drop
+        the fastest profiles beyond ``keep``.
+
+        Returns:
+            bool: Whether it was kept
+        """
+        with self._lock:
+            if not self.would_keep(meta["duration_ms"]):
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, meta["id"])
+
+            out = io.StringIO()
+            stats = pstats.Stats(profile.profiler, stream=out)
+            stats.dump_stats(base + ".prof")
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+            with open(base + ".stacks", "w") as f:
+                f.write(profile.sampler.collapsed())
+            # Metadata last: a profile is listed once its JSON exists
+            with open(base + ".json", "w") as f:
+                json.dump({**meta, "samples": sum(profile.sampler.samples.values()), "top": out.getvalue()}, f)
+
+            for entry in self.entries()[self.keep:]:
+                self.remove(entry["id"])
+            return True
+
+    def remove(self, profile_id):
+        for suffix in PROFILE_FILES.values():
+            try:
+                os.remove(os.path.join(self.directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+_ring = None
+_ring_lock = threading.Lock()
+
+def get_ring():
+    """Return the process-wide profile ring (``PROFILE_DIR``, ``PROFILE_KEEP``)."""
+    global _ring
+    if _ring is None:
+        with _ring_lock:
+            if _ring is None:
+                _ring = ProfileRing(
+                    getattr(settings, "PROFILE_DIR", None) or os.path.join(settings.BASE_DIR, "profiles"),
+                    getattr(settings, "PROFILE_KEEP", 20),
+                )
+    return _ring
+
+def reset_ring():
+    """Drop the process-wide ring so the next use rebuilds it from settings."""
+    global _ring
+    with _ring_lock:
+        _ring = None
+
+def save(request, response, profile):
+    """Queue ``profile`` of ``request`` for the ring (on the writer thread)."""
+    meta = {
+        "id": uuid.uuid4().hex,
+        "path": request.path,
+        "method": request.method,
+        "status": response.status_code,
+        "duration_ms": round(profile.duration * 1000, 2),
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "pid": os.getpid(),
+    }
+    ring = get_ring()
+    future = _writer.submit(ring.add, meta, profile)
+    future.add_done_callback(_saved)
+    return future
+
+def _saved(future):
+    try:
+        kept = future.result()
+    except Exception:
+        logger.exception("Failed to save request profile")
+        return
+    metrics.inc("profiles_total", outcome="kept" if kept else "dropped")
@@ -1,85 +1,807 @@
 # api/resolver.py
-import pandas as pd
+import bisect
+import csv
+import hashlib
+import io
+import logging
+import os
+import sys
+import threading
+from array import array
+from functools import cached_property
+import time
+import numpy as np
 import re
+from django.conf import settings
 from rapidfuzz import fuzz, process
 
-CATALOG_PATH = "api/seed_data/medicines.csv"
+from . import metrics
 
-def load_catalog():
-    """Load the medicine catalog from CSV."""
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seed_data", "medicines.csv")
+
+# Number of threads rapidfuzz may use for batched scoring (-1 = all cores).
+BATCH_WORKERS = -1
+
+# Catalogs with more rows than this shortlist candidates through the trigram
+# index before WRatio scoring; smaller catalogs are brute-forced.
+PREFILTER_MIN_ROWS = 2000
+
+# Rows kept per query by the trigram prefilter. Larger values raise recall at
+# the cost of scoring time.
+CANDIDATE_SHORTLIST = 200
+
+# Typeahead: the WRatio a fuzzy fallback suggestion needs.
+SUGGEST_FUZZY_MIN = 70
+
+# Name kinds in the prefix index, in ranking order.
+SUGGEST_SOURCES = ('brand', 'generic', 'alias')
+
+# Catalog columns every lookup needs; any other CSV column (uses, dosages,
+# side effects, ...) is only read when a response asks for it.
+KEY_FIELDS = ('brand_name', 'generic')
+
+# How often (seconds) the cached catalog checks the CSV's mtime for changes.
+# A change starts a background rebuild; lookups keep using the old catalog
+# until the new one is fully indexed.
+CATALOG_CHECK_INTERVAL = 2.0
+
+def _display_field(value):
+    """Return a catalog cell as a stripped string, treating NaN as empty."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value).strip()
+
+def clean_field(value):
+    """Return a catalog cell as a lowercase string, treating NaN as empty."""
+    return _display_field(value).lower()
+
+def normalize_query(raw_text):
+    """Clean free text before matching it against the catalog."""
+    raw_text = re.sub(r'[^\w\s\-\+\.]', ' ', str(raw_text))
+    raw_text = raw_text.lower().strip()
+    return re.sub(r'\s+', ' ', raw_text)
+
+def _trigrams(text):
+    """Character trigrams of ``text``, padded so short words still yield some."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """
+    Inverted index from character trigrams to catalog rows.
+
+    Used to narrow a query to the rows sharing the most trigrams with it,
+    so full WRatio scoring only runs on a small shortlist.
+    """
+
+    def __init__(self, row_texts):
+        self.size = len(row_texts)
+        postings = {}
+        for idx, texts in enumerate(row_texts):
+            grams = set()
+            for text in texts:
+                grams |= _trigrams(text)
+            for gram in grams:
+                postings.setdefault(gram, []).append(idx)
+        # int32 row ids: half the size of intp, and catalogs stay far below 2**31 rows
+        self.postings = {g: np.asarray(rows, dtype=np.int32) for g, rows in postings.items()}
+
+    def shortlist(self, text, size):
+        """Up to ``size`` row ids sharing the most trigrams with ``text``, ascending."""
+        hits = [self.postings[g] for g in _trigrams(text) if g in self.postings]
+        if not hits:
+            return np.empty(0, dtype=np.int32)
+        counts = np.bincount(np.concatenate(hits), minlength=self.size)
+        rows = np.flatnonzero(counts)
+        if len(rows) > size:
+            rows = rows[np.argpartition(-counts[rows], size - 1)[:size]]
+        return np.sort(rows)
+
+class Column:
+    """
+    Dictionary-encoded catalog column.
+
+    Each distinct value is stored once in ``values`` and every row holds a
+    4-byte code into it, so text repeated across rows (a generic's uses and
+    side effects) costs one string rather than one per row.
+    """
+    __slots__ = ('values', 'codes', '_codes_by_value')
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self._codes_by_value = {}
+
+    def append(self, value):
+        code = self._codes_by_value.get(value)
+        if code is None:
+            code = self._codes_by_value[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def freeze(self):
+        """Drop the value -> code map once every row has been appended."""
+        self._codes_by_value = None
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+def _read_csv_rows(data):
+    """CSV rows of ``data`` as dicts; raises ValueError on malformed input."""
+    reader = csv.DictReader(io.StringIO(data.decode('utf-8-sig'), newline=''), strict=True)
+    try:
+        for row in reader:
+            if None in row:
+                raise ValueError(f"Line {reader.line_num} has more fields than the header")
+            yield row
+    except csv.Error as e:
+        raise ValueError(f"Line {reader.line_num}: {e}") from e
+
+class Catalog:
+    """
+    Preindexed, read-only view of the medicine catalog.
+
+    Built once from the CSV and shared by every lookup in the process, so
+    resolving a query never touches the disk. With
+    CATALOG_SOURCE = "db" a small catalog is instead built per lookup from
+    the candidate rows the database returns.
+
+    Rows are kept column-wise: each CSV column is a dictionary-encoded
+    Column, and lookups work on row ids. Only ``record`` turns a row back
+    into a dict, with just the fields a response needs.
+
+    ``exact`` maps every normalized brand, generic and alias to the rows it
+    names (see ``exact_rows``), for O(1) hits before any fuzzy scoring. ``choices`` holds the
+    strings fuzzy matching runs against (each row's display name followed
+    by its aliases); ``choice_offsets[i]`` is where row ``i``'s choices start.
+    Names are interned, so a generic shared by many rows is one string.
+    """
+
+    def __init__(self, records, mtime=None, version=None):
+        self.mtime = mtime
+        self.version = version
+        self.fields = []
+        self.columns = {}
+        self.size = 0
+        self.brands = []
+        self.generics = []
+        self.alias_names = []
+        self.alias_offsets = array('I')
+        self.names = []
+        self.choices = []
+        self.choice_offsets = []
+        exact = {}
+
+        for idx, row in enumerate(records):
+            if not self.fields:
+                self.fields = list(dict.fromkeys([*KEY_FIELDS, *row]))
+                self.columns = {field: Column() for field in self.fields}
+            for field in self.fields:
+                self.columns[field].append(_display_field(row.get(field)))
+
+            brand_name = sys.intern(clean_field(row.get('brand_name')))
+            generic = sys.intern(clean_field(row.get('generic')))
+            aliases = [sys.intern(a.strip().lower()) for a in clean_field(row.get('aliases')).split(',') if a.strip()]
+
+            self.brands.append(brand_name)
+            self.generics.append(generic)
+            self.alias_offsets.append(len(self.alias_names))
+            self.alias_names.extend(aliases)
+            name = sys.intern(f"{brand_name} ({generic})") if generic else brand_name
+            self.names.append(name)
+
+            for key in [brand_name, generic, *aliases]:
+                key = normalize_query(key)
+                if key:
+                    rows = exact.setdefault(sys.intern(key), [])
+                    # Rows arrive in order, so a repeat can only be the last one
+                    if not rows or rows[-1] != idx:
+                        rows.append(idx)
+
+            self.choice_offsets.append(len(self.choices))
+            self.choices.append(name)
+            self.choices.extend(a for a in dict.fromkeys(aliases) if a != name)
+            self.size += 1
+
+        for column in self.columns.values():
+            column.freeze()
+        self.alias_offsets.append(len(self.alias_names))
+        # Most names belong to one row: store that row's id, not a 1-tuple
+        self.exact = {key: rows[0] if len(rows) == 1 else tuple(rows) for key, rows in exact.items()}
+        self.choice_offsets = np.asarray(self.choice_offsets, dtype=np.intp)
+
+    def record(self, row, fields=None):
+        """Row ``row`` as a dict of ``fields`` (default: every column)."""
+        columns = self.columns
+        return {field: columns[field][row] for field in (fields or self.fields) if field in columns}
+
+    def exact_rows(self, text):
+        """Rows whose normalized brand, generic or alias is ``text``."""
+        rows = self.exact.get(text, ())
+        return (rows,) if isinstance(rows, int) else rows
+
+    def value(self, row, field):
+        """One cell of row ``row`` ('' for a column the catalog lacks)."""
+        column = self.columns.get(field)
+        return column[row] if column is not None else ''
+
+    def row_aliases(self, row):
+        """Row ``row``'s lowercased aliases."""
+        return self.alias_names[self.alias_offsets[row]:self.alias_offsets[row + 1]]
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def empty(self):
+        return not self.size
+
+    @cached_property
+    def trigram_index(self):
+        return TrigramIndex([
+            self.choices[start:end]
+            for start, end in zip(self.choice_offsets, self._choice_ends)
+        ])
+
+    @cached_property
+    def _choice_ends(self):
+        return np.append(self.choice_offsets[1:], len(self.choices))
+
+    def score(self, texts, score_cutoff=0, workers=1, shortlist=None):
+        """
+        Fuzzy-score normalized ``texts`` against the catalog.
+
+        On catalogs larger than PREFILTER_MIN_ROWS only the union of each
+        text's ``shortlist`` best trigram candidates (default
+        CANDIDATE_SHORTLIST) is scored. A ``shortlist`` of 0, or one at
+        least as large as the catalog, scores every row.
+
+        Returns:
+            tuple: ``(rows, scores)`` where ``rows`` are the ascending row ids
+            that were scored and ``scores[i, j]`` is the best WRatio of
+            ``texts[i]`` over row ``rows[j]``'s display name and aliases
+        """
+        if shortlist is None:
+            shortlist = CANDIDATE_SHORTLIST if len(self) > PREFILTER_MIN_ROWS else 0
+
+        if shortlist and shortlist < len(self):
+            index = self.trigram_index
+            rows = np.unique(np.concatenate(
+                [index.shortlist(text, shortlist) for text in texts]
+            ))
+            if not len(rows):
+                return rows, np.zeros((len(texts), 0))
+            starts = self.choice_offsets[rows]
+            ends = self._choice_ends[rows]
+            choices = []
+            offsets = []
+            for start, end in zip(starts, ends):
+                offsets.append(len(choices))
+                choices.extend(self.choices[start:end])
+        else:
+            rows = np.arange(len(self), dtype=np.intp)
+            choices = self.choices
+            offsets = self.choice_offsets
+
+        scores = process.cdist(
+            texts,
+            choices,
+            scorer=fuzz.WRatio,
+            dtype=np.float64,
+            workers=workers,
+            score_cutoff=score_cutoff
+        )
+        return rows, np.maximum.reduceat(scores, offsets, axis=1)
+
+    @cached_property
+    def prefix_index(self):
+        """
+        Sorted completion keys for typeahead, as ``(keys, ranks, names)``.
+
+        Every brand, generic and alias is keyed by its full normalized form
+        and by the remainder from each later word ("montek lc" also under
+        "lc"), so a bisect finds all names with a word starting with the
+        typed prefix. ``ranks[i]`` packs ``(later word, source, name
+        length, row)`` for ``keys[i]`` into one int64, where a lower rank
+        sorts first; ``names[i]`` is the normalized name it completes to.
+        """
+        items = []
+        for row in range(len(self)):
+            names = [(0, self.brands[row]), (1, self.generics[row])]
+            names.extend((2, alias) for alias in self.row_aliases(row))
+            for source, name in names:
+                name = sys.intern(normalize_query(name))
+                for word in re.finditer(r'\S+', name):
+                    start = word.start()
+                    rank = (start > 0) << 50 | source << 48 | min(len(name), 0xFFFF) << 32 | row
+                    items.append((sys.intern(name[start:]), rank, name))
+        items.sort()
+        return (
+            [item[0] for item in items],
+            np.fromiter((item[1] for item in items), dtype=np.int64, count=len(items)),
+            [item[2] for item in items],
+        )
+
+    def complete(self, prefix, limit):
+        """
+        Up to ``limit`` ``(row, source, name)`` whose name has a word starting
+        with normalized ``prefix``: whole-name matches first, then brands
+        before generics before aliases, then shorter names.
+
+        Every entry under the prefix is ranked, however many there are; only
+        the best few are sorted (a partial selection, widened when rows
+        repeat among them).
+        """
+        if limit <= 0:
+            return []
+        keys, ranks, names = self.prefix_index
+        start = bisect.bisect_left(keys, prefix)
+        candidates = ranks[start:bisect.bisect_left(keys, prefix + '\uffff')]
+        wanted = limit
+        while True:
+            if wanted < len(candidates):
+                order = np.argpartition(candidates, wanted)[:wanted]
+                order = order[np.argsort(candidates[order])]
+            else:
+                order = np.argsort(candidates)
+            seen = set()
+            hits = []
+            for i in order:
+                rank = int(candidates[i])
+                row = rank & 0xFFFFFFFF
+                if row not in seen:
+                    seen.add(row)
+                    hits.append((row, SUGGEST_SOURCES[rank >> 48 & 3], names[start + i]))
+                    if len(hits) == limit:
+                        return hits
+            if wanted >= len(candidates):
+                return hits
+            # The same row under several names crowded out others
+            wanted *= 4
+
+    def warm(self):
+        """Build the lazily created indexes now, so no lookup has to."""
+        self.prefix_index
+        if len(self) > PREFILTER_MIN_ROWS:
+            self.trigram_index
+        return self
+
+    @classmethod
+    def from_csv(cls, path=None):
+        """
+        Build a catalog from the CSV at ``path`` (defaults to CATALOG_PATH).
+
+        Its ``version`` is a hash of the file's contents, so every process
+        reports the same version for the same data. Rows are streamed
+        straight into the columns, with no DataFrame or per-row dicts kept;
+        empty cells read as ''.
+
+        Raises:
+            OSError: If the file is missing or can't be read
+        """
+        path = path or CATALOG_PATH
+        mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        version = hashlib.sha256(data).hexdigest()[:12]
+        return cls(_read_csv_rows(data), mtime=mtime, version=version)
+
+    @classmethod
+    def from_database(cls, texts, limit=None):
+        """
+        Build a catalog of just the Medicine rows worth scoring against
+        normalized ``texts``: exact name hits plus up to ``limit`` (default
+        CANDIDATE_SHORTLIST) full-text prefix hits per text.
+        """
+        from .models import Medicine
+        return cls(Medicine.objects.candidate_records(texts, limit or CANDIDATE_SHORTLIST))
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_catalog_checked_at = 0.0
+# CSV mtime the last load or reload was started for
+_watched_mtime = None
+_reload_thread = None
+
+def _catalog_mtime():
+    try:
+        return os.path.getmtime(CATALOG_PATH)
+    except OSError:
+        return None
+
+def _load_catalog():
+    """
+    Build and fully index a catalog from CATALOG_PATH.
+
+    Returns None if the file can't be read or parsed, or if it has no rows
+    while the current catalog does.
+    """
+    global _watched_mtime
+    _watched_mtime = _catalog_mtime()
+    started = time.monotonic()
     try:
-        df = pd.read_csv(CATALOG_PATH)
-        return df
-    except Exception as e:
-        print(f"Error loading catalog: {e}")
-        return pd.DataFrame()
+        catalog = Catalog.from_csv(CATALOG_PATH).warm()
+    except Exception:
+        logger.exception("Error loading catalog")
+        metrics.inc("catalog_loads_total", outcome="failed")
+        return None
+    current = _catalog
+    if not len(catalog) and current is not None and len(current):
+        logger.error("Catalog file has no rows, keeping version %s", current.version)
+        metrics.inc("catalog_loads_total", outcome="rejected")
+        return None
+    metrics.inc("catalog_loads_total", outcome="loaded")
+    logger.info(
+        "Loaded catalog version %s (%d medicines) in %.2fs",
+        catalog.version, len(catalog), time.monotonic() - started
+    )
+    return catalog
+
+def _rebuild_catalog():
+    """
+    Reload the catalog until it matches the CSV on disk, swapping each build in.
+
+    A file _load_catalog rejects leaves the current catalog in place.
+    """
+    global _catalog
+    while True:
+        catalog = _load_catalog()
+        if catalog is None:
+            return
+        # A single reference assignment: lookups see either the old catalog
+        # or the new, fully indexed one
+        _catalog = catalog
+        if _catalog_mtime() == catalog.mtime:
+            return
+
+def reload_catalog(wait=False):
+    """
+    Rebuild the catalog from CATALOG_PATH on a background thread.
 
-def fuzzy_lookup(raw_text, min_confidence=40):
+    Lookups keep being served from the current catalog until the new one
+    is ready. A reload already in progress is reused rather than started
+    twice; it rebuilds again if the file changed while it was reading.
+
+    Args:
+        wait (bool): Block until the rebuild has finished
+
+    Returns:
+        Catalog: The catalog in use afterwards (the current one if not waiting)
+    """
+    global _reload_thread
+    with _catalog_lock:
+        thread = _reload_thread
+        if thread is None or not thread.is_alive():
+            thread = _reload_thread = threading.Thread(
+                target=_rebuild_catalog, name="catalog-reload", daemon=True
+            )
+            thread.start()
+    if wait:
+        thread.join()
+    return _catalog
+
+def get_catalog():
+    """
+    Return the process-wide catalog.
+
+    The first call loads it synchronously, falling back to an empty
+    catalog if the CSV can't be read. After that the CSV's mtime is
+    checked at most once every CATALOG_CHECK_INTERVAL seconds, and a change
+    triggers a background reload_catalog(), so lookups are always served
+    from memory and never wait for a rebuild.
+    """
+    global _catalog, _catalog_checked_at
+
+    catalog = _catalog
+    if catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog_checked_at = time.monotonic()
+                _catalog = _load_catalog() or Catalog([])
+            return _catalog
+
+    now = time.monotonic()
+    if now - _catalog_checked_at >= CATALOG_CHECK_INTERVAL:
+        _catalog_checked_at = now
+        if _catalog_mtime() != _watched_mtime:
+            reload_catalog()
+    return catalog
+
+def reset_catalog():
+    """Drop the cached catalog so the next lookup reloads it from disk."""
+    global _catalog, _catalog_checked_at, _watched_mtime
+    with _catalog_lock:
+        _catalog = None
+        _catalog_checked_at = 0.0
+        _watched_mtime = None
+
+def _catalog_size():
+    """Medicines lookups resolve against (None before the CSV catalog first loads)."""
+    if settings.CATALOG_SOURCE == 'db':
+        from .models import Medicine
+        return Medicine.objects.count()
+    return len(_catalog) if _catalog is not None else None
+
+metrics.describe("catalog_loads_total", "CSV catalog builds by outcome")
+metrics.describe("resolver_lookups_total", "Resolver calls by kind (fuzzy, batch, suggest)")
+metrics.describe("resolver_lookup_queries_total", "Texts looked up in the catalog, by resolver call kind")
+metrics.gauge("catalog_size", _catalog_size, "Medicines in the catalog")
+
+def _catalog_for(texts):
+    """The catalog to resolve normalized ``texts`` against, per CATALOG_SOURCE."""
+    if settings.CATALOG_SOURCE == 'db':
+        return Catalog.from_database(texts)
+    return get_catalog()
+
+def catalog_version():
+    """
+    Version of the catalog lookups currently resolve against, returned in
+    responses and used to key cached results: the CSV's content hash, or
+    the Medicine table's row count and latest update.
+    """
+    if settings.CATALOG_SOURCE == 'db':
+        from django.db.models import Count, Max
+        from .models import Medicine
+        stats = Medicine.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+        return f"{stats['count']}:{stats['updated'].timestamp() if stats['updated'] else 0}"
+    return get_catalog().version
+
+def _top_hits(rows, row, min_confidence, limit):
+    """``(row id, score)`` for the best ``limit`` scores in ``row`` at or above ``min_confidence``."""
+    hits = np.flatnonzero(row >= min_confidence)
+    # Highest score first, ties broken by catalog order (as process.extract does)
+    hits = hits[np.lexsort((hits, -row[hits]))][:limit]
+    return [(rows[hit], row[hit]) for hit in hits]
+
+def _match(catalog, row, score, fields=None):
+    """Catalog row ``row`` as a match dict of ``fields``, with its 0-1 score."""
+    match = catalog.record(row, fields)
+    match['match_score'] = float(score) / 100  # Convert to 0-1 scale
+    return match
+
+def fuzzy_lookup(raw_text, min_confidence=40, fields=None):
     """
     Find fuzzy matches for medicine names in the catalog.
     
     Args:
         raw_text (str): The text to search for
         min_confidence (int): Minimum confidence score (0-100)
+        fields (list): Catalog fields to return per match (default: all)
         
     Returns:
         list: List of matching medicine dictionaries with match scores
     """
-    df = load_catalog()
-    if df.empty:
-        return []
-    
     # Clean and normalize input
-    raw_text = re.sub(r'[^\w\s\-\+\.]', ' ', str(raw_text))
-    raw_text = raw_text.lower().strip()
-    raw_text = re.sub(r'\s+', ' ', raw_text)
+    raw_text = normalize_query(raw_text)
     
     if len(raw_text) < 3:
         return []
+
+    metrics.count_lookup("fuzzy")
+    catalog = _catalog_for([raw_text])
+    if catalog.empty:
+        return []
     
-    # Prepare choices for fuzzy matching
-    choices = []
-    for _, row in df.iterrows():
-        brand_name = str(row.get('brand_name', '')).lower()
-        generic = str(row.get('generic', '')).lower()
-        aliases = [a.strip().lower() for a in str(row.get('aliases', '')).split(',') if a.strip()]
-        
-        # Add all possible name variations
-        choices.append({
-            'id': len(choices),
-            'name': f"{brand_name} ({generic})" if generic else brand_name,
-            'brand_name': brand_name,
-            'generic': generic,
-            'aliases': aliases,
-            'row': row.to_dict()
-        })
-    
-    # Extract just the names for fuzzy matching
-    choice_names = [c['name'] for c in choices]
-    
-    # Perform fuzzy matching
-    results = process.extract(
-        raw_text,
-        choice_names,
-        scorer=fuzz.WRatio,
-        limit=10,
-        score_cutoff=min_confidence
-    )
+    # Exact brand/generic/alias hits skip fuzzy scoring entirely
+    exact = catalog.exact_rows(raw_text)
+    if exact:
+        results = [(idx, 100.0) for idx in exact[:10]]
+    else:
+        rows, scores = catalog.score([raw_text], score_cutoff=min_confidence)
+        results = _top_hits(rows, scores[0], min_confidence, 10)
     
     # Prepare results
-    matches = []
-    for result in results:
-        choice = choices[result[2]]  # Get the original choice using the index
-        if result[1] >= min_confidence:  # Only include matches above threshold
-            match = choice['row'].copy()
-            match['match_score'] = result[1] / 100  # Convert to 0-1 scale
-            matches.append(match)
+    matches = [_match(catalog, idx, score, fields) for idx, score in results]
     
     # Sort by match score (highest first)
     matches.sort(key=lambda x: x.get('match_score', 0), reverse=True)
     
     return matches
 
+def suggest(prefix, limit=10, fuzzy=False):
+    """
+    Typeahead suggestions for a partially typed medicine name.
+
+    Args:
+        prefix (str): Text typed so far
+        limit (int): Maximum suggestions returned
+        fuzzy (bool): Top up with fuzzy matches when prefixes find fewer
+            than ``limit`` (for misspellings)
+
+    Returns:
+        list: Suggestion dicts with ``brand_name``, ``generic``, the
+        ``match``ed name and its ``source`` (brand, generic, alias or fuzzy)
+    """
+    prefix = normalize_query(prefix)
+    if not prefix:
+        return []
+
+    metrics.count_lookup("suggest")
+    catalog = _catalog_for([prefix])
+    hits = catalog.complete(prefix, limit)
+    if fuzzy and len(hits) < limit and len(prefix) >= 3:
+        found = {row for row, _, _ in hits}
+        rows, scores = catalog.score([prefix], score_cutoff=SUGGEST_FUZZY_MIN)
+        for row, _ in _top_hits(rows, scores[0], SUGGEST_FUZZY_MIN, limit):
+            if row not in found and len(hits) < limit:
+                hits.append((row, 'fuzzy', catalog.names[row]))
+
+    return [
+        {
+            'brand_name': catalog.value(row, 'brand_name').strip(),
+            'generic': catalog.value(row, 'generic').strip(),
+            'match': name,
+            'source': source,
+        }
+        for row, source, name in hits
+    ]
+
+def batch_lookup(queries, limit=10, workers=None):
+    """
+    Resolve many candidate segments against the catalog in one pass.
+
+    Exact brand/generic/alias hits are answered from the catalog index; all
+    remaining queries are scored in a single ``rapidfuzz.process.cdist``
+    matrix, so the work runs in native code across ``workers`` threads
+    instead of one ``fuzzy_lookup`` call per segment.
+
+    Args:
+        queries (list): ``(text, min_confidence)`` pairs, in priority order
+        limit (int): Maximum matches kept per query, as in fuzzy_lookup
+        workers (int): rapidfuzz worker threads (defaults to BATCH_WORKERS)
+
+    Returns:
+        list: Matching medicine dictionaries with match scores, deduplicated
+        by brand name and ordered as the per-query fuzzy_lookup results would be
+    """
+    return batch_lookup_groups([queries], limit=limit, workers=workers)[0]
+
+def batch_lookup_groups(groups, limit=10, workers=None, fields=None):
+    """
+    Resolve several independent query lists (e.g. one per image) together.
+
+    Like batch_lookup, but the distinct misses of every group share one
+    cdist matrix; deduplication by brand name happens within each group.
+    Only ``fields`` (default: all) are read from the catalog per match.
+
+    Returns:
+        list: One batch_lookup result list per group, in order
+    """
+    catalog, hits = match_groups(groups, limit=limit, workers=workers)
+    return [[_match(catalog, row, score, fields) for row, score in group] for group in hits]
+
+def match_groups(groups, limit=10, workers=None):
+    """
+    The catalog rows batch_lookup_groups would return, without building
+    any match dicts.
+
+    Returns:
+        tuple: ``(catalog, hits)``: the catalog the row ids refer to, and
+        per group a list of ``(row, score)`` with scores on a 0-100 scale
+    """
+    # Normalize once; exact hits come straight from the index and each
+    # distinct miss is fuzzy-scored only once
+    normalized_groups = []
+    for queries in groups:
+        normalized = []
+        for text, min_confidence in queries:
+            text = normalize_query(text)
+            if len(text) >= 3:
+                normalized.append((text, min_confidence))
+        normalized_groups.append(normalized)
+    texts = list(dict.fromkeys(text for normalized in normalized_groups for text, _ in normalized))
+    if not texts:
+        return None, [[] for _ in groups]
+
+    metrics.count_lookup("batch", len(texts))
+    catalog = _catalog_for(texts)
+    if catalog.empty:
+        return catalog, [[] for _ in groups]
+
+    misses = {}
+    cutoff = 100
+    for normalized in normalized_groups:
+        for text, min_confidence in normalized:
+            if text not in catalog.exact:
+                misses.setdefault(text, len(misses))
+                cutoff = min(cutoff, min_confidence)
+
+    if misses:
+        rows, scores = catalog.score(
+            list(misses),
+            score_cutoff=cutoff,
+            workers=BATCH_WORKERS if workers is None else workers
+        )
+
+    brands = catalog.columns['brand_name'].codes
+    hits_by_group = []
+    for normalized in normalized_groups:
+        seen = set()
+        hits = []
+        for text, min_confidence in normalized:
+            exact = catalog.exact_rows(text)
+            if exact:
+                results = [(idx, 100.0) for idx in exact[:limit]]
+            else:
+                results = _top_hits(rows, scores[misses[text]], min_confidence, limit)
+            for idx, score in results:
+                # Equal brand names share a code in the brand column
+                brand = brands[idx]
+                if brand in seen:
+                    continue
+                seen.add(brand)
+                hits.append((idx, score))
+        hits_by_group.append(hits)
+
+    return catalog, hits_by_group
+
+# Prescription parsing: compiled once at import rather than per call.
+
+# Spaces go between digits and letters and at lowercase-to-uppercase
+# changes ("500mg" -> "500 mg", "TabMetformin" -> "Tab Metformin")...
+_TOKEN_BOUNDARY = re.compile(r'(?<=\d)(?=[a-zA-Z])|(?<=[a-zA-Z])(?=\d)|(?<=[a-z])(?=[A-Z])')
+# ...then the text is re-read as words and single punctuation marks,
+# joined by single spaces.
+_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+_STRENGTH = r'(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)'
+# Instructions run to the end of the text. (They used to stop before the
+# next "<digits>.", but normalization spaces out every ".", so that lookahead
+# never matched and only cost a lookahead test per character.)
+_INSTRUCTIONS = r'\s*-?\s*(.*)'
+
+# Medicine line formats, tried in this order
+MEDICINE_PATTERNS = [
+    # Number. MedicineName Strength - Instructions (e.g., "1. Metformin 500mg - Take once daily")
+    re.compile(r'\b(\d+)\.?\s*([A-Z][a-zA-Z]+)\s+' + _STRENGTH + _INSTRUCTIONS, re.IGNORECASE | re.MULTILINE),
+    # MedicineName (Generic) Strength - Instructions
+    re.compile(r'\b([A-Z][a-zA-Z]+)\s*\(([a-zA-Z\s]+)\)\s*' + _STRENGTH + _INSTRUCTIONS, re.IGNORECASE | re.MULTILINE),
+    # MedicineName Strength - Instructions (without number)
+    re.compile(r'\b([A-Z][a-zA-Z]+)\s+' + _STRENGTH + _INSTRUCTIONS, re.IGNORECASE | re.MULTILINE),
+]
+
+# Common frequency terms, in priority order: the first one found anywhere
+# in the instructions wins. Plain substring checks with an early exit beat a
+# regex alternation over all terms by orders of magnitude in CPython.
+FREQUENCY_TERMS = {
+    'once': 'Once daily',
+    'twice': 'Twice daily',
+    'thrice': 'Three times daily',
+    'daily': 'Once daily',
+    'nightly': 'At night',
+    'morning': 'In the morning',
+    'evening': 'In the evening',
+    'bedtime': 'At bedtime',
+    'hs': 'At bedtime',
+    'qhs': 'At bedtime',
+    'ac': 'Before meals',
+    'pc': 'After meals',
+    'prn': 'As needed',
+    'sos': 'As needed',
+    'qd': 'Once daily',
+    'bid': 'Twice daily',
+    'tid': 'Three times daily',
+    'qid': 'Four times daily',
+    'qod': 'Every other day'
+}
+
+def _normalize_prescription(text):
+    """Split glued tokens and space out punctuation in one substitution and one scan."""
+    return ' '.join(_TOKEN.findall(_TOKEN_BOUNDARY.sub(' ', text)))
+
+def parse_frequency(instructions):
+    """The highest-priority frequency term in ``instructions``, or "As directed"."""
+    instructions = instructions.lower()
+    for term, frequency in FREQUENCY_TERMS.items():
+        if term in instructions:
+            return frequency
+    return 'As directed'
+
 def extract_medicines_from_text(text):
     """
     Extract medicine information from prescription text.
@@ -90,104 +812,43 @@ def extract_medicines_from_text(text):
     Returns:
         list: List of dictionaries containing extracted medicine information
     """
-    print("\n" + "="*80)
-    print("STARTING MEDICINE EXTRACTION")
-    print("="*80)
-    print(f"Original text:\n{text}\n" + "-" * 40)
-    
-    # Clean and preprocess the text
-    text = re.sub(r'(?<=\d)(?=[a-zA-Z])', ' ', text)  # Add space between number and letter
-    text = re.sub(r'(?<=[a-zA-Z])(?=\d)', ' ', text)  # Add space between letter and number
-    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)  # Add space between lowercase and uppercase
-    text = re.sub(r'([^\w\s])', r' \1 ', text)  # Add spaces around special characters
-    text = re.sub(r'\s+', ' ', text).strip()  # Normalize spaces
-    
-    print(f"Cleaned text for processing:\n{text}\n" + "-" * 40)
+    logger.debug("Extracting medicines from text:\n%s", text)
     
-    # Define patterns for different medicine formats
-    medicine_patterns = [
-        # Pattern 1: Number. MedicineName Strength - Instructions (e.g., "1. Metformin 500mg - Take once daily")
-        r'\b(\d+)\.?\s*([A-Z][a-zA-Z]+)\s+(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)\s*-?\s*(.*?)(?=\d+\.|$)',
-        
-        # Pattern 2: MedicineName (Generic) Strength - Instructions
-        r'\b([A-Z][a-zA-Z]+)\s*\(([a-zA-Z\s]+)\)\s*(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)\s*-?\s*(.*?)(?=\d+\.|$)',
-        
-        # Pattern 3: MedicineName Strength - Instructions (without number)
-        r'\b([A-Z][a-zA-Z]+)\s+(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)\s*-?\s*(.*?)(?=\d+\.|$)'
-    ]
+    text = _normalize_prescription(text)
     
-    # Common frequency terms
-    frequency_terms = {
-        'once': 'Once daily',
-        'twice': 'Twice daily',
-        'thrice': 'Three times daily',
-        'daily': 'Once daily',
-        'nightly': 'At night',
-        'morning': 'In the morning',
-        'evening': 'In the evening',
-        'bedtime': 'At bedtime',
-        'hs': 'At bedtime',
-        'qhs': 'At bedtime',
-        'ac': 'Before meals',
-        'pc': 'After meals',
-        'prn': 'As needed',
-        'sos': 'As needed',
-        'qd': 'Once daily',
-        'bid': 'Twice daily',
-        'tid': 'Three times daily',
-        'qid': 'Four times daily',
-        'qod': 'Every other day'
-    }
+    logger.debug("Cleaned text for processing:\n%s", text)
     
     medicines = []
+    seen = set()
     
-    # Try each pattern to extract medicines
-    for pattern in medicine_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE)
-        for match in matches:
+    for index, pattern in enumerate(MEDICINE_PATTERNS):
+        for match in pattern.finditer(text):
             groups = [g.strip() if g else '' for g in match.groups()]
             
-            # Extract medicine details based on pattern
-            if len(groups) >= 4:  # Pattern 1 or 2
-                if groups[0].isdigit():  # Pattern 1
-                    name = groups[1]
-                    strength = groups[2]
-                    instructions = groups[3]
-                    generic = ''
-                else:  # Pattern 2
-                    name = groups[0]
-                    generic = groups[1]
-                    strength = groups[2]
-                    instructions = groups[3] if len(groups) > 3 else ''
-            else:  # Pattern 3
-                name = groups[0]
-                strength = groups[1] if len(groups) > 1 else ''
-                instructions = groups[2] if len(groups) > 2 else ''
+            if index == 0:  # Number. Name Strength
+                _, name, strength, instructions = groups
+                generic = ''
+            elif index == 1:  # Name (Generic) Strength
+                name, generic, strength, instructions = groups
+            else:  # Name Strength
+                name, strength, instructions = groups
                 generic = ''
             
-            # Extract frequency from instructions
-            frequency = 'As directed'
-            for term, freq in frequency_terms.items():
-                if term.lower() in instructions.lower():
-                    frequency = freq
-                    break
+            medicine_key = (name.lower(), strength.lower())
+            if medicine_key in seen:
+                continue
+            seen.add(medicine_key)
             
-            # Create medicine dictionary
-            medicine = {
+            frequency = parse_frequency(instructions)
+            medicines.append({
                 'brand_name': name,
                 'generic': generic or name,
                 'prescribed_dosage': strength,
                 'prescribed_timing': frequency,
                 'instructions': instructions,
                 'match_score': 1.0
-            }
-            
-            # Add to medicines list if not already present
-            medicine_key = f"{name.lower()}_{strength.lower()}"
-            if medicine_key not in [f"{m['brand_name'].lower()}_{m['prescribed_dosage'].lower()}" for m in medicines]:
-                medicines.append(medicine)
-                print(f"Found medicine: {name} {strength} - {frequency}")
+            })
+            logger.debug("Found medicine: %s %s - %s", name, strength, frequency)
     
-    print("\n" + "="*80)
-    print(f"Extracted {len(medicines)} medicines")
-    return medicines
\ No newline at end of file
+    logger.debug("Extracted %d medicines", len(medicines))
+    return medicines
@@ -1,5 +1,23 @@
 # api/serializers.py
+from django.conf import settings
 from rest_framework import serializers
 
+from .uploads import UploadError, validate_upload
+
+def validate_image_upload(value):
+    """Cheap size and header check in place of a full PIL decode."""
+    try:
+        validate_upload(value)
+    except UploadError as e:
+        raise serializers.ValidationError(str(e))
+
 class OCRSerializer(serializers.Serializer):
-    image = serializers.ImageField()
+    image = serializers.FileField(validators=[validate_image_upload])
+
+class BatchOCRSerializer(serializers.Serializer):
+    images = serializers.ListField(
+        child=serializers.FileField(validators=[validate_image_upload]),
+        allow_empty=False,
+        max_length=getattr(settings, "OCR_BATCH_MAX_IMAGES", 20)
+    )
+    kind = serializers.ChoiceField(choices=["strip", "prescription", "ocr"], default="strip")
@@ -0,0 +1,276 @@
+# api/services.py
+"""
+Request-independent OCR and resolution pipelines behind the views.
+
+Each function takes raw upload bytes and returns the JSON payload the
+matching endpoint responds with. Results are cached by content hash (see
+``api.cache``) unless a debug trace is being collected.
+"""
+import logging
+import re
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .cache import get_cache, make_key
+from .extractors import extract_medicines
+from .ocr_utils import PIPELINE_VERSION, ocr_image_bytes
+from .resolver import batch_lookup_groups, catalog_version
+
+logger = logging.getLogger(__name__)
+
+def pipeline_for(kind):
+    """Preprocessing pipeline configured for an endpoint ``kind`` (OCR_PIPELINES)."""
+    return getattr(settings, "OCR_PIPELINES", {}).get(kind, "standard")
+
+def regions_for(kind):
+    """Whether text-region cropping is enabled for ``kind`` (OCR_TEXT_REGIONS)."""
+    return kind in getattr(settings, "OCR_TEXT_REGIONS", ())
+
+def _result_key(kind, bytes_data):
+    parts = [PIPELINE_VERSION, pipeline_for(kind), regions_for(kind)]
+    # Resolved results depend on the catalog as well as the image
+    if kind in ("strip", "prescription"):
+        parts.append(catalog_version())
+    return make_key(kind, bytes_data, *parts)
+
+def _cache_get(key):
+    cache = get_cache()
+    if cache is None:
+        return None
+    result = cache.get(key)
+    if result is not None:
+        logger.debug("Cache hit for %s", key)
+    return result
+
+def _cache_set(key, result):
+    cache = get_cache()
+    # Empty OCR output can be a transient Tesseract failure; don't pin it
+    if cache is not None and _has_text(result):
+        cache.set(key, result)
+
+def _cached(key, compute):
+    result = _cache_get(key)
+    if result is None:
+        result = compute()
+        _cache_set(key, result)
+    return result
+
+def _has_text(result):
+    text = result.get("raw_text") if isinstance(result, dict) else result
+    return bool(text and text.strip())
+
+def ocr_text(bytes_data, trace=None, kind="ocr"):
+    """Raw OCR text for an uploaded image, preprocessed as configured for ``kind``."""
+    pipeline = pipeline_for(kind)
+    regions = regions_for(kind)
+    if trace is not None:
+        return ocr_image_bytes(bytes_data, trace=trace, pipeline=pipeline, regions=regions)
+    return _cached(
+        make_key("text", bytes_data, PIPELINE_VERSION, pipeline, regions),
+        lambda: ocr_image_bytes(bytes_data, pipeline=pipeline, regions=regions)
+    )
+
+def process_ocr(bytes_data, trace=None):
+    """OCR an uploaded image and return the raw text payload."""
+    return {"raw_text": ocr_text(bytes_data, trace=trace)}
+
+def strip_queries(text):
+    """
+    Clean strip OCR text and build its catalog queries.
+
+    Returns:
+        tuple: ``(cleaned text, [(segment, min_confidence), ...])``
+    """
+    # Clean up the text
+    text = re.sub(r'[^\w\s\-\+\/\.]', ' ', text)  # Keep basic punctuation
+    text = text.replace('\n', ' ')  # Convert newlines to spaces
+    text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+    logger.debug("Cleaned strip text: %s", text)
+    
+    # Try different text segmentation approaches
+    queries = []
+    
+    # 1. Try word groups (3-4 words at a time)
+    words = text.split()
+    for i in range(len(words)):
+        for j in range(i+1, min(i+5, len(words)+1)):
+            segment = ' '.join(words[i:j])
+            if len(segment) >= 3:  # Only try segments of reasonable length
+                queries.append((segment, 45))
+                    
+    # 2. Try individual words that look like medicine names
+    for word in words:
+        if (len(word) >= 4 and  # Only try words of reasonable length
+            not any(c.isdigit() for c in word) and  # Skip numbers
+            not word.lower() in {'tablet', 'strip', 'mg', 'ml'}):  # Skip common non-medicine words
+            queries.append((word, 70))  # Higher confidence for single words
+    
+    return text, queries
+
+def resolve_strip_texts(texts):
+    """Resolve several strips' OCR texts against the catalog in one batched pass."""
+    cleaned = [strip_queries(text) for text in texts]
+    version = catalog_version()
+    # Score every segment in one batch; duplicates are removed per strip by brand name
+    matches = batch_lookup_groups([queries for _, queries in cleaned])
+    return [
+        {"raw_text": text, "medicines": medicines, "catalog_version": version}
+        for (text, _), medicines in zip(cleaned, matches)
+    ]
+
+def resolve_strip_text(text):
+    """Clean strip OCR text and resolve it against the catalog."""
+    return resolve_strip_texts([text])[0]
+
+def process_strip(bytes_data, trace=None):
+    """OCR a medicine strip photo and resolve the medicines on it."""
+    if trace is not None:
+        return resolve_strip_text(ocr_text(bytes_data, trace=trace, kind="strip"))
+    return _cached(
+        _result_key("strip", bytes_data),
+        lambda: resolve_strip_text(ocr_text(bytes_data, kind="strip"))
+    )
+
+# Minimum WRatio for an extracted prescription name to count as a catalog
+# medicine; below it the name is returned as written and flagged.
+PRESCRIPTION_MATCH_MIN = 70
+
+# Catalog fields copied onto a resolved prescription medicine
+PRESCRIPTION_CATALOG_FIELDS = ['brand_name', 'generic', 'uses', 'side_effects', 'layman_summary']
+
+def _prescription_medicine(med, match):
+    """Merge an extracted medicine with its best catalog ``match`` (or None)."""
+    formatted = {
+        'brand_name': med['brand_name'],
+        'generic': med['generic'],
+        'prescribed_name': med['brand_name'],
+        'prescribed_dosage': med['prescribed_dosage'],
+        'prescribed_timing': med['prescribed_timing'],
+        'instructions': med['instructions'],
+        'uses': '',
+        'side_effects': '',
+        'layman_summary': '',
+        'match_score': 0.0,
+        'in_catalog': match is not None,
+    }
+    if match is not None:
+        for field in PRESCRIPTION_CATALOG_FIELDS:
+            # Empty catalog cells keep the extracted value
+            value = match.get(field)
+            if value:
+                formatted[field] = value
+        formatted['match_score'] = match['match_score']
+    return formatted
+
+def resolve_prescription_texts(texts):
+    """
+    Extract the medicines from several prescriptions' OCR texts (with the
+    configured extractor, as one batch) and resolve every extracted name
+    against the catalog in one batched pass.
+
+    Each name (and its written generic, when there is one) is looked up;
+    the best match at PRESCRIPTION_MATCH_MIN or above supplies the catalog
+    fields and score, and names without one come back with
+    ``in_catalog: false``.
+    """
+    extracted = extract_medicines(texts)
+    version = catalog_version()
+    groups = []
+    for medicines in extracted:
+        for med in medicines:
+            names = dict.fromkeys([med['brand_name'], med['generic']])
+            groups.append([(name, PRESCRIPTION_MATCH_MIN) for name in names])
+    matches = iter(batch_lookup_groups(groups, limit=1, fields=PRESCRIPTION_CATALOG_FIELDS))
+
+    results = []
+    for text, medicines in zip(texts, extracted):
+        formatted_medicines = []
+        for med in medicines:
+            found = next(matches)
+            best = max(found, key=lambda m: m['match_score']) if found else None
+            formatted_medicines.append(_prescription_medicine(med, best))
+        unknown = sum(not med['in_catalog'] for med in formatted_medicines)
+        results.append({
+            "success": True,
+            "raw_text": text,
+            "medicines": formatted_medicines,
+            "unknown_count": unknown,
+            "catalog_version": version,
+            "message": f"Found {len(formatted_medicines)} medicines" if formatted_medicines else "No medicines found"
+        })
+    return results
+
+def format_prescription(text):
+    """Extract medicines from prescription OCR text into the response payload."""
+    return resolve_prescription_texts([text])[0]
+
+def process_prescription(bytes_data, trace=None):
+    """OCR a prescription photo and extract the prescribed medicines."""
+    if trace is not None:
+        return format_prescription(ocr_text(bytes_data, trace=trace, kind="prescription"))
+    return _cached(
+        _result_key("prescription", bytes_data),
+        lambda: format_prescription(ocr_text(bytes_data, kind="prescription"))
+    )
+
+def _finish_batch(kind, texts):
+    """Turn OCR texts from a batch into endpoint payloads."""
+    if kind == "strip":
+        return resolve_strip_texts(texts)
+    if kind == "prescription":
+        return resolve_prescription_texts(texts)
+    return [{"raw_text": text} for text in texts]
+
+def process_batch(kind, images, executor):
+    """
+    Run the ``kind`` pipeline over many uploaded images.
+
+    OCR runs in parallel on ``executor`` (a process pool). Whenever images
+    finish, every image that is ready is resolved together in one batched
+    catalog pass, so results stream out as they complete.
+
+    An image whose worker died (BrokenProcessPool) is resubmitted once; the
+    executor is expected to replace a broken pool on submit (see
+    api.jobs.RestartingProcessPool).
+
+    Yields:
+        tuple: ``(index, payload)`` per image, in completion order; a failed
+        image yields ``{"error": ...}`` as its payload
+    """
+    def submit(index):
+        # Upload buffers can't be pickled; the worker gets its own copy
+        pending[executor.submit(ocr_text, bytes(images[index]), None, kind)] = index
+
+    pending = {}
+    for index, bytes_data in enumerate(images):
+        cached = _cache_get(_result_key(kind, bytes_data))
+        if cached is not None:
+            yield index, cached
+        else:
+            submit(index)
+
+    retried = set()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        ready = []
+        for future in done:
+            index = pending.pop(future)
+            try:
+                ready.append((index, future.result()))
+            except BrokenProcessPool as e:
+                if index in retried:
+                    logger.error("OCR worker died twice on batch image %d", index)
+                    yield index, {"error": str(e)}
+                    continue
+                logger.warning("OCR worker died on batch image %d, retrying", index)
+                retried.add(index)
+                submit(index)
+            except Exception as e:
+                logger.exception("OCR failed for batch image %d", index)
+                yield index, {"error": str(e)}
+        payloads = _finish_batch(kind, [text for _, text in ready])
+        for (index, _), payload in zip(ready, payloads):
+            _cache_set(_result_key(kind, images[index]), payload)
+            yield index, payload
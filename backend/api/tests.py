@@ -1,3 +1,1503 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import pstats
+import time
+import random
+import re
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile, TemporaryUploadedFile
+from django.core import checks
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.throttling import BaseThrottle
+
+from . import (
+    async_views, benchmarks, cache, debug, extractors, jobs, metrics, ocr_engine, ocr_utils, profiling,
+    resolver, services, uploads, views,
+)
+from .models import Alias, Medicine
+
+
+class TrigramPrefilterTests(SimpleTestCase):
+    """The trigram shortlist must agree with brute-force scoring on the seed catalog."""
+
+    QUERIES = [
+        "dolo 650 tab", "crocn", "amoxicilin", "cetrizine 10mg", "metformn",
+        "azithromycine", "pantop 40", "paracetmol 500", "atorvastatn", "montelukas",
+    ]
+
+    def setUp(self):
+        resolver.reset_catalog()
+        self.catalog = resolver.get_catalog()
+
+    def lookup(self, query, shortlist, min_confidence=40):
+        with mock.patch.object(resolver, "PREFILTER_MIN_ROWS", 0), \
+                mock.patch.object(resolver, "CANDIDATE_SHORTLIST", shortlist):
+            return [
+                (m["brand_name"], m["match_score"])
+                for m in resolver.fuzzy_lookup(query, min_confidence=min_confidence)
+            ]
+
+    def test_shortlist_keeps_best_match(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                expected = self.lookup(query, shortlist=0)
+                self.assertTrue(expected)
+                self.assertEqual(self.lookup(query, shortlist=3)[0], expected[0])
+
+    def test_shortlist_matches_brute_force_above_single_word_threshold(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.lookup(query, shortlist=5, min_confidence=70),
+                    self.lookup(query, shortlist=0, min_confidence=70),
+                )
+
+    def test_shortlist_covering_catalog_is_brute_force(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.lookup(query, shortlist=len(self.catalog)),
+                    self.lookup(query, shortlist=0),
+                )
+
+
+class BatchLookupTests(SimpleTestCase):
+    """batch_lookup must return what per-segment fuzzy_lookup calls would."""
+
+    QUERIES = [
+        ("dolo 650 tab", 40), ("crocn", 60), ("dolo", 40), ("paracetamol", 70),
+        ("zz", 40), ("amoxicilin", 40), ("qwxv plonk", 80), ("Dolo 650 tab!", 40),
+    ]
+
+    def setUp(self):
+        resolver.reset_catalog()
+
+    def per_segment(self, queries, limit):
+        seen = set()
+        matches = []
+        for text, min_confidence in queries:
+            for match in resolver.fuzzy_lookup(text, min_confidence=min_confidence)[:limit]:
+                if match["brand_name"] not in seen:
+                    seen.add(match["brand_name"])
+                    matches.append(match)
+        return matches
+
+    def test_matches_per_segment_lookups(self):
+        for limit in (1, 3, 10):
+            with self.subTest(limit=limit):
+                self.assertEqual(
+                    resolver.batch_lookup(self.QUERIES, limit=limit),
+                    self.per_segment(self.QUERIES, limit),
+                )
+
+    def test_each_query_alone(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(resolver.batch_lookup([query]), self.per_segment([query], 10))
+
+
+class ExactIndexTests(SimpleTestCase):
+    """Exact brand, generic and alias hits come from the index without fuzzy scoring."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+        self.catalog = resolver.get_catalog()
+
+    def test_names_and_aliases_are_indexed(self):
+        brands = self.catalog.columns["brand_name"]
+        self.assertEqual([brands[row] for row in self.catalog.exact_rows("dolo-650")], ["Dolo-650"])
+        self.assertEqual([brands[row] for row in self.catalog.exact_rows("zyrtec")], ["Cetirizine"])
+        self.assertEqual(
+            {brands[row] for row in self.catalog.exact_rows("paracetamol")}, {"Dolo-650", "Crocin-500"}
+        )
+        self.assertEqual(self.catalog.exact_rows("zyrtek"), ())
+
+    def test_exact_hits_skip_fuzzy_scoring(self):
+        with mock.patch.object(resolver.Catalog, "score", side_effect=AssertionError("scored")):
+            # Case and punctuation are normalized before the index lookup
+            (match,) = resolver.fuzzy_lookup("  ZYRTEC! ")
+            batch = resolver.batch_lookup([("Zyrtec", 90), ("dolo", 90)])
+        self.assertEqual((match["brand_name"], match["match_score"]), ("Cetirizine", 1.0))
+        self.assertEqual([(m["brand_name"], m["match_score"]) for m in batch], [("Cetirizine", 1.0), ("Dolo-650", 1.0)])
+
+    def test_misses_fall_back_to_fuzzy_scoring(self):
+        with mock.patch.object(resolver.Catalog, "score", wraps=self.catalog.score) as score:
+            matches = resolver.fuzzy_lookup("zyrtek")
+        score.assert_called_once()
+        self.assertEqual(matches[0]["brand_name"], "Cetirizine")
+        self.assertLess(matches[0]["match_score"], 1.0)
+
+
+class DatabaseCatalogTests(TestCase):
+    """With CATALOG_SOURCE = "db", lookups must find what the CSV catalog finds."""
+
+    QUERIES = TrigramPrefilterTests.QUERIES + ["dolo", "crocin", "paracetamol"]
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command("import_medicines", stdout=StringIO())
+
+    def setUp(self):
+        resolver.reset_catalog()
+
+    def lookup(self, query, source, min_confidence=40):
+        with override_settings(CATALOG_SOURCE=source):
+            return [
+                (m["brand_name"], m["match_score"])
+                for m in resolver.fuzzy_lookup(query, min_confidence=min_confidence)
+            ]
+
+    def test_import(self):
+        self.assertEqual(Medicine.objects.count(), len(resolver.get_catalog()))
+        self.assertTrue(Alias.objects.filter(normalized="dolo").exists())
+
+    def test_best_match_agrees_with_csv(self):
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                expected = self.lookup(query, "csv")
+                self.assertEqual(self.lookup(query, "db")[:1], expected[:1])
+
+    def test_batch_lookup_agrees_with_csv(self):
+        queries = [(query, 70) for query in self.QUERIES]
+        with override_settings(CATALOG_SOURCE="csv"):
+            expected = resolver.batch_lookup(queries)
+        with override_settings(CATALOG_SOURCE="db"):
+            self.assertEqual(resolver.batch_lookup(queries), expected)
+
+    def test_suggest_agrees_with_csv(self):
+        for prefix in ["d", "c", "m", "do", "par", "montek l"]:
+            with self.subTest(prefix=prefix):
+                with override_settings(CATALOG_SOURCE="csv"):
+                    expected = resolver.suggest(prefix)
+                self.assertTrue(expected)
+                with override_settings(CATALOG_SOURCE="db"):
+                    self.assertEqual(resolver.suggest(prefix), expected)
+
+    def test_search_index_follows_edits(self):
+        medicine = Medicine.objects.create(brand_name="Zyxobrin-20", generic="Zyxoprazole")
+        self.assertIn(medicine.id, Medicine.objects.search_ids("zyxo", 10))
+        Alias.objects.create(medicine=medicine, name="Qwelto")
+        self.assertIn(medicine.id, Medicine.objects.search_ids("qwelto", 10))
+        medicine.delete()
+        self.assertNotIn(medicine.id, Medicine.objects.search_ids("zyxo", 10))
+
+    def test_candidates_take_a_fixed_number_of_queries(self):
+        texts = [resolver.normalize_query(query) for query in self.QUERIES]
+        expected = set()
+        for text in texts:
+            expected.update(Medicine.objects.exact(text).values_list("id", flat=True))
+            expected.update(Medicine.objects.search_ids(text, 3))
+        with self.assertNumQueries(4):
+            records = Medicine.objects.candidate_records(texts, 3)
+        brands = dict(Medicine.objects.values_list("id", "brand_name"))
+        self.assertEqual(sorted(record["brand_name"] for record in records), sorted(brands[pk] for pk in expected))
+
+    def test_alias_edits_change_the_catalog_version(self):
+        with override_settings(CATALOG_SOURCE="db"):
+            medicine = Medicine.objects.get(brand_name="Dolo-650")
+            before = resolver.catalog_version()
+            alias = Alias.objects.create(medicine=medicine, name="Dolo Fever")
+            added = resolver.catalog_version()
+            alias.delete()
+            self.assertNotEqual(added, before)
+            self.assertNotIn(resolver.catalog_version(), (before, added))
+
+
+class CatalogReloadTests(SimpleTestCase):
+    """Edits to the CSV are picked up in the background and swapped in whole."""
+
+    NEW_ROW = 'Zyxobrin-20,Zyxoprazole,Zyxoprazole 20mg,Acidity,,,,,,Zyxo\n'
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, "medicines.csv")
+        shutil.copy(resolver.CATALOG_PATH, self.path)
+        for name, value in [("CATALOG_PATH", self.path), ("CATALOG_CHECK_INTERVAL", 0)]:
+            patcher = mock.patch.object(resolver, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        resolver.reset_catalog()
+        self.addCleanup(resolver.reset_catalog)
+
+    def edit_catalog(self):
+        with open(self.path, "a") as f:
+            f.write(self.NEW_ROW)
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_change_is_swapped_in_by_background_reload(self):
+        old = resolver.get_catalog()
+        self.edit_catalog()
+        # The request that notices the change is still served the old catalog
+        self.assertIs(resolver.get_catalog(), old)
+        resolver._reload_thread.join()
+        new = resolver.get_catalog()
+        self.assertEqual(len(new), len(old) + 1)
+        self.assertNotEqual(new.version, old.version)
+        self.assertEqual(resolver.fuzzy_lookup("zyxobrin")[0]["brand_name"], "Zyxobrin-20")
+
+    def test_reload_keeps_catalog_when_file_is_broken(self):
+        old = resolver.get_catalog()
+        with open(self.path, "w") as f:
+            f.write('brand_name,generic\n"unterminated\n')
+        with self.assertLogs("api.resolver", "ERROR"):
+            self.assertIs(resolver.reload_catalog(wait=True), old)
+
+    def test_reload_keeps_catalog_when_file_is_missing(self):
+        old = resolver.get_catalog()
+        os.remove(self.path)
+        with self.assertLogs("api.resolver", "ERROR"):
+            # The mtime check notices the file is gone and starts a reload
+            self.assertIs(resolver.get_catalog(), old)
+            resolver._reload_thread.join()
+        self.assertIs(resolver.get_catalog(), old)
+        self.assertEqual(resolver.fuzzy_lookup("dolo")[0]["brand_name"], "Dolo-650")
+
+    def test_reload_keeps_catalog_when_file_has_no_rows(self):
+        old = resolver.get_catalog()
+        with open(self.path) as f:
+            header = f.readline()
+        with open(self.path, "w") as f:
+            f.write(header)
+        with self.assertLogs("api.resolver", "ERROR"):
+            self.assertIs(resolver.reload_catalog(wait=True), old)
+
+    def test_first_load_of_missing_file_is_empty(self):
+        os.remove(self.path)
+        with self.assertLogs("api.resolver", "ERROR"):
+            self.assertEqual(len(resolver.get_catalog()), 0)
+
+    def test_version_is_reported_and_reload_needs_admin(self):
+        version = resolver.get_catalog().version
+        response = self.client.post("/api/resolve/", {"text": "dolo"})
+        self.assertEqual(response.json()["catalog_version"], version)
+        self.assertEqual(self.client.post("/api/catalog/reload/").status_code, 403)
+
+
+class SuggestTests(SimpleTestCase):
+    def setUp(self):
+        resolver.reset_catalog()
+
+    def brands(self, prefix, **kwargs):
+        return [s["brand_name"] for s in resolver.suggest(prefix, **kwargs)]
+
+    def test_prefix_of_brand_and_later_word(self):
+        self.assertEqual(self.brands("dol")[0], "Dolo-650")
+        self.assertIn("Montek LC", self.brands("lc"))
+
+    def test_limit_and_no_duplicates(self):
+        brands = self.brands("p", limit=3)
+        self.assertLessEqual(len(brands), 3)
+        self.assertEqual(len(brands), len(set(brands)))
+
+    def test_whole_prefix_range_is_ranked(self):
+        # Hundreds of longer names sort alphabetically before the best one
+        rows = [{"brand_name": f"Pa Aaa{i:04d}", "generic": ""} for i in range(2000)]
+        rows.append({"brand_name": "Paz", "generic": ""})
+        catalog = resolver.Catalog(rows)
+        hits = catalog.complete("pa", 3)
+        self.assertEqual(hits[0], (2000, "brand", "paz"))
+        self.assertEqual([row for row, _, _ in hits[1:]], [0, 1])
+        self.assertEqual(catalog.complete("pa", 0), [])
+
+    def test_repeated_rows_do_not_crowd_out_others(self):
+        aliases = ",".join(f"Qb{i}" for i in range(20))
+        catalog = resolver.Catalog([
+            {"brand_name": "Zed", "generic": "", "aliases": aliases},
+            {"brand_name": "Zee", "generic": "", "aliases": "Qbother"},
+        ])
+        self.assertEqual(catalog.complete("qb", 2), [(0, "alias", "qb0"), (1, "alias", "qbother")])
+        self.assertEqual(len(catalog.complete("qb", 5)), 2)
+
+    def test_fuzzy_fallback_is_opt_in(self):
+        self.assertEqual(self.brands("cetrz"), [])
+        self.assertIn("Cetirizine", self.brands("cetrz", fuzzy=True))
+
+    def test_endpoint(self):
+        response = self.client.get("/api/suggest/", {"q": "dol", "limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["suggestions"][0]["brand_name"], "Dolo-650")
+        self.assertEqual(self.client.get("/api/suggest/", {"q": "dol", "limit": "x"}).status_code, 400)
+
+
+def reference_extract_medicines(text):
+    """extract_medicines_from_text as it was before the parser was precompiled."""
+    
+    # Clean and preprocess the text
+    text = re.sub(r'(?<=\d)(?=[a-zA-Z])', ' ', text)  # Add space between number and letter
+    text = re.sub(r'(?<=[a-zA-Z])(?=\d)', ' ', text)  # Add space between letter and number
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)  # Add space between lowercase and uppercase
+    text = re.sub(r'([^\w\s])', r' \1 ', text)  # Add spaces around special characters
+    text = re.sub(r'\s+', ' ', text).strip()  # Normalize spaces
+    
+    
+    # Define patterns for different medicine formats
+    medicine_patterns = [
+        # Pattern 1: Number. MedicineName Strength - Instructions (e.g., "1. Metformin 500mg - Take once daily")
+        r'\b(\d+)\.?\s*([A-Z][a-zA-Z]+)\s+(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)\s*-?\s*(.*?)(?=\d+\.|$)',
+        
+        # Pattern 2: MedicineName (Generic) Strength - Instructions
+        r'\b([A-Z][a-zA-Z]+)\s*\(([a-zA-Z\s]+)\)\s*(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)\s*-?\s*(.*?)(?=\d+\.|$)',
+        
+        # Pattern 3: MedicineName Strength - Instructions (without number)
+        r'\b([A-Z][a-zA-Z]+)\s+(\d+\s*(?:mg|mcg|g|ml|IU|%|mg\/ml|mcg\/ml|g\/ml|mg\/g|mcg\/g|g\/g|%\/ml|%\/g)?)\s*-?\s*(.*?)(?=\d+\.|$)'
+    ]
+    
+    # Common frequency terms
+    frequency_terms = {
+        'once': 'Once daily',
+        'twice': 'Twice daily',
+        'thrice': 'Three times daily',
+        'daily': 'Once daily',
+        'nightly': 'At night',
+        'morning': 'In the morning',
+        'evening': 'In the evening',
+        'bedtime': 'At bedtime',
+        'hs': 'At bedtime',
+        'qhs': 'At bedtime',
+        'ac': 'Before meals',
+        'pc': 'After meals',
+        'prn': 'As needed',
+        'sos': 'As needed',
+        'qd': 'Once daily',
+        'bid': 'Twice daily',
+        'tid': 'Three times daily',
+        'qid': 'Four times daily',
+        'qod': 'Every other day'
+    }
+    
+    medicines = []
+    
+    # Try each pattern to extract medicines
+    for pattern in medicine_patterns:
+        matches = re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE)
+        for match in matches:
+            groups = [g.strip() if g else '' for g in match.groups()]
+            
+            # Extract medicine details based on pattern
+            if len(groups) >= 4:  # Pattern 1 or 2
+                if groups[0].isdigit():  # Pattern 1
+                    name = groups[1]
+                    strength = groups[2]
+                    instructions = groups[3]
+                    generic = ''
+                else:  # Pattern 2
+                    name = groups[0]
+                    generic = groups[1]
+                    strength = groups[2]
+                    instructions = groups[3] if len(groups) > 3 else ''
+            else:  # Pattern 3
+                name = groups[0]
+                strength = groups[1] if len(groups) > 1 else ''
+                instructions = groups[2] if len(groups) > 2 else ''
+                generic = ''
+            
+            # Extract frequency from instructions
+            frequency = 'As directed'
+            for term, freq in frequency_terms.items():
+                if term.lower() in instructions.lower():
+                    frequency = freq
+                    break
+            
+            # Create medicine dictionary
+            medicine = {
+                'brand_name': name,
+                'generic': generic or name,
+                'prescribed_dosage': strength,
+                'prescribed_timing': frequency,
+                'instructions': instructions,
+                'match_score': 1.0
+            }
+            
+            # Add to medicines list if not already present
+            medicine_key = f"{name.lower()}_{strength.lower()}"
+            if medicine_key not in [f"{m['brand_name'].lower()}_{m['prescribed_dosage'].lower()}" for m in medicines]:
+                medicines.append(medicine)
+    
+    return medicines
+
+
+class PrescriptionParserTests(SimpleTestCase):
+    """The precompiled parser must give exactly the old parser's output."""
+
+    NAMES = ["Metformin", "amlodipine", "PARACETAMOL", "Dolo", "TabCrocin", "Azithral", "Pan"]
+    UNITS = ["mg", "mcg", "g", "ml", "IU", "%", "mg/ml", "MG", "", "tabs"]
+    WORDS = [
+        "take", "once", "twice", "daily", "bid", "TDS", "qhs", "at", "bedtime", "after", "food",
+        "sos", "prn", "morning", "x", "5", "days", "Rx", "Dr.", "tablets", "ac", "pc", "qod",
+    ]
+    PUNCT = [".", "-", ",", "(", ")", ":", "/", "\n", "  ", "\t", "*", "é", "_"]
+
+    EXAMPLES = [
+        "1. Metformin 500mg - Take once daily\n2. Amlodipine 5mg - twice a day",
+        "Augmentin (Amoxicillin Clavulanate) 625mg - bid after food",
+        "Rx\nTab.Dolo650 1-0-1 x 5 days\nCap Pan40 qhs",
+        "",
+        "no medicines here",
+    ]
+
+    def random_prescription(self, rng):
+        parts = []
+        for _ in range(rng.randint(1, 6)):
+            line = []
+            if rng.random() < 0.5:
+                line.append(f"{rng.randint(1, 12)}{rng.choice(['.', '. ', ' ', ''])}")
+            line.append(rng.choice(self.NAMES))
+            if rng.random() < 0.3:
+                line.append(f"({rng.choice(self.NAMES)} {rng.choice(self.NAMES)})")
+            line.append(f"{rng.randint(1, 1000)}{rng.choice(['', ' '])}{rng.choice(self.UNITS)}")
+            if rng.random() < 0.7:
+                line.append(rng.choice(["-", " - ", ""]))
+            line.extend(rng.choice(self.WORDS + self.PUNCT) for _ in range(rng.randint(0, 8)))
+            parts.append(rng.choice([" ", ""]).join(line))
+        return rng.choice(["\n", " ", "; "]).join(parts)
+
+    def assert_same(self, text):
+        self.assertEqual(resolver.extract_medicines_from_text(text), reference_extract_medicines(text), text)
+
+    def test_examples(self):
+        for text in self.EXAMPLES:
+            with self.subTest(text=text):
+                self.assert_same(text)
+
+    def test_random_prescriptions(self):
+        rng = random.Random(1234)
+        for _ in range(2000):
+            self.assert_same(self.random_prescription(rng))
+
+
+class PrescriptionResolutionTests(SimpleTestCase):
+    def setUp(self):
+        resolver.reset_catalog()
+
+    def test_names_are_matched_to_catalog_in_one_batch(self):
+        text = "Dolo 650mg - twice daily after food"
+        with mock.patch.object(services, "batch_lookup_groups", wraps=services.batch_lookup_groups) as lookup:
+            payload = services.format_prescription(text)
+        lookup.assert_called_once()
+        med = payload["medicines"][0]
+        self.assertTrue(med["in_catalog"])
+        self.assertEqual(med["brand_name"], "Dolo-650")
+        self.assertEqual(med["prescribed_name"], "Dolo")
+        self.assertEqual(med["prescribed_dosage"], "650 mg")
+        self.assertEqual(med["prescribed_timing"], "Twice daily")
+        self.assertTrue(med["uses"])
+        self.assertTrue(med["side_effects"])
+        self.assertEqual(payload["unknown_count"], 0)
+
+    def test_unknown_names_are_flagged(self):
+        med = services.format_prescription("Zyqxtrol 20mg once daily")["medicines"][0]
+        self.assertFalse(med["in_catalog"])
+        self.assertEqual(med["brand_name"], "Zyqxtrol")
+        self.assertEqual(med["match_score"], 0.0)
+        self.assertEqual(med["uses"], "")
+
+
+class ExtractorTests(SimpleTestCase):
+    def setUp(self):
+        extractors._extractor = None
+        self.addCleanup(setattr, extractors, "_extractor", None)
+
+    def doc(self, text, *entities):
+        ents = []
+        for value, label in entities:
+            start = text.index(value)
+            ents.append(SimpleNamespace(text=value, label_=label, start_char=start, end_char=start + len(value)))
+        return SimpleNamespace(text=text, ents=ents)
+
+    def test_entities_are_grouped_into_medicines(self):
+        doc = self.doc(
+            "Dolo-650 Paracetamol 650mg - twice daily\nAmoxicillin 500mg tid",
+            ("Dolo-650", "BRAND"), ("Paracetamol", "GENERIC"), ("650mg", "STRENGTH"),
+            ("Amoxicillin", "GENERIC"), ("500mg", "STRENGTH"),
+        )
+        self.assertEqual(extractors.medicines_from_entities(doc), [
+            {"brand_name": "Dolo-650", "generic": "Paracetamol", "prescribed_dosage": "650mg",
+             "prescribed_timing": "Twice daily", "instructions": "twice daily", "match_score": 1.0},
+            {"brand_name": "Amoxicillin", "generic": "Amoxicillin", "prescribed_dosage": "500mg",
+             "prescribed_timing": "Three times daily", "instructions": "tid", "match_score": 1.0},
+        ])
+
+    def test_selection(self):
+        with override_settings(PRESCRIPTION_EXTRACTOR="regex"):
+            self.assertEqual(extractors.get_extractor().name, "regex")
+        extractors._extractor = None
+        with override_settings(PRESCRIPTION_EXTRACTOR="auto", NER_MODEL_PATH="/nonexistent"):
+            self.assertEqual(extractors.get_extractor().name, "regex")
+        extractors._extractor = None
+        with override_settings(PRESCRIPTION_EXTRACTOR="ner", NER_MODEL_PATH="/nonexistent"):
+            with self.assertRaises((ImportError, OSError)):
+                extractors.get_extractor()
+
+
+class AsyncViewTests(SimpleTestCase):
+    """The ASGI views run OCR on the offload pool without blocking the event loop."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+        self.factory = AsyncRequestFactory()
+
+    def upload(self, **extra):
+        # Random pixels so no earlier result is served from the cache
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        data = cv2.imencode(".png", image)[1].tobytes()
+        return self.factory.post(
+            "/api/process-strip/", {"image": SimpleUploadedFile("strip.png", data, "image/png"), **extra}
+        )
+
+    async def test_strip_is_resolved(self):
+        with mock.patch.object(ocr_engine, "recognize", return_value=("Dolo 650 tablet", 95.0)):
+            response = await async_views.process_strip(self.upload())
+        self.assertEqual(response.status_code, 200)
+        brands = [m["brand_name"] for m in json.loads(response.content)["medicines"]]
+        self.assertIn("Dolo-650", brands)
+
+    async def test_event_loop_keeps_running_during_ocr(self):
+        def slow_recognize(*args, **kwargs):
+            time.sleep(0.3)
+            return "Dolo 650 tablet", 95.0
+
+        with mock.patch.object(ocr_engine, "recognize", side_effect=slow_recognize):
+            task = asyncio.ensure_future(async_views.process_strip(self.upload()))
+            started = time.monotonic()
+            await asyncio.sleep(0.05)
+            self.assertLess(time.monotonic() - started, 0.2)
+            self.assertFalse(task.done())
+            response = await task
+        self.assertEqual(response.status_code, 200)
+
+    async def test_drf_permissions_apply(self):
+        with mock.patch.object(views.StripProcessView, "permission_classes", [IsAuthenticated]), \
+                mock.patch.object(ocr_engine, "recognize") as recognize:
+            response = await async_views.process_strip(self.upload())
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json.loads(response.content)["detail"], "Authentication credentials were not provided.")
+        recognize.assert_not_called()
+
+    async def test_drf_throttles_apply(self):
+        class Closed(BaseThrottle):
+            def allow_request(self, request, view):
+                return False
+
+            def wait(self):
+                return 7
+
+        with mock.patch.object(views.OCRView, "throttle_classes", [Closed]):
+            response = await async_views.ocr(self.upload())
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+
+    async def test_full_pool_is_rejected(self):
+        with mock.patch.object(async_views, "get_offload_executor", return_value=jobs.BoundedExecutor(1, 0)):
+            response = await async_views.process_strip(self.upload())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+
+    async def test_missing_image(self):
+        response = await async_views.process_strip(self.factory.post("/api/process-strip/", {}))
+        self.assertEqual(response.status_code, 400)
+
+    def batch(self, count):
+        images = [
+            SimpleUploadedFile(
+                f"strip-{i}.png",
+                cv2.imencode(".png", np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8))[1].tobytes(),
+                "image/png",
+            )
+            for i in range(count)
+        ]
+        return self.factory.post("/api/process-batch/", {"images": images, "kind": "strip"})
+
+    def batch_pool(self):
+        patcher = mock.patch.object(jobs, "ProcessPoolExecutor", side_effect=thread_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_batch_executor()
+        self.addCleanup(jobs.reset_batch_executor)
+
+    async def test_batch_streams_lines(self):
+        self.batch_pool()
+        with mock.patch.object(services, "ocr_text", return_value="Dolo 650 tablet"):
+            response = await async_views.process_batch(self.batch(2))
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            lines = [json.loads(chunk) async for chunk in response]
+        self.assertEqual(lines[-1], {"done": True, "count": 2})
+        self.assertEqual(sorted(line["index"] for line in lines[:-1]), [0, 1])
+
+    async def test_resolve_is_served_while_a_batch_runs(self):
+        self.batch_pool()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def ocr_text(bytes_data, trace=None, kind="ocr"):
+            release.wait(5)
+            return "Dolo 650 tablet"
+
+        with mock.patch.object(services, "ocr_text", side_effect=ocr_text):
+            response = await async_views.process_batch(self.batch(1))
+
+            async def drain():
+                return [json.loads(chunk) async for chunk in response]
+
+            task = asyncio.ensure_future(drain())
+            await asyncio.sleep(0.05)
+            # Sync views run on the shared sync thread, as under ASGI
+            resolve = sync_to_async(views.ResolveView.as_view())
+            request = self.factory.post("/api/resolve/", {"text": "dolo"}, content_type="application/json")
+            resolved = await asyncio.wait_for(resolve(request), timeout=2)
+            self.assertFalse(task.done())
+            release.set()
+            lines = await task
+        self.assertEqual(resolved.status_code, 200)
+        self.assertEqual(lines[-1], {"done": True, "count": 1})
+
+    async def test_batch_with_full_pool_is_rejected(self):
+        with mock.patch.object(async_views, "get_offload_executor", return_value=jobs.BoundedExecutor(1, 0)):
+            response = await async_views.process_batch(self.batch(1))
+        self.assertEqual(response.status_code, 503)
+
+
+class BenchmarkTests(SimpleTestCase):
+    """The benchmark corpus is reproducible and the report covers every stage."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+
+    def test_corpus_is_deterministic(self):
+        first = benchmarks.build_corpus(per_variant=2, seed=7)
+        second = benchmarks.build_corpus(per_variant=2, seed=7)
+        self.assertEqual([s["image"] for s in first], [s["image"] for s in second])
+        self.assertEqual({s["variant"] for s in first}, set(benchmarks.VARIANTS))
+        highres = next(s for s in first if s["variant"] == "highres")
+        image = cv2.imdecode(np.frombuffer(highres["image"], np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(image.shape[1], benchmarks.STRIP_SIZE[0] * benchmarks.HIGHRES_SCALE)
+
+    def test_run_reports_stages_throughput_and_accuracy(self):
+        with mock.patch.object(ocr_engine, "recognize", return_value=("Dolo 650 tablet", 95.0)):
+            results = benchmarks.run(per_variant=1, workers=(1, 2), variants=("clean", "noisy"))
+        json.dumps(results)
+        for stage in ("ocr_total", "resolve", "fuzzy_lookup", "suggest"):
+            self.assertGreater(results["stages"][stage]["count"], 0)
+            self.assertLessEqual(results["stages"][stage]["p50_ms"], results["stages"][stage]["p95_ms"])
+        self.assertEqual([run["workers"] for run in results["throughput"]], [1, 2])
+        self.assertTrue(all(run["failed"] == 0 for run in results["throughput"]))
+        self.assertEqual(set(results["accuracy"]["by_variant"]), {"clean", "noisy"})
+        self.assertGreater(results["memory"]["peak_rss_mb"], 0)
+
+        rows = benchmarks.compare(results, results)
+        self.assertTrue(rows)
+        self.assertTrue(all(change == 0 for *_, change in rows))
+
+
+class MetricsTests(SimpleTestCase):
+    """/api/metrics/ exposes request, OCR, cache and lookup metrics."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+        cache.reset_cache()
+        self.addCleanup(cache.reset_cache)
+        metrics.reset()
+
+    def scrape(self):
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        return response.content.decode()
+
+    def sample(self, text, series):
+        """Value of the sample line starting with ``series``."""
+        for line in text.splitlines():
+            if line.startswith(series + " "):
+                return float(line.rsplit(" ", 1)[1])
+        self.fail(f"{series} not in metrics:\n{text}")
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.003, 0.2, 0.2, 45):
+            metrics.histogram("test_seconds", value, view="x")
+        text = metrics.render()
+        self.assertIn("# TYPE test_seconds histogram", text)
+        self.assertEqual(self.sample(text, 'test_seconds_bucket{view="x",le="0.005"}'), 1)
+        self.assertEqual(self.sample(text, 'test_seconds_bucket{view="x",le="0.25"}'), 3)
+        self.assertEqual(self.sample(text, 'test_seconds_bucket{view="x",le="30"}'), 3)
+        self.assertEqual(self.sample(text, 'test_seconds_bucket{view="x",le="+Inf"}'), 4)
+        self.assertEqual(self.sample(text, 'test_seconds_count{view="x"}'), 4)
+
+    def test_label_values_are_escaped(self):
+        metrics.inc("test_total", label='a "b"\\c')
+        self.assertIn('test_total{label="a \\"b\\"\\\\c"} 1', metrics.render())
+
+    def test_request_metrics(self):
+        self.client.post("/api/resolve/", {"text": "Dolo 650\nCrocin Advance"}, content_type="application/json")
+        text = self.scrape()
+        self.assertEqual(self.sample(text, 'http_requests_total{method="POST",status="200",view="resolve"}'), 1)
+        self.assertEqual(
+            self.sample(text, 'http_request_duration_seconds_count{method="POST",view="resolve"}'), 1
+        )
+        # Both lines were resolved with a single batched lookup
+        self.assertEqual(self.sample(text, 'resolver_lookups_per_request_bucket{view="resolve",le="1"}'), 1)
+        self.assertEqual(self.sample(text, 'resolver_lookups_per_request_bucket{view="resolve",le="0"}'), 0)
+        self.assertGreater(self.sample(text, "catalog_size"), 0)
+
+    def test_ocr_pass_and_cache_metrics(self):
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        data = cv2.imencode(".png", image)[1].tobytes()
+
+        def recognize(image, config="", timeout=None, cancel=None):
+            # The PSM 6 pass reads nothing, so the PSM 4 retry is kept
+            if "--psm 6" in config:
+                return "", 0.0
+            return ("Dolo 650 tablet", 90.0) if "--psm 4" in config else ("Dolo", 50.0)
+
+        with mock.patch.object(ocr_engine, "recognize", side_effect=recognize), \
+                override_settings(OCR_TEXT_REGIONS=[], OCR_PASS_TIMEOUT=20, OCR_PASS_WORKERS=3):
+            # A pool of its own, so no other test's passes run alongside
+            ocr_utils.reset_pass_executor()
+            self.addCleanup(ocr_utils.reset_pass_executor)
+            for _ in range(2):
+                upload = SimpleUploadedFile("strip.png", data, "image/png")
+                self.assertEqual(self.client.post("/api/process-strip/", {"image": upload}).status_code, 200)
+        text = self.scrape()
+        self.assertEqual(self.sample(text, 'ocr_pass_selected_total{pass="psm4"}'), 1)
+        self.assertEqual(self.sample(text, 'ocr_fallbacks_total{fallback="psm4"}'), 1)
+        self.assertEqual(self.sample(text, 'ocr_pass_results_total{outcome="empty",pass="psm6"}'), 1)
+        # The second upload of the same image is served from the cache
+        self.assertEqual(self.sample(text, 'ocr_cache_requests_total{result="local_hit"}'), 1)
+        hits = 1 / (1 + self.sample(text, 'ocr_cache_requests_total{result="miss"}'))
+        self.assertAlmostEqual(self.sample(text, "ocr_cache_hit_ratio"), hits)
+        self.assertIn('ocr_stage_duration_seconds_count{pipeline="standard",stage="decode"}', text)
+
+
+class ProfilingTests(TestCase):
+    """Sampled profiles of slow endpoints are kept in a bounded ring for admins."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.settings = override_settings(PROFILE_DIR=self.directory, PROFILE_KEEP=3, PROFILE_SAMPLE_RATE=1)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        profiling.reset_ring()
+        self.addCleanup(profiling.reset_ring)
+        resolver.reset_catalog()
+
+    def profile(self):
+        profile = profiling.RequestProfile()
+        self.assertTrue(profile.start())
+        sum(range(1000))
+        profile.stop()
+        return profile
+
+    def test_ring_keeps_slowest(self):
+        ring = profiling.get_ring()
+        for index, duration in enumerate([50, 10, 80, 30, 20]):
+            meta = {"id": f"p{index}", "path": "/api/process-strip/", "duration_ms": duration}
+            ring.add(meta, self.profile())
+        self.assertEqual([entry["duration_ms"] for entry in ring.entries()], [80, 50, 30])
+        self.assertEqual(len(os.listdir(self.directory)), 3 * len(profiling.PROFILE_FILES))
+        self.assertFalse(ring.would_keep(25))
+        self.assertIsNone(ring.path("../etc", "prof"))
+
+    def test_only_one_request_profiled_at_a_time(self):
+        first = profiling.RequestProfile()
+        self.assertTrue(first.start())
+        self.assertFalse(profiling.RequestProfile().start())
+        first.stop()
+
+    def sampled_strip(self):
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        upload = SimpleUploadedFile("strip.png", cv2.imencode(".png", image)[1].tobytes(), "image/png")
+        with mock.patch.object(ocr_engine, "recognize", return_value=("Dolo 650 tablet", 95.0)):
+            self.assertEqual(self.client.post("/api/process-strip/", {"image": upload}).status_code, 200)
+        profiling._writer.submit(lambda: None).result()
+
+    def test_sampled_request_is_saved_and_downloadable(self):
+        self.sampled_strip()
+        self.client.get("/api/catalog/")
+        self.assertEqual(len(profiling.get_ring().entries()), 1)
+
+        self.assertEqual(self.client.get("/api/profiles/").status_code, 403)
+        User.objects.create_superuser("admin", "admin@example.com", "secret")
+        self.client.login(username="admin", password="secret")
+        (entry,) = self.client.get("/api/profiles/").json()["profiles"]
+        self.assertEqual(entry["path"], "/api/process-strip/")
+
+        response = self.client.get(entry["downloads"]["prof"])
+        self.assertEqual(response.status_code, 200)
+        path = os.path.join(self.directory, "download.prof")
+        with open(path, "wb") as f:
+            f.write(b"".join(response.streaming_content))
+        stats = pstats.Stats(path)
+        self.assertTrue(any(func[2] == "process_strip" for func in stats.stats))
+        self.assertEqual(self.client.get(f"/api/profiles/{entry['id']}/?file=nope").status_code, 404)
+
+    def test_middleware_not_installed_when_rate_is_zero(self):
+        with override_settings(PROFILE_SAMPLE_RATE=0):
+            self.sampled_strip()
+        self.assertEqual(profiling.get_ring().entries(), [])
+
+
+class CompactCatalogTests(SimpleTestCase):
+    """The catalog keeps columns, not row dicts, and builds match dicts on demand."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+
+    def test_repeated_text_is_stored_once(self):
+        rows = [
+            {"brand_name": f"Brand-{i}", "generic": "Paracetamol", "uses": "Fever", "side_effects": None}
+            for i in range(50)
+        ]
+        catalog = resolver.Catalog(rows)
+        self.assertEqual(catalog.columns["uses"].values, ["Fever"])
+        self.assertEqual(len(catalog.columns["brand_name"].values), 50)
+        self.assertEqual(catalog.exact_rows("paracetamol"), tuple(range(50)))
+        self.assertEqual(catalog.exact_rows("brand-7"), (7,))
+        # Missing cells read as empty strings
+        self.assertEqual(catalog.record(3, ["brand_name", "side_effects"]), {"brand_name": "Brand-3", "side_effects": ""})
+
+    def test_lookups_only_build_requested_fields(self):
+        full = resolver.fuzzy_lookup("dolo 650")[0]
+        self.assertEqual(set(full) - {"match_score"}, set(resolver.get_catalog().fields))
+        (partial,), = resolver.batch_lookup_groups([[("dolo 650", 45)]], limit=1, fields=["brand_name"])
+        self.assertEqual(partial, {"brand_name": full["brand_name"], "match_score": full["match_score"]})
+
+        catalog, (hits,) = resolver.match_groups([[("dolo 650", 45)]], limit=1)
+        self.assertIs(catalog, resolver.get_catalog())
+        self.assertEqual(catalog.value(hits[0][0], "brand_name"), full["brand_name"])
+
+    def test_malformed_csv_is_rejected(self):
+        with self.assertRaises(ValueError):
+            resolver.Catalog(resolver._read_csv_rows(b"brand_name,generic\nDolo,Paracetamol,extra\n"))
+
+
+class OCRPassTests(SimpleTestCase):
+    """Concurrent OCR passes stop their losers and time out per pass, not per queue."""
+
+    def passes(self):
+        image = np.zeros((20, 20), dtype=np.uint8)
+        return ocr_utils.ocr_passes(image, image)
+
+    def test_back_to_back_calls_do_not_time_out(self):
+        # Losing passes that can't be interrupted still hold pool threads,
+        # but queueing behind them doesn't count against a pass's timeout
+        def recognize(image, config="", timeout=None, cancel=None):
+            if "--psm 6" in config:
+                time.sleep(0.1)
+                return "Dolo 650", 95.0
+            time.sleep(2)
+            return "Dolo", 10.0
+
+        with mock.patch.object(ocr_engine, "recognize", side_effect=recognize):
+            for _ in range(3):
+                self.assertEqual(ocr_utils.run_passes(self.passes(), timeout=1.5)[0], "psm6")
+
+    def test_losing_passes_are_cancelled(self):
+        stopped = []
+
+        def recognize(image, config="", timeout=None, cancel=None):
+            if "--psm 6" in config:
+                return "Dolo 650", 95.0
+            cancelled = cancel.wait(5)
+            stopped.append(cancelled)
+            raise ocr_engine.Cancelled() if cancelled else AssertionError("pass was not cancelled")
+
+        started = time.monotonic()
+        with mock.patch.object(ocr_engine, "recognize", side_effect=recognize):
+            self.assertEqual(ocr_utils.run_passes(self.passes(), timeout=10)[0], "psm6")
+            ocr_utils._get_pass_executor().submit(time.sleep, 0).result()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(all(stopped))
+
+    def test_overrunning_pass_times_out(self):
+        def recognize(image, config="", timeout=None, cancel=None):
+            cancel.wait(5)
+            return "", 0.0
+
+        started = time.monotonic()
+        with mock.patch.object(ocr_engine, "recognize", side_effect=recognize):
+            self.assertEqual(ocr_utils.run_passes(self.passes(), timeout=0.2), (None, "", 0.0))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_regions_share_one_deadline(self):
+        image = np.zeros((100, 400), dtype=np.uint8)
+        regions = [(0, i * 10, 400, 10) for i in range(10)]
+        calls = []
+
+        def recognize(image, config="", timeout=None, cancel=None):
+            calls.append(timeout)
+            if len(calls) <= 3:
+                return f"line {len(calls)}", 90.0
+            # Later crops outlast the request's budget until cancelled
+            cancel.wait(5)
+            raise ocr_engine.Cancelled()
+
+        started = time.monotonic()
+        with mock.patch.object(ocr_engine, "recognize", side_effect=recognize):
+            text, confidence = ocr_utils.ocr_regions(image, regions, timeout=0.3)
+        # One budget for all ten crops, not one per crop
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(text.splitlines(), ["line I", "line Z", "line 3"])
+        self.assertLessEqual(max(calls), 0.3 + 1e-6)
+        self.assertLess(len(calls), len(regions))
+
+    def test_regions_are_opt_in(self):
+        self.assertFalse(services.regions_for("strip"))
+
+
+class PreprocessTests(SimpleTestCase):
+    """The opt-in pipelines cap image size before the costlier stages."""
+
+    def test_large_images_are_resized_first(self):
+        timings = {}
+        large = np.random.randint(0, 255, (3000, 4000, 3), dtype=np.uint8)
+        self.assertEqual(ocr_utils.preprocess(large, "fast", timings=timings).shape, (1500, 2000))
+        self.assertEqual(next(iter(timings)), "resize")
+
+        small = np.random.randint(0, 255, (600, 800, 3), dtype=np.uint8)
+        self.assertIs(ocr_utils.resize_image(small), small)
+
+    def test_default_pipelines_keep_full_resolution(self):
+        large = np.random.randint(0, 255, (2400, 3200, 3), dtype=np.uint8)
+        for name in ("standard", "strip"):
+            self.assertEqual(ocr_utils.preprocess(large, name).shape, (2400, 3200))
+
+
+class FakeTessAPI:
+    """Records what TesserocrBackend does with a PyTessBaseAPI handle."""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.variables = {"preserve_interword_spaces": "0"}
+        self.recognized = []
+
+    def GetVariableAsString(self, key):
+        return self.variables.get(key)
+
+    def SetVariable(self, key, value):
+        self.variables[key] = value
+
+    def SetPageSegMode(self, psm):
+        self.psm = psm
+
+    def SetImageBytes(self, data, width, height, channels, bytes_per_line):
+        self.image = (width, height, channels)
+        self.seen = dict(self.variables)
+
+    def Recognize(self, timeout=0):
+        self.recognized.append(timeout)
+        return timeout != 1
+
+    def GetUTF8Text(self):
+        return "Dolo 650\n"
+
+    def MeanTextConf(self):
+        return 88
+
+    def Clear(self):
+        pass
+
+
+class TesserocrBackendTests(SimpleTestCase):
+    """Config strings map onto tesserocr calls and handles are reused per thread."""
+
+    def setUp(self):
+        class PSM(int):
+            AUTO = 3
+
+        self.handles = []
+
+        def api(**kwargs):
+            self.handles.append(FakeTessAPI(**kwargs))
+            return self.handles[-1]
+
+        fake = SimpleNamespace(PyTessBaseAPI=api, OEM=int, PSM=PSM)
+        patcher = mock.patch.object(ocr_engine, "tesserocr", fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = ocr_engine.TesserocrBackend()
+        self.image = np.zeros((10, 30), dtype=np.uint8)
+
+    def test_parse_config(self):
+        self.assertEqual(ocr_engine.parse_config(""), (None, None, {}))
+        self.assertEqual(
+            ocr_engine.parse_config(
+                "--oem 3 --psm 6 -c preserve_interword_spaces=1 --user-words ./words.txt "
+                "-c tessedit_char_whitelist=ABC-+/.()[],:;% --dpi 300"
+            ),
+            (3, 6, {
+                "preserve_interword_spaces": "1",
+                "user_words_file": "./words.txt",
+                "tessedit_char_whitelist": "ABC-+/.()[],:;%",
+            }),
+        )
+
+    def test_handles_are_reused_per_thread(self):
+        # The constructor's check created the first handle on this thread
+        self.assertEqual(self.backend.recognize(self.image, "--psm 6"), ("Dolo 650\n", 88.0))
+        self.backend.recognize(self.image, "--psm 4")
+        self.assertEqual(len(self.handles), 1)
+        # A different OEM or init-only variable needs its own handle
+        self.backend.recognize(self.image, "--oem 1 --psm 6")
+        self.backend.recognize(self.image, "--psm 6 -c load_system_dawg=1")
+        self.backend.recognize(self.image, "--oem 1 --psm 7")
+        self.assertEqual(len(self.handles), 3)
+        self.assertEqual(self.handles[1].kwargs["oem"], 1)
+        self.assertEqual(self.handles[2].kwargs["variables"], {"load_system_dawg": "1"})
+        # Other threads get their own
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(lambda _: self.backend.recognize(self.image, "--psm 6"), range(4)))
+        self.assertIn(len(self.handles), (4, 5))
+
+    def test_runtime_variables_apply_to_one_call(self):
+        self.backend.recognize(self.image, "--psm 7 -c preserve_interword_spaces=1", timeout=2.5)
+        handle = self.handles[0]
+        self.assertEqual(handle.psm, 7)
+        self.assertEqual(handle.seen["preserve_interword_spaces"], "1")
+        self.assertEqual(handle.variables["preserve_interword_spaces"], "0")
+        self.assertEqual(handle.image, (30, 10, 1))
+        self.assertEqual(handle.recognized, [2500])
+
+    def test_timeout_and_cancel(self):
+        with self.assertRaises(RuntimeError):
+            self.backend.recognize(self.image, timeout=0.001)
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(ocr_engine.Cancelled):
+            self.backend.recognize(self.image, cancel=cancel)
+        self.assertEqual(self.handles[0].recognized, [1])
+
+
+class PytesseractBackendTests(SimpleTestCase):
+    """The pytesseract backend parses the CLI's TSV and kills it when cancelled."""
+
+    TSV = (
+        "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+        "5\t1\t1\t1\t1\t1\t0\t0\t10\t10\t90\tDolo\n"
+        "5\t1\t1\t1\t1\t2\t0\t0\t10\t10\t80\t650\n"
+        "5\t1\t1\t1\t2\t1\t0\t0\t10\t10\t-1\t\n"
+    )
+
+    def fake_tesseract(self, body):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "tesseract")
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n" + body)
+        os.chmod(path, 0o755)
+        patcher = mock.patch("pytesseract.pytesseract.tesseract_cmd", path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return directory
+
+    def test_tsv_is_parsed(self):
+        self.fake_tesseract(f"printf '{self.TSV}' > \"$2.tsv\"\n")
+        image = np.zeros((20, 20), dtype=np.uint8)
+        self.assertEqual(ocr_engine.PytesseractBackend().recognize(image, "--psm 6"), ("Dolo 650", 85.0))
+
+    def test_ocr_lang_is_passed(self):
+        directory = self.fake_tesseract(f"echo \"$@\" > \"$(dirname \"$0\")/args\"\nprintf '{self.TSV}' > \"$2.tsv\"\n")
+        with mock.patch.object(ocr_engine, "_backend", None), \
+                override_settings(OCR_BACKEND="pytesseract", OCR_LANG="eng+hin"):
+            ocr_engine.recognize(np.zeros((20, 20), dtype=np.uint8), "--psm 6")
+        with open(os.path.join(directory, "args")) as f:
+            args = f.read().split()
+        self.assertEqual(args[2:4], ["-l", "eng+hin"])
+
+    def test_cancel_kills_the_process(self):
+        self.fake_tesseract("exec sleep 5\n")
+        cancel = threading.Event()
+        threading.Timer(0.1, cancel.set).start()
+        started = time.monotonic()
+        with self.assertRaises(ocr_engine.Cancelled):
+            ocr_engine.PytesseractBackend().recognize(np.zeros((20, 20), dtype=np.uint8), cancel=cancel)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_timeout_kills_the_process(self):
+        self.fake_tesseract("exec sleep 5\n")
+        started = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            ocr_engine.PytesseractBackend().recognize(np.zeros((20, 20), dtype=np.uint8), timeout=0.2)
+        self.assertLess(time.monotonic() - started, 2)
+
+
+def thread_pool(max_workers=None, initializer=None, initargs=()):
+    """Stands in for the job/batch process pools so mocks reach the workers."""
+    return ThreadPoolExecutor(max_workers)
+
+
+class JobCacheCheckTests(SimpleTestCase):
+    """Job state must be kept in a cache every web worker can read."""
+
+    def test_default_settings_pass(self):
+        self.assertEqual(checks.run_checks(), [])
+
+    def test_process_local_cache_warns(self):
+        with override_settings(OCR_JOB_CACHE="default"):
+            self.assertEqual([m.id for m in checks.run_checks()], ["api.W001"])
+
+    def test_undefined_alias_is_an_error(self):
+        with override_settings(OCR_JOB_CACHE="nowhere"):
+            self.assertEqual([m.id for m in checks.run_checks()], ["api.E001"])
+
+
+class JobTests(SimpleTestCase):
+    """?async=1 submits a job (202), polls it to its result and sheds load with a 503."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+        patcher = mock.patch.object(jobs, "ProcessPoolExecutor", side_effect=thread_pool)
+        self.pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_manager()
+        self.addCleanup(jobs.reset_manager)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def recognize(self, image, config="", timeout=None, cancel=None):
+        self.release.wait(5)
+        return "Dolo 650 tablet", 95.0
+
+    def submit(self):
+        # Random pixels so no earlier result is served from the cache
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        upload = SimpleUploadedFile("strip.png", cv2.imencode(".png", image)[1].tobytes(), "image/png")
+        return self.client.post("/api/process-strip/?async=1", {"image": upload})
+
+    def poll(self, url, until):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            state = self.client.get(url).json()
+            if state["status"] in until:
+                return state
+            time.sleep(0.02)
+        self.fail(f"job never reached {until}: {state}")
+
+    def test_job_lifecycle(self):
+        with mock.patch.object(ocr_engine, "recognize", side_effect=self.recognize):
+            response = self.submit()
+            self.assertEqual(response.status_code, 202)
+            job = response.json()
+            self.assertEqual(job["status"], "queued")
+            self.assertEqual(job["status_url"], f"/api/jobs/{job['job_id']}/")
+            self.assertEqual(self.poll(job["status_url"], {"running"})["kind"], "strip")
+            self.release.set()
+            state = self.poll(job["status_url"], {"done", "failed"})
+        self.assertEqual(state["status"], "done")
+        self.assertIn("Dolo-650", [m["brand_name"] for m in state["result"]["medicines"]])
+        self.assertEqual(self.client.get("/api/jobs/0123abcd/").status_code, 404)
+
+    @override_settings(OCR_JOB_QUEUE_SIZE=1)
+    def test_full_queue_is_rejected(self):
+        with mock.patch.object(ocr_engine, "recognize", side_effect=self.recognize):
+            first = self.submit()
+            self.assertEqual(first.status_code, 202)
+            response = self.submit()
+            self.release.set()
+            # Finish the queued job while OCR is still mocked
+            self.poll(first.json()["status_url"], {"done", "failed"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(response.json()["error"], "queue_full")
+
+    def test_broken_pool_is_replaced(self):
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool("A worker died")
+        self.pool.side_effect = [broken, thread_pool(1)]
+        self.release.set()
+        restarts = metrics.counter_value("process_pool_restarts_total", pool="job")
+        with mock.patch.object(ocr_engine, "recognize", side_effect=self.recognize):
+            response = self.submit()
+            self.assertEqual(response.status_code, 202)
+            state = self.poll(response.json()["status_url"], {"done", "failed"})
+        self.assertEqual(state["status"], "done")
+        broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        self.assertEqual(metrics.counter_value("process_pool_restarts_total", pool="job"), restarts + 1)
+
+
+class BatchTests(SimpleTestCase):
+    """/api/process-batch/ streams one NDJSON line per image, then a done line."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+        patcher = mock.patch.object(jobs, "ProcessPoolExecutor", side_effect=thread_pool)
+        self.pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        jobs.reset_batch_executor()
+        self.addCleanup(jobs.reset_batch_executor)
+
+    def images(self, count):
+        # Random pixels so no earlier result is served from the cache
+        return [
+            cv2.imencode(".png", np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8))[1].tobytes()
+            for _ in range(count)
+        ]
+
+    def post(self, images):
+        uploads = [SimpleUploadedFile(f"strip-{i}.png", data, "image/png") for i, data in enumerate(images)]
+        response = self.client.post("/api/process-batch/", {"images": uploads, "kind": "strip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_lines_per_image_and_done(self):
+        images = self.images(4)
+
+        def ocr_text(bytes_data, trace=None, kind="ocr"):
+            if bytes_data == images[2]:
+                raise RuntimeError("Tesseract crashed")
+            return "Dolo 650 tablet"
+
+        with mock.patch.object(services, "ocr_text", side_effect=ocr_text):
+            lines = self.post(images)
+        self.assertEqual(lines[-1], {"done": True, "count": 4})
+        by_index = {line["index"]: line for line in lines[:-1]}
+        self.assertEqual(len(lines) - 1, len(by_index))
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3])
+        for index, line in by_index.items():
+            self.assertEqual(line["filename"], f"strip-{index}.png")
+        self.assertEqual(by_index[2]["error"], "Tesseract crashed")
+        for index in (0, 1, 3):
+            self.assertIn("Dolo-650", [m["brand_name"] for m in by_index[index]["medicines"]])
+
+    def test_repeated_images_are_served_from_the_cache(self):
+        images = self.images(2)
+        with mock.patch.object(services, "ocr_text", return_value="Dolo 650 tablet") as ocr_text:
+            first = self.post(images)
+            second = self.post(images)
+        self.assertEqual(ocr_text.call_count, 2)
+        # Cached results stream out in upload order, before any OCR
+        self.assertEqual([line.get("index") for line in second], [0, 1, None])
+        self.assertEqual(
+            sorted(first[:-1], key=lambda line: line["index"]),
+            sorted(second[:-1], key=lambda line: line["index"]),
+        )
+
+    def test_dead_worker_is_retried_on_a_new_pool(self):
+        # A dead worker fails its image, then the pool refuses new work
+        failed = Future()
+        failed.set_exception(BrokenProcessPool("A worker died"))
+        dead = mock.Mock()
+        dead.submit.side_effect = [failed, BrokenProcessPool("A worker died")]
+        self.pool.side_effect = [dead, thread_pool(1)]
+        with mock.patch.object(services, "ocr_text", return_value="Dolo 650 tablet"):
+            lines = self.post(self.images(1))
+        self.assertEqual(lines[0]["index"], 0)
+        self.assertIn("Dolo-650", [m["brand_name"] for m in lines[0]["medicines"]])
+        self.assertEqual(lines[-1], {"done": True, "count": 1})
+
+    @override_settings(OCR_BATCH_WORKERS=None, OCR_PASS_WORKERS=3)
+    def test_pool_size_leaves_room_for_passes(self):
+        with mock.patch.object(os, "cpu_count", return_value=12):
+            self.assertEqual(jobs.batch_workers(), 4)
+        with mock.patch.object(os, "cpu_count", return_value=2):
+            self.assertEqual(jobs.batch_workers(), 1)
+
+
+class UploadTests(SimpleTestCase):
+    """Uploads are size-capped while parsing, sniffed by magic bytes and read without copies."""
+
+    PNG = cv2.imencode(".png", np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+
+    @override_settings(MAX_UPLOAD_SIZE=1024)
+    def test_oversized_upload_is_cut_off(self):
+        # Only the upload handler answers 413; a rejected serializer gives 400
+        upload = SimpleUploadedFile("big.png", self.PNG + bytes(4096), "image/png")
+        response = self.client.post("/api/ocr/", {"image": upload})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["error"], "image_too_large")
+
+    def test_formats_are_sniffed_from_magic_bytes(self):
+        self.assertEqual(uploads.sniff_image_type(self.PNG[:16]), "png")
+        self.assertEqual(uploads.sniff_image_type(b"\xff\xd8\xff\xe0" + bytes(12)), "jpeg")
+        self.assertEqual(uploads.sniff_image_type(b"RIFF\0\0\0\0WEBPVP8 "), "webp")
+        self.assertIsNone(uploads.sniff_image_type(b"%PDF-1.7"))
+
+        # The name and content type don't matter, only the bytes
+        response = self.client.post("/api/ocr/", {"image": SimpleUploadedFile("scan.png", b"%PDF-1.7\n", "image/png")})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("valid image", json.dumps(response.json()))
+        with self.assertRaises(uploads.UploadError):
+            uploads.validate_upload(SimpleUploadedFile("empty.png", b"", "image/png"))
+        uploads.validate_upload(SimpleUploadedFile("photo.txt", self.PNG, "text/plain"))
+
+    def test_in_memory_upload_is_a_view(self):
+        upload = InMemoryUploadedFile(
+            BytesIO(self.PNG), "image", "a.png", "image/png", len(self.PNG), None
+        )
+        data = uploads.read_upload(upload)
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(bytes(data), self.PNG)
+
+    def test_temporary_upload_is_memory_mapped(self):
+        upload = TemporaryUploadedFile("a.png", "image/png", len(self.PNG), None)
+        self.addCleanup(upload.close)
+        upload.write(self.PNG)
+        upload.flush()
+        data = uploads.read_upload(upload)
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(data.tobytes(), self.PNG)
+        self.assertEqual(ocr_utils.decode_image(data).shape, (8, 8, 3))
+
+
+class DebugTraceTests(SimpleTestCase):
+    """?debug=1 returns the OCR trace and never reads or fills the result cache."""
+
+    def setUp(self):
+        resolver.reset_catalog()
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        self.data = cv2.imencode(".png", image)[1].tobytes()
+
+    def post(self, query=""):
+        upload = SimpleUploadedFile("strip.png", self.data, "image/png")
+        response = self.client.post(f"/api/process-strip/{query}", {"image": upload})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_trace_contents(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.object(ocr_engine, "recognize", return_value=("Dolo 650 tablet", 95.0)), \
+                override_settings(OCR_DEBUG_DIR=directory):
+            trace = self.post("?debug=1")["debug"]
+        self.assertEqual(trace["stages"], ["grayscale", "adaptive_threshold", "dilate"])
+        self.assertEqual(trace["passes"][0], {"name": "psm6", "confidence": 95.0, "chars": 15})
+        self.assertEqual(trace["texts"]["psm6"], "Dolo 6SO tablet")
+        self.assertTrue({"decode", "grayscale", "ocr"} <= set(trace["timings"]))
+        debug._writer.submit(lambda: None).result()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(directory, trace["trace_id"]))),
+            ["adaptive_threshold.png", "dilate.png", "grayscale.png"],
+        )
+
+    def test_traced_requests_bypass_the_cache(self):
+        with mock.patch.object(ocr_engine, "recognize", return_value=("Dolo 650 tablet", 95.0)) as recognize:
+            self.post("?debug=1")
+            self.post("?debug=1")
+            traced = recognize.call_count
+            # A traced result wasn't cached, so the first plain request runs OCR...
+            self.post()
+            untraced = recognize.call_count - traced
+            # ...and its cached result isn't served to a traced request
+            self.post()
+            self.assertEqual(recognize.call_count, traced + untraced)
+            self.assertIn("debug", self.post("?debug=1"))
+        self.assertGreater(traced, 1)
+        self.assertGreater(untraced, 0)
+        self.assertGreater(recognize.call_count, traced + untraced)
+
+
+class ResultCacheTests(SimpleTestCase):
+    """Results are cached by content and settings, and the LRU stays within its byte budget."""
+
+    def setUp(self):
+        cache.reset_cache()
+        self.addCleanup(cache.reset_cache)
+
+    def test_keys(self):
+        key = cache.make_key("ocr", b"image", 5, "standard")
+        self.assertEqual(cache.make_key("ocr", memoryview(b"image"), 5, "standard"), key)
+        self.assertNotEqual(cache.make_key("ocr", b"other", 5, "standard"), key)
+        self.assertNotEqual(cache.make_key("strip", b"image", 5, "standard"), key)
+        self.assertNotEqual(cache.make_key("ocr", b"image", 6, "standard"), key)
+
+        strip = services._result_key("strip", b"image")
+        with mock.patch.object(services, "PIPELINE_VERSION", -1):
+            self.assertNotEqual(services._result_key("strip", b"image"), strip)
+        with override_settings(OCR_PIPELINES={"strip": "fast"}):
+            self.assertNotEqual(services._result_key("strip", b"image"), strip)
+        with mock.patch.object(services, "catalog_version", return_value="edited"):
+            self.assertNotEqual(services._result_key("strip", b"image"), strip)
+            self.assertEqual(services._result_key("ocr", b"image"), services._result_key("ocr", b"image"))
+
+    def test_lru_evicts_least_recently_used_by_size(self):
+        lru = cache.LRUCache(max_bytes=30)
+        for key in "abc":
+            lru.set(key, key.upper(), 10)
+        self.assertEqual(lru.get("a"), "A")
+        lru.set("d", "D", 10)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual([lru.get(key) for key in "acd"], ["A", "C", "D"])
+        self.assertEqual((lru.size, len(lru)), (30, 3))
+        # Replacing an entry re-counts its size; one over budget is never stored
+        lru.set("a", "AA", 20)
+        self.assertEqual((lru.size, len(lru)), (30, 2))
+        lru.set("e", "E", 31)
+        self.assertIsNone(lru.get("e"))
+        self.assertEqual((lru.hits, lru.misses), (4, 2))
+
+    def test_shared_hits_fill_the_local_cache(self):
+        shared = mock.Mock()
+        shared.get.return_value = {"raw_text": "Dolo"}
+        results = cache.ResultCache(1024, shared=shared, timeout=60)
+        self.assertEqual(results.get("k"), {"raw_text": "Dolo"})
+        self.assertEqual(results.get("k"), {"raw_text": "Dolo"})
+        shared.get.assert_called_once_with("k")
+        # A failing shared cache is a miss, not an error
+        shared.get.side_effect = ConnectionError()
+        self.assertIsNone(results.get("other"))
+        results.set("other", {"raw_text": "Crocin"})
+        shared.set.assert_called_once_with("other", {"raw_text": "Crocin"}, 60)
+
+    def test_repeat_uploads_are_served_from_the_cache(self):
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        data = cv2.imencode(".png", image)[1].tobytes()
+        with mock.patch.object(ocr_engine, "recognize", return_value=("", 0.0)) as recognize:
+            services.process_ocr(data)
+            calls = recognize.call_count
+            # Empty text may be a transient failure, so it isn't cached
+            services.process_ocr(data)
+            self.assertEqual(recognize.call_count, 2 * calls)
+            recognize.return_value = ("Dolo 650", 95.0)
+            self.assertEqual(services.process_ocr(data), {"raw_text": "Dolo 6SO"})
+            calls = recognize.call_count
+            self.assertEqual(services.process_ocr(data), {"raw_text": "Dolo 6SO"})
+            self.assertEqual(recognize.call_count, calls)
+        with override_settings(OCR_CACHE_MAX_BYTES=0):
+            cache.reset_cache()
+            self.assertIsNone(cache.get_cache())
+
+
+class StageTimingTests(SimpleTestCase):
+    """Every preprocessing/OCR stage is timed per call and aggregated per process."""
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        image = np.random.randint(0, 255, (60, 200, 3), dtype=np.uint8)
+        self.data = cv2.imencode(".png", image)[1].tobytes()
+
+    def test_stages_are_timed(self):
+        timings = {}
+        with mock.patch.object(ocr_engine, "recognize", return_value=("Dolo 650", 95.0)):
+            ocr_utils.ocr_image_bytes(self.data, pipeline="strip", timings=timings)
+            ocr_utils.ocr_image_bytes(self.data, pipeline="strip")
+        self.assertEqual(list(timings), ["decode", "grayscale", "adaptive_threshold", "ocr"])
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+
+        response = self.client.get("/api/stage-timings/")
+        self.assertEqual(response.status_code, 200)
+        stages = {
+            entry["labels"]["stage"]: entry for entry in response.json()["stages"]
+            if entry["name"] == "ocr_stage_seconds" and entry["labels"]["pipeline"] == "strip"
+        }
+        self.assertEqual(set(stages), set(timings))
+        for stage, entry in stages.items():
+            self.assertEqual(entry["count"], 2)
+            self.assertGreaterEqual(entry["max"], timings[stage])
+            self.assertAlmostEqual(entry["mean"], entry["total"] / 2)
@@ -0,0 +1,105 @@
+# api/uploads.py
+"""
+Upload ingestion: size limits, cheap format checks and zero-copy reads.
+
+``SizeLimitUploadHandler`` stops parsing a multipart body as soon as a file
+grows past ``MAX_UPLOAD_SIZE``, so oversized uploads are never buffered.
+``validate_upload`` rejects non-images from their first bytes instead of a
+full PIL decode, and ``read_upload`` exposes the stored upload as a buffer
+(a view of the in-memory file, or a memory map of the temporary file) that
+OpenCV can decode without intermediate copies.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+# Leading bytes of the image formats OpenCV can decode for us
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+]
+
+class UploadError(Exception):
+    """An upload was rejected; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def max_upload_size():
+    return getattr(settings, "MAX_UPLOAD_SIZE", 10 * 1024 * 1024)
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """
+    Abort multipart parsing once any uploaded file exceeds MAX_UPLOAD_SIZE.
+
+    Must come first in FILE_UPLOAD_HANDLERS; it passes chunks through to
+    the storing handlers and marks the request with ``upload_too_large``.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_upload_size():
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+def sniff_image_type(header):
+    """Image format named by the leading bytes ``header``, or None."""
+    for signature, kind in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return kind
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def validate_upload(uploaded_file):
+    """
+    Check an uploaded file's size and format without reading it all.
+
+    Raises:
+        UploadError: if it is empty, too large or not a supported image
+    """
+    if uploaded_file.size > max_upload_size():
+        raise UploadError(
+            f"Image too large. Maximum size is {max_upload_size() // (1024 * 1024)}MB.",
+            status=413
+        )
+    uploaded_file.seek(0)
+    header = uploaded_file.read(16)
+    uploaded_file.seek(0)
+    if not header:
+        raise UploadError("The submitted file is empty.")
+    if sniff_image_type(header) is None:
+        raise UploadError("Upload a valid image (JPEG, PNG, GIF, BMP, TIFF or WebP).")
+
+def read_upload(uploaded_file):
+    """
+    Return the upload's contents as a read-only buffer without copying.
+
+    Temporary (on-disk) uploads are memory-mapped and in-memory uploads are
+    exposed as a view of their buffer. Either can be passed wherever image
+    bytes are expected (``np.frombuffer``, hashing); call ``bytes()`` on it
+    only where a real copy is needed, e.g. to send it to another process.
+    """
+    if hasattr(uploaded_file, "temporary_file_path"):
+        if uploaded_file.size == 0:
+            return b""
+        return np.memmap(uploaded_file.temporary_file_path(), dtype=np.uint8, mode="r")
+    inner = getattr(uploaded_file, "file", None)
+    if hasattr(inner, "getbuffer"):
+        return inner.getbuffer()[:uploaded_file.size]
+    uploaded_file.seek(0)
+    return uploaded_file.read()
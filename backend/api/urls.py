@@ -1,11 +1,34 @@
 # api/urls.py
+from django.conf import settings
 from django.urls import path
-from .views import OCRView, ResolveView, StripProcessView, PrescriptionProcessView, debug_ocr
+from . import async_views
+from .views import OCRView, ResolveView, SuggestView, StripProcessView, PrescriptionProcessView, BatchProcessView, JobStatusView, debug_ocr, stage_timings, prometheus_metrics, profile_list, profile_download, catalog_info, catalog_reload
+
+# Under ASGI the OCR endpoints are served by their async versions
+if settings.ASYNC_VIEWS:
+    ocr = async_views.ocr
+    process_strip = async_views.process_strip
+    process_prescription = async_views.process_prescription
+    process_batch = async_views.process_batch
+else:
+    ocr = OCRView.as_view()
+    process_strip = StripProcessView.as_view()
+    process_prescription = PrescriptionProcessView.as_view()
+    process_batch = BatchProcessView.as_view()
 
 urlpatterns = [
-    path("ocr/", OCRView.as_view(), name="ocr"),
+    path("ocr/", ocr, name="ocr"),
     path("resolve/", ResolveView.as_view(), name="resolve"),
-    path("process-strip/", StripProcessView.as_view(), name="process-strip"),
-    path("process-prescription/", PrescriptionProcessView.as_view(), name="process-prescription"),
+    path("suggest/", SuggestView.as_view(), name="suggest"),
+    path("process-strip/", process_strip, name="process-strip"),
+    path("process-prescription/", process_prescription, name="process-prescription"),
+    path("process-batch/", process_batch, name="process-batch"),
+    path("jobs/<str:job_id>/", JobStatusView.as_view(), name="job-status"),
     path("debug-ocr/", debug_ocr, name="debug-ocr"),
+    path("stage-timings/", stage_timings, name="stage-timings"),
+    path("metrics/", prometheus_metrics, name="metrics"),
+    path("profiles/", profile_list, name="profiles"),
+    path("profiles/<str:profile_id>/", profile_download, name="profile-download"),
+    path("catalog/", catalog_info, name="catalog"),
+    path("catalog/reload/", catalog_reload, name="catalog-reload"),
 ]
@@ -2,166 +2,279 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.decorators import api_view
-from .serializers import OCRSerializer
-from .ocr_utils import ocr_image_bytes, ocr_strip_image
-from .resolver import fuzzy_lookup, extract_medicines_from_text
-import io
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from .serializers import OCRSerializer, BatchOCRSerializer
+from .ocr_utils import decode_image, ocr_image_bytes
+from .uploads import UploadError, read_upload, validate_upload
+from .resolver import catalog_version, fuzzy_lookup, get_catalog, reload_catalog, suggest
+from .debug import TRUTHY, OCRTrace, debug_requested
+from .services import format_prescription, process_ocr, process_strip, process_prescription, process_batch
+from .jobs import QueueFull, async_requested, get_manager, get_batch_executor
+from .profiling import PROFILE_FILES, get_ring
+from . import metrics, ocr_engine
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Body of the 503 sent when OCR work can't be queued
+QUEUE_FULL = {"error": "queue_full", "detail": "Too many images are being processed, retry shortly"}
+QUEUE_FULL_HEADERS = {"Retry-After": "5"}
+
+def upload_error(request, errors):
+    """``(payload, status)`` for a rejected upload: 413 if the upload handler cut off an oversized file, else 400."""
+    if getattr(request, "upload_too_large", False):
+        return (
+            {"error": "image_too_large", "detail": f"Maximum upload size is {settings.MAX_UPLOAD_SIZE} bytes"},
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    return errors, status.HTTP_400_BAD_REQUEST
+
+def job_submission(kind, bytes_data):
+    """Queue ``bytes_data`` as a background job; ``(payload, status, headers)`` to respond with."""
+    try:
+        job_id = get_manager().submit(kind, bytes_data)
+    except QueueFull:
+        return QUEUE_FULL, status.HTTP_503_SERVICE_UNAVAILABLE, QUEUE_FULL_HEADERS
+    return (
+        {"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}/"},
+        status.HTTP_202_ACCEPTED,
+        None
+    )
+
+def invalid_upload(request, errors):
+    """400 with ``errors``, or 413 if the upload handler cut off an oversized file."""
+    payload, code = upload_error(request, errors)
+    return Response(payload, status=code)
+
+def submit_job(kind, bytes_data):
+    """Queue ``bytes_data`` as a background job and return a 202 with its id."""
+    payload, code, headers = job_submission(kind, bytes_data)
+    return Response(payload, status=code, headers=headers)
 
 @api_view(['POST'])
 def debug_ocr(request):
     """Debug endpoint to view raw OCR output"""
     if 'image' not in request.FILES:
-        return Response({"error": "No image provided"}, status=status.HTTP_400_BAD_REQUEST)
+        return invalid_upload(request, {"error": "No image provided"})
     
     img = request.FILES['image']
-    bytes_data = img.read()
+    try:
+        validate_upload(img)
+    except UploadError as e:
+        return Response({"error": str(e)}, status=e.status)
+    bytes_data = read_upload(img)
     
     try:
-        # Get raw OCR output
-        raw_text = ocr_image_bytes(bytes_data)
+        # Get raw OCR output, keeping intermediate stages
+        trace = OCRTrace()
+        raw_text = ocr_image_bytes(bytes_data, trace=trace)
         
-        # Try to extract medicines
-        medicines = extract_medicines_from_text(raw_text)
+        # Try to extract medicines and match them to the catalog
+        medicines = format_prescription(raw_text)["medicines"]
         
         return Response({
             "success": True,
             "raw_text": raw_text,
             "medicines": medicines,
+            "debug": trace.as_dict(),
             "message": f"Found {len(medicines)} medicines" if medicines else "No medicines found"
         })
     except Exception as e:
-        print(f"Error in debug_ocr: {str(e)}")
+        logger.exception("Error in debug_ocr")
         return Response({
             "success": False,
             "error": str(e),
             "message": "Failed to process image"
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+def stage_timings(request):
+    """Aggregated per-stage preprocessing and OCR wall times for this process"""
+    return Response({"stages": metrics.snapshot()})
+
+@require_GET
+def prometheus_metrics(request):
+    """This process's metrics in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """The slowest sampled request profiles kept on disk, slowest first"""
+    return Response({"profiles": [
+        {
+            **{key: value for key, value in entry.items() if key != "top"},
+            "downloads": {fmt: f"/api/profiles/{entry['id']}/?file={fmt}" for fmt in PROFILE_FILES},
+        }
+        for entry in get_ring().entries()
+    ]})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_download(request, profile_id):
+    """One saved profile: ?file=prof (pstats, the default), stacks (collapsed) or json"""
+    fmt = request.query_params.get("file", "prof")
+    path = get_ring().path(profile_id, fmt)
+    if path is None:
+        return Response({"error": "not_found"}, status=status.HTTP_404_NOT_FOUND)
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=os.path.basename(path))
+
+def catalog_state():
+    state = {"source": settings.CATALOG_SOURCE, "version": catalog_version()}
+    if settings.CATALOG_SOURCE == "csv":
+        state["size"] = len(get_catalog())
+    return state
+
+@api_view(['GET'])
+def catalog_info(request):
+    """Version and size of the catalog this process resolves against"""
+    return Response(catalog_state())
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def catalog_reload(request):
+    """Rebuild the CSV catalog now instead of waiting for the mtime check"""
+    if settings.CATALOG_SOURCE == "csv":
+        reload_catalog(wait=True)
+    return Response(catalog_state())
+
 class OCRView(APIView):
     def post(self, request):
         ser = OCRSerializer(data=request.data)
         if not ser.is_valid():
-            return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+            return invalid_upload(request, ser.errors)
         img = ser.validated_data["image"]
-        bytes_data = img.read()
+        bytes_data = read_upload(img)
+        if async_requested(request):
+            return submit_job("ocr", bytes_data)
+        trace = OCRTrace() if debug_requested(request) else None
         try:
-            text = ocr_image_bytes(bytes_data)
+            response = dict(process_ocr(bytes_data, trace=trace))
         except Exception as e:
             return Response({"error":"ocr_failed", "detail": str(e)}, status=500)
-        return Response({"raw_text": text})
+        if trace is not None:
+            response["debug"] = trace.as_dict()
+        return Response(response)
 
 class ResolveView(APIView):
     def post(self, request):
         text = request.data.get("text", "")
         if not text:
             return Response({"error":"no_text"}, status=400)
+        version = catalog_version()
         matches = fuzzy_lookup(text)
         # return top match as primary
-        return Response({"matches": matches})
+        return Response({"matches": matches, "catalog_version": version})
+
+class SuggestView(APIView):
+    """
+    Typeahead over brand names, generics and aliases.
+
+    ``q`` is the text typed so far; ``limit`` caps the suggestions (default
+    10, at most 50) and ``fuzzy=1`` tops them up with fuzzy matches.
+    """
+
+    def get(self, request):
+        text = request.query_params.get("q", "")
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 50)
+        except ValueError:
+            return Response({"error": "invalid_limit"}, status=400)
+        fuzzy = request.query_params.get("fuzzy", "").lower() in TRUTHY
+        return Response({
+            "suggestions": suggest(text, limit=limit, fuzzy=fuzzy),
+            "catalog_version": catalog_version(),
+        })
 
 class StripProcessView(APIView):
     def post(self, request):
         ser = OCRSerializer(data=request.data)
         if not ser.is_valid():
-            return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+            return invalid_upload(request, ser.errors)
         
         img = ser.validated_data["image"]
-        bytes_data = img.read()
+        bytes_data = read_upload(img)
+        
+        if async_requested(request):
+            return submit_job("strip", bytes_data)
+        
+        trace = OCRTrace() if debug_requested(request) else None
         
         try:
-            # First perform OCR on the strip image
-            text = ocr_image_bytes(bytes_data)
-            print(f"Debug - OCR Result: {text}")
-            
-            # Clean up the text
-            text = re.sub(r'[^\w\s\-\+\/\.]', ' ', text)  # Keep basic punctuation
-            text = text.replace('\n', ' ')  # Convert newlines to spaces
-            text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
-            print(f"Debug - Cleaned text: {text}")
-            
-            # Try different text segmentation approaches
-            all_matches = []
-            
-            # 1. Try word groups (3-4 words at a time)
-            words = text.split()
-            for i in range(len(words)):
-                for j in range(i+1, min(i+5, len(words)+1)):
-                    segment = ' '.join(words[i:j])
-                    if len(segment) >= 3:  # Only try segments of reasonable length
-                        matches = fuzzy_lookup(segment, min_confidence=45)
-                        if matches:
-                            all_matches.extend(matches)
-                            
-            # 2. Try individual words that look like medicine names
-            for word in words:
-                if (len(word) >= 4 and  # Only try words of reasonable length
-                    not any(c.isdigit() for c in word) and  # Skip numbers
-                    not word.lower() in {'tablet', 'strip', 'mg', 'ml'}):  # Skip common non-medicine words
-                    matches = fuzzy_lookup(word, min_confidence=70)  # Higher confidence for single words
-                    if matches:
-                        all_matches.extend(matches)
-            
-            # Remove duplicates while preserving order
-            seen = set()
-            unique_matches = []
-            for match in all_matches:
-                if match['brand_name'] not in seen:
-                    seen.add(match['brand_name'])
-                    unique_matches.append(match)
-            
-            return Response({
-                "raw_text": text,
-                "medicines": unique_matches
-            })
+            # OCR the strip image and resolve it against the catalog
+            response = dict(process_strip(bytes_data, trace=trace))
+            if trace is not None:
+                response["debug"] = trace.as_dict()
+            return Response(response)
             
         except Exception as e:
-            print(f"Debug - Error processing: {str(e)}")
+            logger.exception("Error processing strip")
             return Response(
                 {"error": "processing_failed", "detail": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+def batch_lines(kind, names, images):
+    """NDJSON lines for a batch: one per image as it finishes, then a done line."""
+    for index, payload in process_batch(kind, images, get_batch_executor()):
+        line = {"index": index, "filename": names[index], **payload}
+        yield json.dumps(line, default=str) + "\n"
+    yield json.dumps({"done": True, "count": len(images)}) + "\n"
+
+class BatchProcessView(APIView):
+    """
+    Process many images from one multipart request (repeated ``images``
+    fields, plus ``kind``: strip, prescription or ocr).
+
+    Streams one NDJSON line per image as it finishes, carrying its upload
+    ``index`` and ``filename``, then a final ``{"done": true}`` line.
+    """
+
+    def post(self, request):
+        ser = BatchOCRSerializer(data=request.data)
+        if not ser.is_valid():
+            return invalid_upload(request, ser.errors)
+        
+        files = ser.validated_data["images"]
+        lines = batch_lines(ser.validated_data["kind"], [img.name for img in files], [read_upload(img) for img in files])
+        return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+class JobStatusView(APIView):
+    def get(self, request, job_id):
+        state = get_manager().status(job_id)
+        if state is None:
+            return Response({"error": "job_not_found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(state)
+
 class PrescriptionProcessView(APIView):
     def post(self, request):
         ser = OCRSerializer(data=request.data)
         if not ser.is_valid():
-            return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+            return invalid_upload(request, ser.errors)
         
         img = ser.validated_data["image"]
-        bytes_data = img.read()
+        bytes_data = read_upload(img)
+        
+        if async_requested(request):
+            return submit_job("prescription", bytes_data)
+        
+        trace = OCRTrace() if debug_requested(request) else None
         
         try:
-            # First perform OCR on the prescription image
-            text = ocr_image_bytes(bytes_data)
-            print(f"Debug - Prescription OCR Result: {text}")
-            
-            # Extract and match medicines from the text
-            medicines = extract_medicines_from_text(text)
-            
-            # Format the response with required fields
-            formatted_medicines = []
-            for med in medicines:
-                formatted_med = {
-                    'brand_name': med.get('brand_name', 'Unknown'),
-                    'generic': med.get('generic', ''),
-                    'prescribed_dosage': med.get('strength', ''),
-                    'prescribed_timing': med.get('frequency', ''),
-                    'uses': med.get('therapeutic_class', ''),
-                    'side_effects': med.get('side_effects', ''),
-                    'match_score': med.get('match_score', 0.0)
-                }
-                formatted_medicines.append(formatted_med)
-            
-            return Response({
-                "success": True,
-                "raw_text": text,
-                "medicines": formatted_medicines,
-                "message": f"Found {len(formatted_medicines)} medicines" if formatted_medicines else "No medicines found"
-            })
+            # OCR the prescription image and extract the medicines
+            response = dict(process_prescription(bytes_data, trace=trace))
+            if trace is not None:
+                response["debug"] = trace.as_dict()
+            return Response(response)
             
         except Exception as e:
-            print(f"Debug - Error processing prescription: {str(e)}")
+            logger.exception("Error processing prescription")
             return Response(
                 {"error": "processing_failed", "detail": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -170,9 +283,7 @@ class PrescriptionProcessView(APIView):
 
 import cv2
 import numpy as np
-import pytesseract
 import re
-from PIL import Image
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
@@ -180,11 +291,14 @@ from rest_framework.response import Response
 def ocr_view(request):
     file = request.FILES.get("image")
     if not file:
-        return Response({"error": "No image provided"}, status=400)
+        return invalid_upload(request, {"error": "No image provided"})
+    try:
+        validate_upload(file)
+    except UploadError as e:
+        return Response({"error": str(e)}, status=e.status)
 
-    # Convert to OpenCV image
-    img = Image.open(file).convert("RGB")
-    img = np.array(img)
+    # Decode straight from the upload buffer into an OpenCV image
+    img = decode_image(read_upload(file))
 
     # Convert to grayscale
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -204,7 +318,7 @@ def ocr_view(request):
     # OCR
     # Use a more flexible OCR configuration
     custom_config = r'--oem 3 --psm 6 -c preserve_interword_spaces=1'
-    text = pytesseract.image_to_string(sharp, config=custom_config)
+    text = ocr_engine.image_to_string(sharp, config=custom_config)
     
     # Clean up common OCR artifacts
     text = re.sub(r'[^\w\s\-\+\/\n\.]', ' ', text)  # Keep only alphanumeric, basic punctuation
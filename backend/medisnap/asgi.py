@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medisnap.settings')
+# Serve the OCR endpoints with the async views (see api.async_views)
+os.environ.setdefault('MEDISNAP_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,115 @@ MEDIA_ROOT = BASE_DIR / 'media'
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = None  # Let Django handle large files
 
+# Stop reading any uploaded file past MAX_UPLOAD_SIZE before it is buffered
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# OCR debug tracing: off by default, or enable per request with ?debug=1.
+# When OCR_DEBUG_DIR is set, traced intermediate images are written there
+# (one subdirectory per request) on a background thread.
+OCR_DEBUG = False
+OCR_DEBUG_DIR = None
+
+# OCR engine: "tesserocr" (persistent in-process handles, one per thread),
+# "pytesseract" (spawns the tesseract CLI per call) or "auto" to prefer
+# tesserocr when it is installed.
+OCR_BACKEND = 'auto'
+OCR_LANG = 'eng'
+
+# Preprocessing pipeline (see api.ocr_utils.PIPELINES) used per endpoint.
+# Per-stage wall times are aggregated at /api/stage-timings/ and returned
+# per request under "debug" when tracing. 'fast' is a cheaper take on 'full'
+# that also caps images at 2000px a side; switch an endpoint to it only once
+# the benchmark shows equal accuracy, the highres variant included.
+OCR_PIPELINES = {
+    'ocr': 'standard',
+    'strip': 'standard',
+    'prescription': 'standard',
+}
+
+# Endpoints whose images are cropped to detected text regions before OCR,
+# so Tesseract only reads the text and not foil, background or glare.
+# Falls back to whole-image passes when no text regions are found.
+# Opt-in (e.g. ['strip']) until the benchmark accuracy numbers show that
+# cropping doesn't lose text compared to the whole-image passes.
+OCR_TEXT_REGIONS = []
+
+# OCR pass scheduling: the PSM 6, PSM 4 and plain passes run concurrently on
+# OCR_PASS_WORKERS threads. The first result with mean Tesseract confidence
+# >= OCR_PASS_MIN_CONFIDENCE wins and the rest are dropped; no pass may take
+# longer than OCR_PASS_TIMEOUT seconds.
+OCR_PASS_WORKERS = 3
+OCR_PASS_MIN_CONFIDENCE = 75
+OCR_PASS_TIMEOUT = 20
+
+# Request latency per view, OCR pass/fallback counts, cache hit ratio and
+# catalog lookups per request are collected in-process by
+# api.middleware.MetricsMiddleware and served at /api/metrics/ in the
+# Prometheus text format (one set of numbers per process).
+
+# Sampled profiling (api.profiling): PROFILE_SAMPLE_RATE of the requests
+# under PROFILE_PATHS run under cProfile plus a stack sampler (every
+# PROFILE_STACK_INTERVAL seconds). The PROFILE_KEEP slowest are kept in
+# PROFILE_DIR (None = BASE_DIR/profiles) for admins to download from
+# /api/profiles/. Off (and the middleware not installed) at rate 0.
+PROFILE_SAMPLE_RATE = float(os.environ.get('MEDISNAP_PROFILE_SAMPLE_RATE', 0))
+PROFILE_PATHS = ['/api/process-']
+PROFILE_STACK_INTERVAL = 0.01
+PROFILE_KEEP = 20
+PROFILE_DIR = None
+
+# Content-hash cache of OCR text and resolved medicines. Results are kept in
+# a per-process LRU of up to OCR_CACHE_MAX_BYTES (0 disables caching); set
+# OCR_CACHE_SHARED to an alias in CACHES (e.g. a DatabaseCache) to share them
+# between workers.
+OCR_CACHE_MAX_BYTES = 64 * 1024 * 1024
+OCR_CACHE_SHARED = None
+OCR_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Submit/poll mode (?async=1 on the OCR endpoints). Jobs run on a pool of
+# OCR_JOB_WORKERS processes; once OCR_JOB_QUEUE_SIZE jobs are queued or
+# running, new submissions get a 503. Job state lives in the OCR_JOB_CACHE
+# cache for OCR_JOB_TTL seconds, which must be shared between web workers
+# (check api.W001 warns if it is process-local).
+OCR_JOB_WORKERS = 2
+OCR_JOB_QUEUE_SIZE = 16
+OCR_JOB_CACHE = 'jobs'
+OCR_JOB_TTL = 60 * 60
+
+# Async OCR/strip/prescription/batch views, on by default when served through
+# medisnap.asgi. Their pipelines run on OCR_ASYNC_WORKERS threads; once
+# OCR_ASYNC_QUEUE_SIZE images are queued or running, requests get a 503.
+ASYNC_VIEWS = os.environ.get('MEDISNAP_ASYNC_VIEWS') == '1'
+OCR_ASYNC_WORKERS = 4
+OCR_ASYNC_QUEUE_SIZE = 16
+
+# Multi-image endpoint (/api/process-batch/): at most OCR_BATCH_MAX_IMAGES
+# per request, OCR'd on OCR_BATCH_WORKERS processes. Each runs its passes on
+# OCR_PASS_WORKERS threads, so None means CPUs // OCR_PASS_WORKERS.
+OCR_BATCH_MAX_IMAGES = 20
+OCR_BATCH_WORKERS = None
+
+# Where medicine lookups get their catalog: "csv" keeps the whole of
+# api/seed_data/medicines.csv in memory in every process; "db" fetches only
+# the candidate rows for each lookup from the Medicine table (load it with
+# `python manage.py import_medicines`).
+CATALOG_SOURCE = 'csv'
+
+# Prescription medicine extraction: "regex" (hand-written patterns), "ner"
+# (the spaCy model trained into NER_MODEL_PATH by api/ml/train_ner.py;
+# None = api/ml/ner_model) or "auto" to prefer the model when spaCy and a
+# trained model are available. The model is loaded once per process, at
+# first use or at startup with PRESCRIPTION_EXTRACTOR_WARMUP; multi-image
+# requests run NER_BATCH_SIZE texts per nlp.pipe batch.
+PRESCRIPTION_EXTRACTOR = 'regex'
+PRESCRIPTION_EXTRACTOR_WARMUP = False
+NER_MODEL_PATH = None
+NER_BATCH_SIZE = 32
+
 
 # Application definition
 
@@ -53,9 +163,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'corsheaders',
     'rest_framework',
+    'api',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -104,6 +217,50 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# 'jobs' holds ?async=1 job state (OCR_JOB_CACHE). It is file based so every
+# web worker on the host can answer a poll; point it at memcached or redis
+# when workers run on more than one host.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'jobs',
+    },
+}
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -159,6 +159,12 @@ export default function PrescriptionUpload() {
                         <h3 className="text-lg font-semibold text-blue-700 mb-2">
                           {medicine.brand_name}
                         </h3>
+
+                        {medicine.in_catalog === false && (
+                          <div className="mb-2 p-2 bg-yellow-50 rounded text-sm text-yellow-700">
+                            Not found in our medicine database. Check the name with your pharmacist.
+                          </div>
+                        )}
                         
                         {medicine.generic && (
                           <div className="mb-2">
@@ -28,20 +28,42 @@ API.interceptors.request.use(
   }
 );
 
-export const processStrip = async (file) => {
-  const formData = new FormData();
-  formData.append('image', file);
-  const response = await API.post('/api/process-strip/', formData);
-  return response.data;
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Poll a background OCR job until it finishes and return its result
+const waitForJob = async (statusUrl, { interval = 1000, timeout = 120000 } = {}) => {
+  const deadline = Date.now() + timeout;
+  while (Date.now() < deadline) {
+    const { data } = await API.get(statusUrl);
+    if (data.status === 'done') {
+      return data.result;
+    }
+    if (data.status === 'failed') {
+      throw new Error(data.error || 'Processing failed');
+    }
+    await sleep(interval);
+  }
+  throw new Error('Processing is taking too long. Please try again.');
 };
 
-export const processPrescription = async (file) => {
+// Submit an image and return its result. Requests are synchronous: job
+// state is only shared between backend workers when OCR_JOB_CACHE is a
+// shared cache, so job mode (?async=1) is opt-in through `jobs`. A 202
+// answer is polled until the job finishes.
+const submitImage = async (url, file, { jobs = false } = {}) => {
   const formData = new FormData();
   formData.append('image', file);
-  const response = await API.post('/api/process-prescription/', formData);
+  const response = await API.post(jobs ? `${url}?async=1` : url, formData);
+  if (response.status === 202) {
+    return waitForJob(response.data.status_url);
+  }
   return response.data;
 };
 
+export const processStrip = async (file, options) => submitImage('/api/process-strip/', file, options);
+
+export const processPrescription = async (file, options) => submitImage('/api/process-prescription/', file, options);
+
 // Add response interceptor for error handling
 API.interceptors.response.use(
   (response) => response,